@@ -0,0 +1,1559 @@
+# -*- coding: utf-8 -*-
+# @File : benchmark.py
+"""
+Stress checks and performance reports for the face recognition server.
+
+    python benchmark.py <command> --help
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+
+def gallery_stress(args):
+    """Hammer FeatureGallery with batched writers and check every reader snapshot."""
+    from src.feature_gallery import FeatureGallery
+
+    gallery = FeatureGallery()
+    stop = threading.Event()
+    errors = []
+    reads = [0] * args.readers
+    worst_read = [0.0] * args.readers
+
+    def writer(w):
+        generation = 0
+        while not stop.is_set():
+            generation += 1
+            if args.clear_every and generation % args.clear_every == 0 and w == 0:
+                gallery.clear()
+                continue
+            gallery.update({"w{}:{}".format(w, k): (w, generation) for k in range(args.batch)})
+
+    def reader(r):
+        last_version = -1
+        last_generation = {}
+        while not stop.is_set():
+            start = time.perf_counter()
+            snapshot = gallery.snapshot()
+            worst_read[r] = max(worst_read[r], time.perf_counter() - start)
+            reads[r] += 1
+
+            if snapshot.version < last_version:
+                errors.append("version went backwards: {} -> {}".format(last_version, snapshot.version))
+            last_version = snapshot.version
+
+            seen = {}
+            for w, generation in snapshot.values():
+                seen.setdefault(w, []).append(generation)
+            for w, generations in seen.items():
+                if len(generations) != args.batch or len(set(generations)) != 1:
+                    errors.append("torn batch from writer {}: generations={} keys={}".format(
+                        w, sorted(set(generations)), len(generations)))
+                    continue
+                if generations[0] < last_generation.get(w, 0):
+                    errors.append("writer {} went backwards: {} -> {}".format(
+                        w, last_generation[w], generations[0]))
+                last_generation[w] = generations[0]
+            if len(errors) > 20:
+                stop.set()
+
+    threads = [threading.Thread(target=writer, args=(w,)) for w in range(args.writers)]
+    threads += [threading.Thread(target=reader, args=(r,)) for r in range(args.readers)]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    print("writers={} readers={} batch={} seconds={}".format(
+        args.writers, args.readers, args.batch, args.seconds))
+    print("published versions: {}".format(gallery.snapshot().version))
+    print("snapshots checked:  {}".format(sum(reads)))
+    print("slowest snapshot(): {:.1f} us (includes GIL scheduling)".format(max(worst_read) * 1e6))
+    if errors:
+        for error in errors[:20]:
+            print("FAIL:", error)
+        return 1
+    print("OK: no torn or out-of-order snapshots observed")
+    return 0
+
+
+def _latency_summary(samples):
+    samples = sorted(samples)
+    return "p50 {:.2f} ms  p99 {:.2f} ms".format(
+        samples[len(samples) // 2] * 1e3, samples[int(len(samples) * 0.99) - 1] * 1e3)
+
+
+def rpc_compare(args):
+    """Round-trip latency and CPU per call: HTTP/JSON/base64 vs the Unix socket transport."""
+    import base64
+    import tempfile
+    import requests
+    from werkzeug.serving import make_server
+    import face_recognition_server_enhanced as server
+    from src.local_rpc import LocalRpcServer, LocalRpcClient
+
+    logging_level = server.logger.level
+    server.logger.setLevel("WARNING")
+    image_bytes = open(args.image, "rb").read()
+    image_b64 = base64.b64encode(image_bytes).decode()
+    encodings = [{"studentId": "S{}".format(i), "encoding": [0.0] * 128} for i in range(args.gallery)]
+    server.feature_gallery.clear()
+
+    http = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    socket_path = os.path.join(tempfile.mkdtemp(), "face.sock")
+    rpc = LocalRpcServer(socket_path, {"encode": server.encode_request,
+                                       "recognize": server.recognize_request})
+    rpc.serve_in_background()
+
+    session = requests.Session()
+    url = "http://127.0.0.1:{}".format(http.server_port)
+    client = LocalRpcClient(socket_path)
+
+    def http_call(op):
+        body = {"image": image_b64, "studentId": "S0"} if op == "encode" \
+            else {"image": image_b64, "encodings": encodings}
+        return session.post(url + "/" + op, json=body).status_code
+
+    def rpc_call(op):
+        header = {"studentId": "S0"} if op == "encode" else {"encodings": encodings}
+        return client.call(op, header, image_bytes)[1]
+
+    print("image={} ({} bytes) gallery={} calls={}".format(
+        args.image, len(image_bytes), args.gallery, args.calls))
+    for op in ("encode", "recognize"):
+        for name, call in (("http", http_call), ("unix", rpc_call)):
+            for _ in range(args.warmup):
+                call(op)
+            latencies = []
+            cpu_start = time.process_time()
+            for _ in range(args.calls):
+                start = time.perf_counter()
+                call(op)
+                latencies.append(time.perf_counter() - start)
+            cpu = (time.process_time() - cpu_start) / args.calls
+            print("{:<9} {:<4}  mean {:.2f} ms  {}  cpu/call {:.2f} ms".format(
+                op, name, sum(latencies) / len(latencies) * 1e3, _latency_summary(latencies), cpu * 1e3))
+
+    client.close()
+    rpc.shutdown()
+    rpc.server_close()
+    http.shutdown()
+    server.logger.setLevel(logging_level)
+    return 0
+
+
+def recognize_batch(args):
+    """N sequential /recognize calls vs one /recognize-batch call with the same images."""
+    import base64
+    import face_recognition_server_enhanced as server
+
+    server.logger.setLevel("WARNING")
+    client = server.app.test_client()
+    images = [base64.b64encode(open(path, "rb").read()).decode() for path in args.images]
+    probes = [images[i % len(images)] for i in range(args.batch)]
+    server.feature_gallery.clear()
+    for i in range(args.gallery):
+        client.post("/encode", json={"image": images[i % len(images)], "studentId": "S{}".format(i)})
+    encodings = [{"studentId": "S{}".format(i), "encoding": [0.0] * 128} for i in range(args.gallery)]
+
+    def sequential():
+        return [client.post("/recognize", json={"image": image, "encodings": encodings}).json
+                for image in probes]
+
+    def batched():
+        return client.post("/recognize-batch", json={"images": probes, "encodings": encodings}).json["results"]
+
+    print("batch={} gallery={} repeats={}".format(args.batch, args.gallery, args.repeats))
+    outcomes = {}
+    for name, run in (("sequential /recognize", sequential), ("/recognize-batch", batched)):
+        run()
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            outcomes[name] = [result.get("studentId") for result in run()]
+        elapsed = (time.perf_counter() - start) / args.repeats
+        print("{:<22} {:.1f} ms per batch ({:.2f} ms per image)".format(
+            name, elapsed * 1e3, elapsed * 1e3 / args.batch))
+    same = outcomes["sequential /recognize"] == outcomes["/recognize-batch"]
+    print("identical matches: {}".format(same))
+    return 0 if same else 1
+
+
+def _serve_images(paths, latency):
+    """Serve images at http://127.0.0.1:<port>/<index> after ``latency`` seconds, like a remote CDN."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    payloads = [open(path, "rb").read() for path in paths]
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            body = payloads[int(self.path.strip("/"))]
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return "http://127.0.0.1:{}".format(httpd.server_port)
+
+
+def encode_batch(args):
+    """N sequential /encode calls vs one /encode-batch call."""
+    import base64
+    import face_recognition_server_enhanced as server
+
+    server.logger.setLevel("WARNING")
+    client = server.app.test_client()
+    if args.url_latency_ms is None:
+        images = [base64.b64encode(open(path, "rb").read()).decode() for path in args.images]
+        items = [{"studentId": "S{}".format(i), "image": images[i % len(images)]} for i in range(args.count)]
+    else:
+        url = _serve_images(args.images, args.url_latency_ms / 1e3)
+        items = [{"studentId": "S{}".format(i), "image_url": "{}/{}".format(url, i % len(args.images))}
+                 for i in range(args.count)]
+
+    server.feature_gallery.clear()
+    if args.pipeline == "fused":
+        with server.anti_spoof_models.lease():
+            pass  # load the models outside the timing
+    start = time.perf_counter()
+    # Spoofs and frames without a face have no encoding in the fused pipeline
+    sequential = [client.post("/encode", json=dict(item, pipeline=args.pipeline)).json.get("encoding")
+                  for item in items]
+    sequential_time = time.perf_counter() - start
+
+    server.feature_gallery.clear()
+    if args.pipeline == "mock":
+        server.get_extract_pool().submit(int).result()  # start workers outside the timing
+    start = time.perf_counter()
+    batch = client.post("/encode-batch", json={"items": items, "pipeline": args.pipeline}).json
+    batch_time = time.perf_counter() - start
+
+    print("pipeline={} enrolments={} extract workers={}".format(
+        args.pipeline, args.count, server.ENCODE_WORKERS if args.pipeline == "mock" else 0))
+    print("sequential /encode  {:.2f} s ({:.2f} ms per image)".format(
+        sequential_time, sequential_time * 1e3 / args.count))
+    print("/encode-batch       {:.2f} s ({:.2f} ms per image)".format(
+        batch_time, batch_time * 1e3 / args.count))
+    same = sequential == [result.get("encoding") for result in batch["results"]]
+    print("identical encodings: {}  encoded: {}".format(same, batch["encoded"]))
+    return 0 if same else 1
+
+
+def _load_samples(paths):
+    import cv2
+
+    images = []
+    for path in paths:
+        image = cv2.imread(path)
+        # test() expects 3:4 portrait frames
+        images.append(cv2.resize(image, (int(image.shape[0] * 3 / 4), image.shape[0])))
+    return images
+
+
+def anti_spoof(args):
+    """Per-image liveness latency: reload-per-call (old test()) vs the load-once registry."""
+    import numpy as np
+    from src.anti_spoof_predict import AntiSpoofPredict
+    from src.generate_patches import CropImage
+    from src.utility import parse_model_name
+    from src.anti_spoof_service import predict_liveness
+
+    images = _load_samples(args.images)
+    image_cropper = CropImage()
+
+    def reload_per_image(image):
+        # What test() did before the registry: new detector, torch.load per model
+        model_test = AntiSpoofPredict(args.device_id)
+        image_bbox = model_test.get_bbox(image)
+        prediction = np.zeros((1, 3))
+        for model_name in os.listdir(args.model_dir):
+            if not model_name.endswith(".pth"):
+                continue
+            h_input, w_input, model_type, scale = parse_model_name(model_name)
+            img = image_cropper.crop(image, image_bbox, scale, w_input, h_input, crop=scale is not None)
+            prediction += model_test.predict(img, os.path.join(args.model_dir, model_name))
+        return prediction
+
+    start = time.perf_counter()
+    model_test = AntiSpoofPredict(args.device_id, args.model_dir)
+    print("registry startup: {:.1f} ms for {} models".format(
+        (time.perf_counter() - start) * 1e3, len(model_test.registry)))
+
+    def registry_loop(image):
+        # One model at a time at batch size 1, served from the registry
+        image_bbox = model_test.get_bbox(image)
+        prediction = np.zeros((1, 3))
+        for entry in model_test.registry:
+            h_input, w_input, model_type, scale = entry.spec
+            img = image_cropper.crop(image, image_bbox, scale, w_input, h_input, crop=scale is not None)
+            prediction += model_test.predict(img, entry.name)
+        return prediction
+
+    def ensemble(image):
+        return predict_liveness(image, model_test)[1]
+
+    return _report_liveness(args, images, (("reload per image", reload_per_image),
+                                           ("registry, model loop", registry_loop),
+                                           ("ensemble executor", ensemble)))
+
+
+def ensemble_batch(args):
+    """N faces x M models: per-face model loop (N*M passes) vs ensemble batches (M passes)."""
+    import numpy as np
+    from src.anti_spoof_predict import AntiSpoofPredict
+
+    model_test = AntiSpoofPredict(args.device_id, args.model_dir)
+    image = _load_samples(args.images[:1])[0]
+    bbox = model_test.get_bbox(image)
+
+    def per_face(faces):
+        return np.concatenate([model_test.predict_faces(img, [b]) for img, b in faces])
+
+    print("models={} image={}".format(len(model_test.registry), args.images[0]))
+    for n in args.faces:
+        # Jitter the box so every face is a distinct crop
+        faces = [(image, [bbox[0] + i % 5, bbox[1] + i % 3, bbox[2], bbox[3]]) for i in range(n)]
+        timings, outputs = {}, {}
+        for name, run in (("per face", per_face), ("batched", model_test.ensemble.predict_faces)):
+            outputs[name] = run(faces)
+            start = time.perf_counter()
+            for _ in range(args.repeats):
+                run(faces)
+            timings[name] = (time.perf_counter() - start) / args.repeats
+        drift = float(np.abs(outputs["per face"] - outputs["batched"]).max())
+        print("faces={:<3} per face {:.1f} ms  batched {:.1f} ms  speedup {:.2f}x  max |diff| {:.1e}".format(
+            n, timings["per face"] * 1e3, timings["batched"] * 1e3,
+            timings["per face"] / timings["batched"], drift))
+    return 0
+
+
+def crop(args):
+    """Crop + stack + transpose per model vs one crop_many pass per face into preallocated batches."""
+    import numpy as np
+    from src.anti_spoof_predict import Detection
+    from src.ensemble import EnsembleExecutor, to_batch_array
+    from src.utility import ModelSpec, RegisteredModel, get_kernel, parse_model_name
+
+    specs = [ModelSpec(*parse_model_name(name)) for name in sorted(os.listdir(args.model_dir))
+             if name.endswith(".pth")]
+    # Only the specs matter for cropping; no model is loaded
+    entries = [RegisteredModel(str(spec), spec, get_kernel(spec.h_input, spec.w_input), None) for spec in specs]
+    executor = EnsembleExecutor(entries, workers=1)
+    image = _load_samples(args.images[:1])[0]
+    bbox = Detection().get_bbox(image)
+
+    def per_model(faces):
+        # EnsembleExecutor.prepare before crop_many
+        return [to_batch_array(np.stack([
+            executor.image_cropper.crop(img, b, entry.spec.scale, entry.spec.w_input, entry.spec.h_input,
+                                        crop=entry.spec.scale is not None)
+            for img, b in faces])) for entry in entries]
+
+    print("plans {}".format([(spec.scale, spec.w_input, spec.h_input) for spec in specs]))
+    for n in args.faces:
+        faces = [(image, [bbox[0] + i % 5, bbox[1] + i % 3, bbox[2], bbox[3]]) for i in range(n)]
+        timings, outputs = {}, {}
+        for name, run in (("per model", per_model), ("crop_many", lambda f: executor.prepare_entries(entries, f))):
+            outputs[name] = run(faces)
+            start = time.perf_counter()
+            for _ in range(args.repeats):
+                run(faces)
+            timings[name] = (time.perf_counter() - start) / args.repeats
+        identical = all(np.array_equal(a, b) for a, b in zip(outputs["per model"], outputs["crop_many"]))
+        print("faces={:<3} per model {:.3f} ms  crop_many {:.3f} ms  speedup {:.2f}x  identical {}".format(
+            n, timings["per model"] * 1e3, timings["crop_many"] * 1e3,
+            timings["per model"] / timings["crop_many"], identical))
+    executor.close()
+    return 0
+
+
+def pipeline(args):
+    """Per-stage latency of the fused /encode path vs running the stages separately."""
+    import io
+    import cv2
+    import numpy as np
+    from PIL import Image
+    from src.anti_spoof_predict import AntiSpoofPredict
+    from src.face_pipeline import StageTimer, analyze_face
+    from src.image_ingest import decode_frame
+    from src.simple_features import extract_simple_features
+
+    predictor = AntiSpoofPredict(args.device_id, args.model_dir)
+    predictor.warm_up()
+    payloads = [open(path, "rb").read() for path in args.images]
+
+    def decode(payload):
+        # The servers' former PIL decode
+        return np.ascontiguousarray(np.asarray(Image.open(io.BytesIO(payload)).convert("RGB"))[:, :, ::-1])
+
+    def separate(payload, timer):
+        # Liveness and features each start from their own copy of the image
+        with timer.stage("decode"):
+            frame = decode(payload)
+        with timer.stage("detect"):
+            bbox = predictor.get_bbox(frame)
+        with timer.stage("liveness"):
+            prediction = predictor.predict_faces(frame, [bbox])[0] / len(predictor.registry)
+        with timer.stage("features"):
+            left, top, width, height = bbox
+            face = Image.open(io.BytesIO(payload)).convert("RGB").crop((left, top, left + width, top + height))
+            extract_simple_features(face)
+        return prediction[1]
+
+    def fused(payload, timer):
+        with timer.stage("decode"):
+            frame = decode_frame(payload)
+        return analyze_face(frame, predictor, timer).spoof_score
+
+    status = 0
+    runs = (("separate", separate), ("fused", fused))
+    stages = {name: {} for name, _ in runs}
+    # Interleaved so both paths see the same machine load
+    for _ in range(args.repeats):
+        for payload in payloads:
+            for name, run in runs:
+                timer = StageTimer()
+                run(payload, timer)
+                for stage, ms in timer.report().items():
+                    stages[name].setdefault(stage, []).append(ms)
+    for name, _ in runs:
+        print("{:<9} ".format(name) + "  ".join(
+            "{} {:.2f}".format(stage, float(np.median(ms))) for stage, ms in stages[name].items()) + "  (median ms)")
+    for path, payload in zip(args.images, payloads):
+        # Same pixels as test.py's cv2.imread (EXIF orientation applied, unlike the PIL decode)
+        frame = decode_frame(payload)
+        face = analyze_face(frame, predictor, StageTimer())
+        reference = predictor.predict_faces(frame.bgr, [face.bbox])[0][1] / len(predictor.registry)
+        diff = abs(face.spoof_score - reference)
+        print("{:<36} imread pixels {}  spoof_score diff {:.2e}".format(
+            path, np.array_equal(frame.bgr, cv2.imread(path)), diff))
+        status |= diff > args.tolerance
+    predictor.close()
+    return int(status)
+
+
+def ingest(args):
+    """Request decode: the former PIL path vs image_ingest (cv2.imdecode on the buffer, gray once)."""
+    import base64
+    import io
+    import tracemalloc
+    import cv2
+    import numpy as np
+    from PIL import Image
+    from src.image_ingest import decode_base64_frame
+
+    payloads = [base64.b64encode(open(path, "rb").read()).decode("ascii") for path in args.images]
+    payloads = ["data:image/jpeg;base64," + payload for payload in payloads]
+
+    def pil(payload):
+        # base64_to_image, pil_to_bgr for the models, PIL grayscale for the features
+        image = Image.open(io.BytesIO(base64.b64decode(payload.split(",")[1]))).convert("RGB")
+        bgr = np.ascontiguousarray(np.asarray(image)[:, :, ::-1])
+        gray = np.asarray(image.convert("L"))
+        # The multi-face path converted the frame once more per face for its features
+        gray_again = np.asarray(image.convert("L"))
+        return bgr, gray, gray_again
+
+    def shared(payload):
+        frame = decode_base64_frame(payload)
+        # Pre-check, features and every face read the same grayscale
+        return frame.bgr, frame.gray, frame.gray
+
+    for name, run in (("PIL", pil), ("imdecode", shared)):
+        for payload in payloads:
+            run(payload)
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            for payload in payloads:
+                run(payload)
+        seconds = (time.perf_counter() - start) / (args.repeats * len(payloads))
+        tracemalloc.start()
+        run(payloads[0])
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("{:<9} {:.2f} ms/request  traced peak {:.2f} MB".format(name, seconds * 1e3, peak / 2 ** 20))
+    frame = decode_base64_frame(payloads[0])
+    print("imdecode frame identical to cv2.imread: {}".format(np.array_equal(frame.bgr, cv2.imread(args.images[0]))))
+    return 0
+
+
+def _stream_video(path, frames, absent):
+    """JPEG frames of the face in ``path`` drifting around, with ``absent`` empty frames in the middle"""
+    import cv2
+    import numpy as np
+
+    image = cv2.imread(path)
+    height, width = image.shape[:2]
+    # Nobody in view: the top-left corner of the scene (background) scaled up
+    empty = cv2.resize(image[:height // 5, :width // 5], (width, height), interpolation=cv2.INTER_LINEAR)
+    # Offset so the face leaves between two scheduled detections
+    gone = frames // 2 + 7
+    video = []
+    for t in range(frames):
+        if gone <= t < gone + absent:
+            frame = empty
+        else:
+            shift = np.float32([[1, 0, 25 * np.sin(t / 15)], [0, 1, 12 * np.sin(t / 9)]])
+            frame = cv2.warpAffine(image, shift, (width, height), borderMode=cv2.BORDER_REPLICATE)
+        video.append(cv2.imencode(".jpg", frame)[1].tobytes())
+    return video
+
+
+def stream(args):
+    """Per-frame /recognize work vs a FaceStream (tracking, periodic detection, recognition when uncertain)."""
+    import numpy as np
+    from src.anti_spoof_predict import AntiSpoofPredict
+    from src.face_pipeline import StageTimer, analyze_face, score_face
+    from src.face_stream import FaceStream, FaceTracker
+    from src.image_ingest import decode_frame
+    from src.simple_features import prepare_features, similarity_matrix
+
+    predictor = AntiSpoofPredict(args.device_id, args.model_dir)
+    predictor.warm_up()
+    video = _stream_video(args.images[0], args.frames, args.absent)
+    first = decode_frame(video[0])
+    gallery = prepare_features([analyze_face(first, predictor, StageTimer()).features])
+
+    def match(face):
+        similarity = float(similarity_matrix(prepare_features([face.features]), gallery)[0, 0])
+        return face.is_real and similarity >= 0.7, similarity
+
+    def per_frame(payload):
+        face = analyze_face(decode_frame(payload), predictor, StageTimer())
+        return None if face is None else match(face)[0]
+
+    def detect(frame, timer):
+        return predictor.find_bbox(frame.bgr, frame.gray)
+
+    def recognize(frame, bbox, timer):
+        recognized, similarity = match(score_face(frame, bbox, predictor, timer))
+        return {"success": recognized}, recognized and similarity >= 0.75
+
+    print("{} frames, face absent for {}; detect every {} frames".format(
+        len(video), args.absent, args.detect_interval))
+    reference = None
+    for name, make in (("per frame", lambda: None),
+                       ("stream", lambda: FaceStream(detect, recognize, detect_interval=args.detect_interval,
+                                                     tracker=FaceTracker(width=args.track_width,
+                                                                         search=args.search)))):
+        face_stream = make()
+        for payload in video[:3]:
+            per_frame(payload)
+        outcomes = []
+        wall, cpu = time.perf_counter(), time.process_time()
+        for payload in video:
+            if face_stream is None:
+                outcomes.append(per_frame(payload))
+            else:
+                body = face_stream.process(decode_frame(payload), StageTimer())
+                outcomes.append(body["success"] if body["face_location"] is not None else None)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        if reference is None:
+            reference = (outcomes, cpu)
+        agreement = np.mean([a == b for a, b in zip(outcomes, reference[0])])
+        extra = "" if face_stream is None else "  {}".format(dict(face_stream.stats))
+        print("{:<9} {:.2f} ms/frame wall  {:.2f} ms/frame CPU ({:.0%} of per-frame)  agreement {:.1%}{}".format(
+            name, wall * 1e3 / len(video), cpu * 1e3 / len(video), cpu / reference[1], agreement, extra))
+    predictor.close()
+    return 0
+
+
+def _burst_captures(args):
+    """
+    {capture name: (label, [JPEG frames])}: frames of a --burst_dir grouped by
+    capture (file name without its trailing _<n>), or jittered copies of the
+    sample images (image_T* real, image_F* fake)
+    """
+    import random
+    import cv2
+    import numpy as np
+    from src.quantization import load_image_folder
+
+    captures = {}
+    if args.burst_dir:
+        for path, image, label in load_image_folder(args.burst_dir):
+            if label is None:
+                continue
+            name = os.path.splitext(os.path.basename(path))[0].rsplit("_", 1)[0]
+            captures.setdefault(name, (label, []))[1].append(cv2.imencode(".jpg", image)[1].tobytes())
+        return captures
+    rng = random.Random(0)
+    for path in args.images:
+        name = os.path.splitext(os.path.basename(path))[0]
+        image = cv2.imread(path)
+        frames = []
+        for _ in range(args.frames * 2):
+            shift = np.float32([[1, 0, rng.uniform(-10, 10)], [0, 1, rng.uniform(-10, 10)]])
+            frame = cv2.warpAffine(image, shift, image.shape[1::-1], borderMode=cv2.BORDER_REPLICATE)
+            frame = cv2.convertScaleAbs(frame, alpha=rng.uniform(0.85, 1.15))
+            frames.append(cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, rng.randint(60, 95)])[1].tobytes())
+        captures[name] = (1 if name.startswith("image_T") else 0, frames)
+    return captures
+
+
+def burst(args):
+    """Liveness per burst: first frame only, retry-until-pass, and the sequential test of /verify-burst."""
+    import random
+    import numpy as np
+    from src.anti_spoof_predict import AntiSpoofPredict
+    from src.burst_liveness import SequentialLivenessTest, verify_burst
+    from src.face_pipeline import StageTimer, analyze_face
+    from src.image_ingest import decode_frame
+
+    predictor = AntiSpoofPredict(args.device_id, args.model_dir)
+    predictor.warm_up()
+    captures = _burst_captures(args)
+    rng = random.Random(1)
+    bursts = [(label, rng.sample(frames, min(args.frames, len(frames))))
+              for label, frames in captures.values() for _ in range(args.trials)]
+
+    def single_frame(frames):
+        # What one /recognize call decides
+        face = analyze_face(decode_frame(frames[0]), predictor, StageTimer())
+        return ('real' if face.is_real else 'fake') if face else None, 1
+
+    def retry(frames):
+        # The frontend's loop: resend until a frame passes, up to len(frames) times
+        for used, payload in enumerate(frames, 1):
+            face = analyze_face(decode_frame(payload), predictor, StageTimer())
+            if face is not None and face.is_real:
+                return 'real', used
+        return 'fake', len(frames)
+
+    def sequential(frames):
+        test = SequentialLivenessTest(args.false_accept, args.false_reject)
+        result = verify_burst((decode_frame(payload) for payload in frames), predictor, StageTimer(),
+                              test, batch=args.batch)
+        return result.decision, result.frames_processed
+
+    print("{} bursts of {} frames from {} captures ({} real)".format(
+        len(bursts), args.frames, len(captures), sum(label == 1 for label, _ in captures.values())))
+    for name, run in (("single", single_frame), ("retry", retry), ("sequential", sequential)):
+        decisions, used, latencies = [], [], []
+        for label, frames in bursts:
+            start = time.perf_counter()
+            decision, frames_used = run(frames)
+            latencies.append(time.perf_counter() - start)
+            decisions.append((label == 1, decision))
+            used.append(frames_used)
+        false_accepts = sum(decision == 'real' for real, decision in decisions if not real)
+        false_rejects = sum(decision != 'real' for real, decision in decisions if real)
+        undecided = sum(decision is None for _, decision in decisions)
+        print("{:<10} accuracy {:.1%}  false accepts {}  false rejects {}  undecided {}  "
+              "frames {:.2f}  latency {}".format(
+                  name, 1 - (false_accepts + false_rejects) / len(decisions), false_accepts, false_rejects,
+                  undecided, float(np.mean(used)), _latency_summary(latencies)))
+    predictor.close()
+    return 0
+
+
+def liveness_cache(args):
+    """Replayed auto-capture trace: liveness CPU and hit rate with and without the crop-hash cache."""
+    import random
+    import cv2
+    import numpy as np
+    from src.anti_spoof_predict import AntiSpoofPredict
+    from src.face_pipeline import StageTimer, analyze_face
+    from src.image_ingest import decode_frame
+    from src.liveness_cache import LivenessCache
+
+    # Each session is one capture (its own pose and framing) followed by resubmissions:
+    # the same bytes again (double submit) or the next camera frame (retry)
+    rng = random.Random(0)
+    trace = []
+    for path in args.images:
+        image = cv2.imread(path)
+        for session in range(args.sessions):
+            shift = np.float32([[1, 0, rng.uniform(-30, 30)], [0, 1, rng.uniform(-30, 30)]])
+            capture = cv2.warpAffine(image, shift, image.shape[1::-1], borderMode=cv2.BORDER_REPLICATE)
+            payload = cv2.imencode(".jpg", capture, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+            trace.append((len(trace), True, payload))
+            for _ in range(args.resubmits):
+                if rng.random() < 0.5:
+                    trace.append((len(trace), False, payload))
+                    continue
+                frame = cv2.convertScaleAbs(capture, alpha=rng.uniform(0.95, 1.05), beta=rng.uniform(-3, 3))
+                frame = np.clip(frame + np.random.RandomState(len(trace)).normal(0, 2, frame.shape), 0, 255)
+                trace.append((len(trace), False, cv2.imencode(
+                    ".jpg", frame.astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, rng.randint(80, 95)])[1].tobytes()))
+
+    results = {}
+    for name, cache in (("uncached", None), ("cached", LivenessCache(args.ttl, args.max_distance))):
+        predictor = AntiSpoofPredict(args.device_id, args.model_dir, liveness_cache=cache)
+        predictor.warm_up()
+        scores, liveness_ms, cpu, first_hits = [], [], 0.0, 0
+        for _, first, payload in trace:
+            hits = cache.stats["hits"] if cache else 0
+            timer = StageTimer()
+            start = time.process_time()
+            face = analyze_face(decode_frame(payload), predictor, timer)
+            cpu += time.process_time() - start
+            scores.append((face.is_real, face.spoof_score))
+            liveness_ms.append(timer.timings["liveness"])
+            # A capture's first request can only hit an entry of another capture
+            first_hits += first and cache is not None and cache.stats["hits"] > hits
+        results[name] = scores
+        print("{:<9} {} requests  CPU {:.1f} ms/request  liveness p50 {:.2f} ms  mean {:.2f} ms{}".format(
+            name, len(trace), cpu / len(trace) * 1e3, float(np.median(liveness_ms)), float(np.mean(liveness_ms)),
+            "  hit rate {}  hits on a new capture {}".format(cache.status()["hit_rate"], first_hits)
+            if cache else ""))
+        predictor.close()
+    agree = sum(a[0] == b[0] for a, b in zip(results["uncached"], results["cached"]))
+    drift = max(abs(a[1] - b[1]) for a, b in zip(results["uncached"], results["cached"]))
+    print("decisions agree {}/{}  max |spoof_score diff| {:.3f}".format(agree, len(trace), drift))
+    return 0
+
+
+def _quality_trace(args):
+    """Encoded captures of the sample images, ``args.bad_share`` of them blurred, dark, overexposed or flat"""
+    import random
+    import cv2
+    import numpy as np
+
+    rng = random.Random(0)
+    degradations = {
+        "blur": lambda image: cv2.GaussianBlur(image, (0, 0), rng.uniform(4, 8)),
+        "dark": lambda image: cv2.convertScaleAbs(image, alpha=rng.uniform(0.1, 0.3)),
+        "overexposed": lambda image: cv2.convertScaleAbs(image, beta=rng.uniform(120, 200)),
+        "flat": lambda image: cv2.convertScaleAbs(image, alpha=0.15, beta=rng.uniform(90, 130)),
+    }
+    trace = []
+    for path in args.images:
+        image = cv2.imread(path)
+        for _ in range(args.captures):
+            shift = np.float32([[1, 0, rng.uniform(-10, 10)], [0, 1, rng.uniform(-10, 10)]])
+            frame = cv2.warpAffine(image, shift, image.shape[1::-1], borderMode=cv2.BORDER_REPLICATE)
+            kind = rng.choice(sorted(degradations)) if rng.random() < args.bad_share else "good"
+            if kind != "good":
+                frame = degradations[kind](frame)
+            trace.append((path, kind, cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()))
+    rng.shuffle(trace)
+    return trace
+
+
+def quality_gate(args):
+    """Replayed capture trace: CPU of the fused pipeline with and without the image-quality gate."""
+    import collections
+    import cv2
+    import numpy as np
+    from src.anti_spoof_predict import AntiSpoofPredict
+    from src.face_pipeline import StageTimer, analyze_face, score_face
+    from src.image_ingest import decode_frame
+    from src.quality_gate import QualityGate
+    from src.simple_features import prepare_features, similarity_matrix
+
+    predictor = AntiSpoofPredict(args.device_id, args.model_dir)
+    predictor.warm_up()
+    trace = _quality_trace(args)
+    enrolled = {path: analyze_face(decode_frame(cv2.imencode(".jpg", cv2.imread(path))[1].tobytes()),
+                                   predictor, StageTimer()) for path in args.images}
+    gate = QualityGate()
+
+    def accepted(path, face):
+        # What /recognize would mark: a live face at 90% confidence against its enrolment
+        if face is None or not face.is_real or face.features is None or not enrolled[path].is_real:
+            return False
+        gallery = prepare_features([enrolled[path].features])
+        return float(similarity_matrix(prepare_features([face.features]), gallery)[0, 0]) >= 0.9
+
+    def ungated(frame):
+        return analyze_face(frame, predictor, StageTimer()), None
+
+    def gated(frame):
+        issue = gate.check_frame(frame.gray)
+        if issue is not None:
+            return None, issue.reason
+        bbox = predictor.find_bbox(frame.bgr, frame.gray)
+        if bbox is None:
+            return None, None
+        issue = gate.check_face(frame.width, frame.height, bbox)
+        if issue is not None:
+            return None, issue.reason
+        return score_face(frame, bbox, predictor, StageTimer()), None
+
+    print("{} captures, {} degraded ({})".format(
+        len(trace), sum(kind != "good" for _, kind, _ in trace),
+        dict(collections.Counter(kind for _, kind, _ in trace if kind != "good"))))
+    outcomes, cpu = {}, {}
+    for name, run in (("ungated", ungated), ("gated", gated)):
+        outcomes[name], cpu[name] = [], []
+        for path, kind, payload in trace:
+            start = time.process_time()
+            face, reason = run(decode_frame(payload))
+            cpu[name].append(time.process_time() - start)
+            outcomes[name].append((accepted(path, face), reason))
+        print("{:<8} CPU {:.1f} ms/capture  accepted {}".format(
+            name, float(np.mean(cpu[name])) * 1e3, sum(ok for ok, _ in outcomes[name])))
+    rejected = [i for i, (_, reason) in enumerate(outcomes["gated"]) if reason is not None]
+    lost = sum(outcomes["ungated"][i][0] for i in rejected)
+    saved = sum(cpu["ungated"][i] - cpu["gated"][i] for i in rejected)
+    print("gate rejected {} ({})  of which the full pipeline would have accepted {}".format(
+        len(rejected), dict(collections.Counter(outcomes["gated"][i][1] for i in rejected)), lost))
+    print("CPU saved {:.1f} ms per rejected capture, {:.0%} of the whole trace".format(
+        saved / max(1, len(rejected)) * 1e3, 1 - sum(cpu["gated"]) / sum(cpu["ungated"])))
+    predictor.close()
+    return 0
+
+
+def fuse(args):
+    """Eager vs BatchNorm-folded MiniFASNet: numerical equivalence and CPU speedup per checkpoint."""
+    import numpy as np
+    import torch
+    from src.anti_spoof_predict import Detection
+    from src.ensemble import to_batch_array
+    from src.generate_patches import CropImage
+    from src.model_lib.fusion import fuse_model
+    from src.model_registry import load_model
+
+    images = _load_samples(args.images)
+    detector = Detection()
+    cropper = CropImage()
+    status = 0
+    for model_name in sorted(os.listdir(args.model_dir)):
+        if not model_name.endswith(".pth"):
+            continue
+        entry = load_model(os.path.join(args.model_dir, model_name), "cpu")
+        h_input, w_input, _, scale = entry.spec
+        crops = np.stack([cropper.crop(image, detector.get_bbox(image), scale, w_input, h_input,
+                                       crop=scale is not None) for image in images])
+        batch = torch.cat([torch.from_numpy(to_batch_array(crops)),
+                           torch.rand(4, 3, h_input, w_input) * 255])
+        eager = entry.model
+        fused = fuse_model(load_model(os.path.join(args.model_dir, model_name), "cpu").model)
+
+        with torch.no_grad():
+            logits_diff = float((eager(batch) - fused(batch)).abs().max())
+            softmax_diff = float((torch.softmax(eager(batch), 1) - torch.softmax(fused(batch), 1)).abs().max())
+            timings = {}
+            single = batch[:1]
+            for name, model in (("eager", eager), ("fused", fused)):
+                for _ in range(10):
+                    model(single)
+                start = time.perf_counter()
+                for _ in range(args.repeats):
+                    model(single)
+                timings[name] = (time.perf_counter() - start) / args.repeats
+
+        ok = softmax_diff <= args.tolerance
+        status |= 0 if ok else 1
+        print("{:<32} eager {:.2f} ms  fused {:.2f} ms  speedup {:.2f}x  "
+              "max |logit diff| {:.1e}  max |softmax diff| {:.1e}  {}".format(
+                  model_name, timings["eager"] * 1e3, timings["fused"] * 1e3,
+                  timings["eager"] / timings["fused"], logits_diff, softmax_diff,
+                  "OK" if ok else "MISMATCH"))
+    return status
+
+
+def torchscript(args):
+    """Eager vs frozen TorchScript: startup, first-request and steady-state ensemble latency."""
+    import warnings
+    import numpy as np
+    import torch
+    from src.ensemble import EnsembleExecutor
+    from src.model_registry import ModelRegistry
+    from src.anti_spoof_predict import Detection
+
+    warnings.filterwarnings("ignore")
+    images = _load_samples(args.images)
+    detector = Detection()
+    faces = [(image, detector.get_bbox(image)) for image in images]
+    reference = None
+    for backend in ("eager", "torchscript"):
+        for warmup in (False, True):
+            start = time.perf_counter()
+            registry = ModelRegistry(args.model_dir, torch.device("cpu"), backend=backend, warmup=warmup)
+            startup = time.perf_counter() - start
+            ensemble = EnsembleExecutor(registry)
+            start = time.perf_counter()
+            first = ensemble.predict_faces(faces[:1])
+            first_latency = time.perf_counter() - start
+            latencies = []
+            for _ in range(args.repeats):
+                for face in faces:
+                    start = time.perf_counter()
+                    ensemble.predict_faces([face])
+                    latencies.append(time.perf_counter() - start)
+            if reference is None:
+                reference = first
+            ensemble.close()
+            print("{:<11} warmup={:<5} startup {:.0f} ms  first request {:.1f} ms  steady {}  max |diff| {:.1e}".format(
+                backend, str(warmup), startup * 1e3, first_latency * 1e3, _latency_summary(latencies),
+                float(np.abs(first - reference).max())))
+    return 0
+
+
+# ru_maxrss survives fork+exec on Linux, so peak RSS is read from VmHWM instead
+_STARTUP_PROBE = """
+import sys, time
+start = time.perf_counter()
+from src.anti_spoof_predict import AntiSpoofPredict
+AntiSpoofPredict({device_id}, {model_dir!r}, backend={backend!r})
+elapsed = time.perf_counter() - start
+peak_kb = next(line.split()[1] for line in open('/proc/self/status') if line.startswith('VmHWM'))
+print(elapsed, 'torch' in sys.modules, peak_kb)
+"""
+
+
+def onnx(args):
+    """OpenCV DNN (ONNX) vs PyTorch backends: fresh-process startup, footprint, latency and parity."""
+    import subprocess
+    from src.anti_spoof_predict import AntiSpoofPredict
+    from src.onnx_models import load_onnx_model
+
+    # Export up front so the startup probes below measure loading only
+    for model_name in sorted(os.listdir(args.model_dir)):
+        if model_name.endswith(".pth"):
+            load_onnx_model(os.path.join(args.model_dir, model_name))
+
+    backends = ("eager", "torchscript", "opencv")
+    for backend in backends:
+        probe = _STARTUP_PROBE.format(device_id=args.device_id, model_dir=args.model_dir, backend=backend)
+        output = subprocess.run([sys.executable, "-W", "ignore", "-c", probe], check=True,
+                                capture_output=True, text=True).stdout.split()
+        print("{:<12} fresh process: import + load {:.2f} s  torch imported {}  max RSS {:.0f} MB".format(
+            backend, float(output[0]), output[1], int(output[2]) / 1024))
+
+    images = _load_samples(args.images)
+    variants = []
+    for backend in backends:
+        model_test = AntiSpoofPredict(args.device_id, args.model_dir, backend=backend)
+        variants.append((backend, lambda image, model_test=model_test:
+                         model_test.predict_faces(image, [model_test.get_bbox(image)])))
+    return _report_liveness(args, images, variants)
+
+
+def bundle(args):
+    """Model directory vs single-file bundle: fresh-process startup, footprint and parity."""
+    import subprocess
+    import tempfile
+    import numpy as np
+    import torch
+    from bundle_models import main as write_model_bundle
+    from src.frozen_models import FROZEN_BLOB
+    from src.model_bundle import BUNDLE_SUFFIX, read_bundle
+    from src.model_registry import ModelRegistry
+
+    if not os.path.exists(args.bundle):
+        write_model_bundle(argparse.Namespace(model_dir=args.model_dir, output=args.bundle, no_frozen=False))
+    stored = sum(FROZEN_BLOB in metadata['blobs'] for metadata, _ in read_bundle(args.bundle))
+    print("bundle {} ({:.2f} MB), {} stored frozen graphs".format(
+        args.bundle, os.path.getsize(args.bundle) / 2 ** 20, stored))
+    # The same weights without graphs: what tracing and freezing at every start costs
+    fd, weights_only = tempfile.mkstemp(suffix=BUNDLE_SUFFIX)
+    os.close(fd)
+    write_model_bundle(argparse.Namespace(model_dir=args.model_dir, output=weights_only, no_frozen=True))
+    # Fills the directory's .frozen.pt cache, so it is timed warm like a restarted server
+    ModelRegistry(args.model_dir, torch.device("cpu"), backend="torchscript", warmup=False)
+    try:
+        for label, source in (("directory", args.model_dir), ("bundle, weights only", weights_only),
+                              ("bundle", args.bundle)):
+            for backend in ("eager", "torchscript"):
+                probe = _STARTUP_PROBE.format(device_id=args.device_id, model_dir=source, backend=backend)
+                outputs = [subprocess.run([sys.executable, "-W", "ignore", "-c", probe], check=True,
+                                          capture_output=True, text=True).stdout.split()
+                           for _ in range(args.startups)]
+                print("{:<24} {:<12} fresh process: import + load {:.2f} s (median of {})  max RSS {:.0f} MB".format(
+                    label, backend, float(np.median([float(output[0]) for output in outputs])), args.startups,
+                    max(int(output[2]) for output in outputs) / 1024))
+    finally:
+        os.remove(weights_only)
+
+    timings = {}
+    for source in (args.model_dir, args.bundle):
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            ModelRegistry(source, torch.device("cpu"), backend="eager", warmup=False)
+        timings[source] = (time.perf_counter() - start) / args.repeats
+        print("{:<40} eager registry load {:.1f} ms (no warm-up)".format(source, timings[source] * 1e3))
+
+    directory = ModelRegistry(args.model_dir, torch.device("cpu"), backend="eager", warmup=False)
+    packed = ModelRegistry(args.bundle, torch.device("cpu"), backend="eager", warmup=False)
+    frozen = ModelRegistry(args.bundle, torch.device("cpu"), backend="torchscript", warmup=False)
+    for entry in directory:
+        batch = np.random.rand(4, 3, entry.spec.h_input, entry.spec.w_input).astype(np.float32) * 255
+        expected = directory.forward(entry, batch)
+        drift = np.abs(expected - packed.forward(packed[entry.spec], batch)).max()
+        frozen_drift = np.abs(expected - frozen.forward(frozen[entry.spec], batch)).max()
+        print("{:<32} max |softmax diff| eager {:.1e}  torchscript {:.1e}".format(
+            entry.name, float(drift), float(frozen_drift)))
+    return 0
+
+
+def detector(args):
+    """Face detection throughput: one blob per image vs batched passes of the detector engine."""
+    import cv2
+    import numpy as np
+    from src.detector_engine import DetectorEngine, MEAN, detection_size
+
+    deploy = "./resources/detection_model/deploy.prototxt"
+    caffemodel = "./resources/detection_model/Widerface-RetinaFace.caffemodel"
+    images = _load_samples(args.images)
+    net = cv2.dnn.readNetFromCaffe(deploy, caffemodel)
+    engine = DetectorEngine(deploy, caffemodel)
+
+    def per_image(batch):
+        # Detection.get_bbox before the engine
+        for image in batch:
+            size = detection_size(image.shape[0], image.shape[1])
+            net.setInput(cv2.dnn.blobFromImage(cv2.resize(image, size), 1, mean=MEAN), 'data')
+            net.forward('detection_out')
+
+    status = 0
+    for batch_size in args.batch_sizes:
+        batch = [images[i % len(images)] for i in range(batch_size)]
+        expected = [engine.best_bboxes([image])[0] for image in batch]
+        if engine.best_bboxes(batch) != expected:
+            print("batch {}: bboxes differ from single-image detection".format(batch_size))
+            status = 1
+        per_image(batch)
+        rates = []
+        for run in (per_image, engine.best_bboxes):
+            start = time.perf_counter()
+            frames = 0
+            while time.perf_counter() - start < args.seconds:
+                run(batch)
+                frames += batch_size
+            rates.append(frames / (time.perf_counter() - start))
+        print("batch {:>2}: per-image {:7.1f} frames/s  engine {:7.1f} frames/s  ({:.2f}x)".format(
+            batch_size, rates[0], rates[1], rates[1] / rates[0]))
+    return status
+
+
+def _image_paths(folder):
+    from src.quantization import IMAGE_EXTENSIONS
+    return sorted(os.path.join(root, name) for root, _, files in os.walk(folder)
+                  for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def precheck(args):
+    """No-face pre-checks: skip rate on empty frames, missed-face rate and time saved per frame."""
+    import cv2
+    import numpy as np
+    from src.anti_spoof_predict import Detection
+    from src.face_precheck import CascadePrecheck, MotionPrecheck
+
+    detector = Detection()
+    face_frames = [cv2.imread(path) for path in _image_paths(args.face_dir)]
+    empty_frames = [cv2.imread(path) for path in _image_paths(args.no_face_dir)]
+    # Ground truth for "has a face" is what the DNN finds, so misses are the pre-check's alone
+    face_frames = [frame for frame in face_frames if detector.get_faces(frame)]
+    print("{} frames with a face (found by the DNN), {} without".format(len(face_frames), len(empty_frames)))
+
+    def seconds_per_frame(run, frames):
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            for frame in frames:
+                run(frame)
+        return (time.perf_counter() - start) / (args.repeats * len(frames))
+
+    frames = face_frames + empty_frames
+    dnn = seconds_per_frame(detector.get_faces, frames)
+    print("{:<8} {:.2f} ms/frame".format("dnn", dnn * 1e3))
+    rng = np.random.default_rng(0)
+    for name, make in (("cascade", CascadePrecheck), ("motion", MotionPrecheck)):
+        check = make()
+        # The motion check sees a camera stream: each empty scene held for `hold`
+        # frames with sensor noise, then the people walking up
+        fired_empty = [check(np.clip(frame + rng.normal(0, 2, frame.shape), 0, 255).astype(np.uint8))
+                       for frame in empty_frames for _ in range(args.hold)]
+        fired_face = [check(frame) for frame in face_frames]
+        skip_rate = 1 - sum(fired_empty) / len(fired_empty)
+        missed_rate = 1 - sum(fired_face) / len(face_frames)
+        cost = seconds_per_frame(make(), frames)
+        # Expected detector cost per frame when a fraction `empty` of the traffic has nobody in view
+        staged = cost + dnn * (args.empty_share * (1 - skip_rate) + (1 - args.empty_share) * (1 - missed_rate))
+        print("{:<8} {:.2f} ms/frame  skip rate {:.1%}  missed faces {:.1%}  "
+              "staged {:.2f} ms/frame at {:.0%} empty frames".format(
+                  name, cost * 1e3, skip_rate, missed_rate, staged * 1e3, args.empty_share))
+    return 0
+
+
+def hot_reload(args):
+    """Swap latency and the latency blip seen by concurrent liveness requests during model reloads."""
+    import warnings
+    from src.anti_spoof_predict import AntiSpoofPredict
+    from src.hot_reload import ReloadableModels
+
+    warnings.filterwarnings("ignore")
+    images = _load_samples(args.images)
+    probe = AntiSpoofPredict(args.device_id)
+    faces = [(image, [probe.get_bbox(image)]) for image in images]
+    released = []
+
+    def load():
+        predictor = AntiSpoofPredict(args.device_id, args.model_dir, backend=args.backend)
+        predictor.warm_up()
+        return predictor
+
+    def release(predictor):
+        released.append(time.perf_counter())
+        predictor.close()
+
+    for nice in (0, 10):
+        models = ReloadableModels(load, release=release, background_nice=nice)
+        with models.lease():
+            pass
+        samples = []  # (finished at, latency, generation)
+        stop = threading.Event()
+
+        def client(offset):
+            i = offset
+            while not stop.is_set():
+                image, bboxes = faces[i % len(faces)]
+                start = time.perf_counter()
+                with models.lease() as predictor:
+                    predictor.predict_faces(image, bboxes)
+                end = time.perf_counter()
+                samples.append((end, end - start))
+                i += 1
+
+        clients = [threading.Thread(target=client, args=(n,)) for n in range(args.clients)]
+        for thread in clients:
+            thread.start()
+        time.sleep(args.settle)
+        windows = []
+        for _ in range(args.reloads):
+            start = time.perf_counter()
+            models.reload_in_background()
+            while models.status()["reloading"] or models.status()["draining"]:
+                time.sleep(0.005)
+            windows.append((start, time.perf_counter()))
+            time.sleep(args.settle)
+        stop.set()
+        for thread in clients:
+            thread.join()
+
+        def during(t):
+            return any(begin <= t <= end for begin, end in windows)
+
+        steady = [latency for end, latency in samples if not during(end)]
+        blip = [latency for end, latency in samples if during(end)]
+        reload = models.last_reload
+        print("background nice {:>2}: {} reloads, load {:.2f} s, swap {:.3f} ms, generations released {}".format(
+            nice, args.reloads, reload["load_seconds"], reload["swap_ms"], len(released)))
+        print("    steady        {}  ({} requests)".format(_latency_summary(steady), len(steady)))
+        print("    during reload {}  ({} requests)".format(_latency_summary(blip), len(blip)))
+        released.clear()
+        with models.lease() as predictor:
+            predictor.close()
+    return 0
+
+
+def early_exit(args):
+    """Confidence-gated ensemble: calibrated margin, early-exit fraction, accuracy and latency."""
+    import numpy as np
+    from quantize import real_accuracy
+    from src.anti_spoof_predict import AntiSpoofPredict
+    from src.ensemble import calibrate_margin
+    from src.quantization import load_image_folder
+
+    model_test = AntiSpoofPredict(args.device_id, args.model_dir, backend=args.backend)
+    ensemble = model_test.ensemble
+    members = len(ensemble.registry)
+    print("members by cost: {}".format(", ".join(entry.name for entry in ensemble.members_by_cost)))
+
+    def faces_of(folder):
+        samples = [sample for sample in load_image_folder(folder) if sample[2] is not None]
+        return [(image, model_test.get_bbox(image)) for _, image, _ in samples], \
+            np.array([label for _, _, label in samples])
+
+    faces, _ = faces_of(args.calibration_dir)
+    # A zero margin stops every face after the cheapest member
+    first = ensemble.predict_faces_gated(faces, 0.0)[0] / members
+    full = ensemble.predict_faces(faces)
+    margin = calibrate_margin(first, np.argmax(full, axis=1), args.target_agreement)
+    if margin is None:
+        print("no margin reaches {:.3f} agreement with the full ensemble; early exit stays off".format(
+            args.target_agreement))
+        return 1
+    print("calibrated margin {:.4f} on {} faces (target agreement {:.3f})".format(
+        margin, len(faces), args.target_agreement))
+
+    faces, labels = faces_of(args.eval_dir or args.calibration_dir)
+    full_predictions, gated_predictions, used = [], [], []
+    full_latencies, gated_latencies = [], []
+    for face in faces:
+        start = time.perf_counter()
+        full_predictions.append(ensemble.predict_faces([face])[0])
+        full_latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        prediction, members_run = ensemble.predict_faces_gated([face], margin)
+        gated_latencies.append(time.perf_counter() - start)
+        gated_predictions.append(prediction[0])
+        used.append(members_run[0])
+    full_predictions, gated_predictions, used = np.array(full_predictions), np.array(gated_predictions), np.array(used)
+    print("early exit on {:.1%} of {} faces, {:.2f} of {} members run on average".format(
+        np.mean(used < members), len(faces), used.mean(), members))
+    print("real/fake accuracy full {:.3f}  gated {:.3f}  label agreement {:.3f}".format(
+        real_accuracy(full_predictions, labels), real_accuracy(gated_predictions, labels),
+        np.mean(np.argmax(full_predictions, 1) == np.argmax(gated_predictions, 1))))
+    print("ensemble latency full  {}".format(_latency_summary(full_latencies)))
+    print("ensemble latency gated {}".format(_latency_summary(gated_latencies)))
+    return 0
+
+
+def _report_liveness(args, images, variants):
+    """Time each variant over the sample images and check they agree with the first one."""
+    import numpy as np
+
+    reference = None
+    status = 0
+    for name, run in variants:
+        predictions = [run(image) for image in images]  # warm-up
+        latencies = []
+        for _ in range(args.repeats):
+            for image in images:
+                start = time.perf_counter()
+                run(image)
+                latencies.append(time.perf_counter() - start)
+        if reference is None:
+            reference = predictions
+            drift = 0.0
+        else:
+            drift = max(float(np.abs(np.asarray(p) - np.asarray(r)).max())
+                        for p, r in zip(predictions, reference))
+        labels = [int(np.argmax(p)) for p in predictions]
+        print("{:<22} mean {:.2f} ms  {}  labels {}  max |diff| {:.2e}".format(
+            name, sum(latencies) / len(latencies) * 1e3, _latency_summary(latencies), labels, drift))
+        if drift > args.tolerance:
+            status = 1
+    return status
+
+
+def _ring_producer(name, image_path, fps, seconds):
+    import cv2
+    from src.frame_ring import FrameRing
+
+    ring = FrameRing.attach(name)
+    height, width, _ = ring.shape
+    frames = [cv2.resize(cv2.imread(path), (width, height)) for path in image_path]
+    interval = 1.0 / fps if fps else 0
+    end = time.time() + seconds
+    n = 0
+    while time.time() < end and not ring.stopped:
+        start = time.time()
+        ring.write(frames[n % len(frames)])
+        n += 1
+        if interval:
+            time.sleep(max(0, interval - (time.time() - start)))
+    ring.request_stop()
+    ring.close()
+
+
+def frame_ring(args):
+    """Sustained liveness FPS reading camera frames from the shared-memory ring."""
+    import multiprocessing
+    from src.anti_spoof_predict import AntiSpoofPredict
+    from src.frame_ring import FrameRing, consume
+    from src.anti_spoof_service import predict_liveness
+
+    model_test = AntiSpoofPredict(args.device_id, args.model_dir)
+    ring = FrameRing.create("face_ring_{}".format(os.getpid()), args.slots, args.height, args.width)
+    producer = multiprocessing.Process(
+        target=_ring_producer, args=(ring.name, args.images, args.fps, args.seconds))
+
+    def process(frame):
+        return predict_liveness(frame, model_test)[1]
+
+    processed = 0
+    producer.start()
+    start = time.time()
+    try:
+        for _ in consume(ring, process):
+            processed += 1
+    finally:
+        elapsed = time.time() - start
+        producer.join()
+    written = ring.write_seq
+    ring.close()
+
+    print("ring {} slots of {}x{}, producer target fps={}".format(
+        args.slots, args.height, args.width, args.fps or "max"))
+    print("frames written:   {} ({:.1f} fps)".format(written, written / elapsed))
+    print("frames processed: {} ({:.1f} fps sustained on CPU)".format(processed, processed / elapsed))
+    print("frames skipped:   {} (newest-frame policy)".format(written - processed))
+    return 0
+
+
+def _budget_worker(budget, args, start_barrier, results):
+    # Runs in a fresh (spawned) process: the budget is applied before torch loads
+    from src import thread_budget
+    thread_budget.apply(budget)
+    from src.anti_spoof_predict import AntiSpoofPredict
+    from src.anti_spoof_service import predict_liveness
+
+    model_test = AntiSpoofPredict(args.device_id, args.model_dir, backend=args.backend,
+                                  ensemble_threads=budget.ensemble_threads)
+    images = _load_samples(args.images)
+    for image in images:
+        predict_liveness(image, model_test)
+    latencies = []
+    lock = threading.Lock()
+    start_barrier.wait()
+    end = time.perf_counter() + args.seconds
+
+    def serve():
+        n = 0
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            predict_liveness(images[n % len(images)], model_test)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+            n += 1
+
+    threads = [threading.Thread(target=serve) for _ in range(budget.request_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(latencies)
+
+
+def _budget_matrix(cores):
+    """Budgets worth comparing on ``cores`` cores, plus the unbudgeted defaults"""
+    from src.thread_budget import ThreadBudget
+
+    budgets = set()
+    for workers in sorted({1, 2, cores} & set(range(1, cores + 1))):
+        per_worker = cores // workers
+        for request_threads in sorted({1, max(1, per_worker // 2), per_worker}):
+            # Both anti-spoof models at once only where the request share has the cores for it
+            for ensemble_threads in sorted({1, min(2, max(1, per_worker // request_threads))}):
+                share = max(1, per_worker // (request_threads * ensemble_threads))
+                for intra_op in sorted({1, share}):
+                    budgets.add(ThreadBudget(cores, workers, request_threads, intra_op, intra_op, ensemble_threads))
+    # threaded=True Flask without a budget: 2 requests per core, every model at once, all-core pools
+    budgets.add(ThreadBudget(cores, 1, 2 * cores, cores, cores, 2))
+    return sorted(budgets, key=lambda b: (b.workers, b.request_threads, b.ensemble_threads, b.torch_threads))
+
+
+def thread_budget_matrix(args):
+    """Liveness throughput/latency per thread budget (workers x request threads x intra-op threads)."""
+    import multiprocessing
+    from src.thread_budget import available_cores
+
+    cores = args.cores or available_cores()
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    for budget in _budget_matrix(cores):
+        start_barrier = context.Barrier(budget.workers + 1)
+        results = context.Queue()
+        workers = [context.Process(target=_budget_worker, args=(budget, args, start_barrier, results))
+                   for _ in range(budget.workers)]
+        for worker in workers:
+            worker.start()
+        start_barrier.wait()
+        latencies = [latency for _ in workers for latency in results.get()]
+        for worker in workers:
+            worker.join()
+        throughput = len(latencies) / args.seconds
+        rows.append((throughput, budget))
+        print("workers {:>2}  request threads {:>2}  ensemble threads {}  torch/cv2 threads {:>2}  "
+              "({:>3} compute threads)  {:6.1f} img/s  {}".format(
+                  budget.workers, budget.request_threads, budget.ensemble_threads, budget.torch_threads,
+                  budget.compute_threads, throughput, _latency_summary(latencies)))
+        sys.stdout.flush()
+    best = max(rows, key=lambda row: row[0])[1]
+    print("best on {} cores: FACE_WORKERS={} FACE_REQUEST_THREADS={} FACE_ENSEMBLE_THREADS={} "
+          "FACE_TORCH_THREADS={} FACE_CV2_THREADS={}".format(
+              cores, best.workers, best.request_threads, best.ensemble_threads, best.torch_threads,
+              best.cv2_threads))
+    return 0
+
+
+def _add_liveness_args(p):
+    p.add_argument("--images", nargs="+", default=["./images/sample/image_T1.jpg",
+                                                   "./images/sample/image_F1.jpg",
+                                                   "./images/sample/image_F2.jpg"])
+    p.add_argument("--model_dir", default="./resources/anti_spoof_models")
+    p.add_argument("--device_id", type=int, default=0)
+    p.add_argument("--repeats", type=int, default=10)
+    p.add_argument("--tolerance", type=float, default=1e-4, help="max allowed softmax difference")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="face recognition server benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("gallery-stress", help="concurrency stress test for the feature gallery")
+    p.add_argument("--writers", type=int, default=4)
+    p.add_argument("--readers", type=int, default=8)
+    p.add_argument("--batch", type=int, default=50, help="entries written per update")
+    p.add_argument("--clear-every", type=int, default=25, help="writer 0 clears every N updates (0 = never)")
+    p.add_argument("--seconds", type=float, default=5.0)
+    p.set_defaults(func=gallery_stress)
+
+    p = sub.add_parser("rpc", help="HTTP vs Unix-socket round trip for /encode and /recognize")
+    p.add_argument("--image", default="./images/sample/image_T1.jpg")
+    p.add_argument("--gallery", type=int, default=200, help="encodings sent with each recognize call")
+    p.add_argument("--calls", type=int, default=200)
+    p.add_argument("--warmup", type=int, default=10)
+    p.set_defaults(func=rpc_compare)
+
+    p = sub.add_parser("recognize-batch", help="sequential /recognize vs /recognize-batch")
+    p.add_argument("--images", nargs="+", default=["./images/sample/image_T1.jpg",
+                                                   "./images/sample/image_F1.jpg",
+                                                   "./images/sample/image_F2.jpg"])
+    p.add_argument("--batch", type=int, default=16)
+    p.add_argument("--gallery", type=int, default=500)
+    p.add_argument("--repeats", type=int, default=5)
+    p.set_defaults(func=recognize_batch)
+
+    p = sub.add_parser("encode-batch", help="sequential /encode vs /encode-batch")
+    p.add_argument("--images", nargs="+", default=["./images/sample/image_T1.jpg",
+                                                   "./images/sample/image_F1.jpg",
+                                                   "./images/sample/image_F2.jpg"])
+    p.add_argument("--count", type=int, default=500)
+    p.add_argument("--url-latency-ms", type=float, default=None,
+                   help="send image_url items served locally with this download latency")
+    p.add_argument("--pipeline", choices=["fused", "mock"], default="fused")
+    p.set_defaults(func=encode_batch)
+
+    p = sub.add_parser("anti-spoof", help="per-image liveness latency before/after the model registry")
+    _add_liveness_args(p)
+    p.set_defaults(func=anti_spoof)
+
+    p = sub.add_parser("ensemble-batch", help="faces per forward pass: per-face loop vs batched ensemble")
+    _add_liveness_args(p)
+    p.add_argument("--faces", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    p.set_defaults(func=ensemble_batch)
+
+    p = sub.add_parser("crop", help="per-model crops vs crop_many into preallocated model batches")
+    _add_liveness_args(p)
+    p.add_argument("--faces", type=int, nargs="+", default=[1, 4, 16])
+    p.set_defaults(func=crop, repeats=500)
+
+    p = sub.add_parser("burst", help="burst liveness: single frame vs retry loop vs sequential test")
+    _add_liveness_args(p)
+    p.add_argument("--burst_dir", default=None, help="0/1/2 class folders; frames named <capture>_<n>")
+    p.add_argument("--frames", type=int, default=8, help="frames per burst")
+    p.add_argument("--trials", type=int, default=10, help="random bursts drawn per capture")
+    p.add_argument("--batch", type=int, default=2, help="frames per detector/ensemble pass")
+    p.add_argument("--false_accept", type=float, default=0.01)
+    p.add_argument("--false_reject", type=float, default=0.05)
+    p.set_defaults(func=burst)
+
+    p = sub.add_parser("quality-gate", help="CPU saved by the image-quality gate on a replayed capture trace")
+    _add_liveness_args(p)
+    p.add_argument("--captures", type=int, default=30, help="captures per image")
+    p.add_argument("--bad_share", type=float, default=0.3, help="share of blurred, dark, overexposed or flat captures")
+    p.set_defaults(func=quality_gate)
+
+    p = sub.add_parser("liveness-cache", help="liveness result cache on a replayed retry/double-submit trace")
+    _add_liveness_args(p)
+    p.add_argument("--sessions", type=int, default=4, help="distinct captures per image")
+    p.add_argument("--resubmits", type=int, default=3, help="retries and double submits after each capture")
+    p.add_argument("--ttl", type=float, default=5.0)
+    p.add_argument("--max_distance", type=int, default=12)
+    p.set_defaults(func=liveness_cache)
+
+    p = sub.add_parser("stream", help="video stream: per-frame recognition vs tracking with periodic detection")
+    _add_liveness_args(p)
+    p.add_argument("--frames", type=int, default=300)
+    p.add_argument("--absent", type=int, default=30, help="frames without a face in the middle of the video")
+    p.add_argument("--detect_interval", type=int, default=15)
+    p.add_argument("--track_width", type=int, default=160)
+    p.add_argument("--search", type=float, default=0.5)
+    p.set_defaults(func=stream)
+
+    p = sub.add_parser("ingest", help="request decode: PIL + conversions vs one cv2.imdecode Frame")
+    _add_liveness_args(p)
+    p.set_defaults(func=ingest, repeats=100)
+
+    p = sub.add_parser("pipeline", help="per-stage latency: fused /encode path vs separate stages")
+    _add_liveness_args(p)
+    p.set_defaults(func=pipeline, repeats=20)
+
+    p = sub.add_parser("fuse", help="Conv-BN folding: equivalence and CPU speedup per checkpoint")
+    _add_liveness_args(p)
+    p.set_defaults(func=fuse, repeats=200)
+
+    p = sub.add_parser("torchscript", help="eager vs frozen TorchScript models, with and without warm-up")
+    _add_liveness_args(p)
+    p.set_defaults(func=torchscript, repeats=20)
+
+    p = sub.add_parser("onnx", help="OpenCV DNN (ONNX) backend vs PyTorch: startup, latency, parity")
+    _add_liveness_args(p)
+    p.set_defaults(func=onnx)
+
+    p = sub.add_parser("bundle", help="model directory vs single-file bundle: startup and parity")
+    p.add_argument("--bundle", default="./resources/anti_spoof_models.fasb",
+                   help="bundle to compare (written with bundle_models.py when missing)")
+    p.add_argument("--model_dir", default="./resources/anti_spoof_models")
+    p.add_argument("--device_id", type=int, default=0)
+    p.add_argument("--repeats", type=int, default=20)
+    p.add_argument("--startups", type=int, default=3, help="fresh processes timed per source and backend")
+    p.set_defaults(func=bundle)
+
+    p = sub.add_parser("detector", help="face detection throughput: per-image blobs vs batched engine")
+    p.add_argument("--images", nargs="+", default=["./images/sample/image_T1.jpg",
+                                                   "./images/sample/image_F1.jpg",
+                                                   "./images/sample/image_F2.jpg"])
+    p.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    p.add_argument("--seconds", type=float, default=2.0, help="measurement window per batch size")
+    p.set_defaults(func=detector)
+
+    p = sub.add_parser("precheck", help="no-face pre-checks: skip rate, missed faces, detector time saved")
+    p.add_argument("--face_dir", required=True, help="frames with somebody in view")
+    p.add_argument("--no_face_dir", required=True, help="frames with nobody in view")
+    p.add_argument("--empty_share", type=float, default=0.8, help="share of empty frames in kiosk traffic")
+    p.add_argument("--hold", type=int, default=10, help="frames each empty scene is seen for (motion check)")
+    p.add_argument("--repeats", type=int, default=5)
+    p.set_defaults(func=precheck)
+
+    p = sub.add_parser("hot-reload", help="swap latency and p99 blip of concurrent requests during reloads")
+    _add_liveness_args(p)
+    p.add_argument("--backend", default="torchscript")
+    p.add_argument("--clients", type=int, default=2, help="threads issuing liveness requests")
+    p.add_argument("--reloads", type=int, default=3)
+    p.add_argument("--settle", type=float, default=3.0, help="seconds of steady traffic around each reload")
+    p.set_defaults(func=hot_reload)
+
+    p = sub.add_parser("thread-budget", help="throughput per workers x request threads x intra-op threads")
+    _add_liveness_args(p)
+    p.add_argument("--cores", type=int, default=None, help="cores to budget for (default: available)")
+    p.add_argument("--seconds", type=float, default=5.0, help="measurement window per budget")
+    p.add_argument("--backend", default="torchscript", help="anti-spoof backend the workers load")
+    p.set_defaults(func=thread_budget_matrix)
+
+    p = sub.add_parser("early-exit", help="calibrate and evaluate the confidence-gated ensemble")
+    p.add_argument("--calibration_dir", required=True,
+                   help="frames in 0/1/2 class folders (1 = real) to calibrate the margin on")
+    p.add_argument("--eval_dir", default=None, help="labelled frames to evaluate on (default: calibration_dir)")
+    p.add_argument("--target_agreement", type=float, default=1.0,
+                   help="required agreement of early exits with the full ensemble")
+    p.add_argument("--model_dir", default="./resources/anti_spoof_models")
+    p.add_argument("--device_id", type=int, default=0)
+    p.add_argument("--backend", default="torchscript")
+    p.set_defaults(func=early_exit)
+
+    p = sub.add_parser("frame-ring", help="liveness FPS over the shared-memory frame ring")
+    p.add_argument("--images", nargs="+", default=["./images/sample/image_T1.jpg",
+                                                   "./images/sample/image_F1.jpg"])
+    p.add_argument("--height", type=int, default=640)
+    p.add_argument("--width", type=int, default=480)
+    p.add_argument("--slots", type=int, default=4)
+    p.add_argument("--fps", type=float, default=30, help="producer frame rate (0 = as fast as possible)")
+    p.add_argument("--seconds", type=float, default=10)
+    p.add_argument("--model_dir", default="./resources/anti_spoof_models")
+    p.add_argument("--device_id", type=int, default=0)
+    p.set_defaults(func=frame_ring)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    sys.exit(args.func(args))
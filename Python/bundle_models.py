@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# @File : bundle_models.py
+"""
+Pack every anti-spoof model of a directory into one bundle file: the
+BatchNorm-folded weights (``module.`` prefixes and the FT generator stripped)
+plus a manifest with each model's input size, scale, type and kernel, and each
+model's frozen TorchScript graph so the torchscript backend loads it instead of
+tracing (``--no_frozen`` leaves them out; they are only used by the torch
+version that wrote them).
+
+    python bundle_models.py --model_dir ./resources/anti_spoof_models \
+        --output ./resources/anti_spoof_models.fasb
+
+Pass the file wherever a model directory is expected (``model_dir`` of
+AntiSpoofPredict/ModelRegistry, ``anti_spoof_service.get_predictor``); names and specs then
+come from the manifest, not from file names.
+"""
+
+import argparse
+import os
+import warnings
+
+from src.frozen_models import FROZEN_BLOB, dump_frozen, freeze
+from src.model_bundle import write_bundle
+from src.model_registry import bundle_metadata, load_model
+
+warnings.filterwarnings('ignore')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pack the anti-spoof models into a single bundle")
+    parser.add_argument("--model_dir", type=str, default="./resources/anti_spoof_models")
+    parser.add_argument("--output", type=str, default="./resources/anti_spoof_models.fasb")
+    parser.add_argument("--no_frozen", action="store_true", help="store the weights only, no TorchScript graphs")
+    return parser.parse_args()
+
+
+def main(args):
+    members = []
+    for model_name in sorted(os.listdir(args.model_dir)):
+        if not model_name.endswith(".pth"):
+            continue
+        entry = load_model(os.path.join(args.model_dir, model_name), "cpu", fuse=True)
+        metadata = bundle_metadata(entry)
+        blobs = {}
+        if not args.no_frozen:
+            blobs[FROZEN_BLOB] = dump_frozen(freeze(entry.model, entry.spec.h_input, entry.spec.w_input, "cpu"))
+        members.append((metadata, entry.model.state_dict(), blobs))
+        print("{:<32} {} {}x{} scale {} kernel {}{}".format(
+            model_name, metadata['model_type'], metadata['h_input'], metadata['w_input'],
+            metadata['scale'], tuple(metadata['kernel']),
+            "  frozen graph {:.2f} MB".format(len(blobs[FROZEN_BLOB]) / 2 ** 20) if blobs else ""))
+    if not members:
+        raise SystemExit("no .pth models in {}".format(args.model_dir))
+    write_bundle(args.output, members)
+    print("{} models -> {} ({:.2f} MB)".format(len(members), args.output, os.path.getsize(args.output) / 2 ** 20))
+
+
+if __name__ == "__main__":
+    main(parse_args())
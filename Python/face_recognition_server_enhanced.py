@@ -4,20 +4,35 @@ Enhanced Face Recognition Server with Basic Image Analysis
 This version uses simple image analysis for better recognition than pure mock
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
-import base64
-import io
+import errno
 import json
 import logging
 import os
+import threading
 import time
 import hashlib
+import struct
+import uuid
 import requests  # Added for Cloudinary URL downloads
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from PIL import Image
 import numpy as np
 
+from src import anti_spoof_service, thread_budget
+from src.burst_liveness import SequentialLivenessTest, verify_burst
+from src.face_pipeline import (MOCK_FACE_LOCATION, MOCK_SPOOF_SCORE, PIPELINE_MODES, FaceAnalysis, StageTimer,
+                               face_features, score_face)
+from src.face_precheck import make_precheck
+from src.face_stream import FaceStream, StreamRegistry
+from src.feature_gallery import FeatureGallery
+from src.hot_reload import ReloadableModels, SourceWatcher
+from src.image_ingest import base64_buffer, decode_frame
+from src.liveness_cache import LivenessCache
+from src.quality_gate import QualityGate
+from src.simple_features import PreparedFeatures, gray_image_features, prepare_features, similarity_matrix
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -28,136 +43,440 @@ CORS(app)  # Enable CORS for all domains
 # Configuration
 CONFIDENCE_THRESHOLD = 0.90  # 90% confidence required for attendance
 SIMILARITY_THRESHOLD = 0.70  # 70% similarity = 90%+ confidence
+LOCAL_RPC_SOCKET = os.environ.get('FACE_RPC_SOCKET')  # Unix socket for co-located callers
+MAX_BATCH_IMAGES = 64  # Images accepted by one /recognize-batch call
+DECODE_WORKERS = 8  # Threads downloading and decoding batch images
+MAX_ENCODE_BATCH_ITEMS = 10000  # Enrolments accepted by one /encode-batch call
+ENCODE_CHUNK_SIZE = 256  # Images held in memory at once during /encode-batch
+ANTI_SPOOF_MODEL_DIR = os.environ.get('ANTI_SPOOF_MODEL_DIR', './resources/anti_spoof_models')  # Directory or bundle
+# 'fused': real detection + liveness, features from the face; 'mock': whole-frame features, fixed spoof score
+PIPELINE_MODE = os.environ.get('FACE_PIPELINE_MODE', 'fused')
+ANTI_SPOOF_WATCH_INTERVAL = float(os.environ.get('ANTI_SPOOF_WATCH_INTERVAL', 0))  # Seconds between model file checks; 0 = off
+# Touched by /admin/reload-models so the watchers of the other workers reload too
+ANTI_SPOOF_RELOAD_SENTINEL = os.environ.get('ANTI_SPOOF_RELOAD_SENTINEL',
+                                            ANTI_SPOOF_MODEL_DIR.rstrip('/\\') + '.reload')
+# Reuse of ensemble outputs for near-identical face crops (retries, double submits): seconds an
+# output stays valid (0 = off, e.g. for high-security gates) and the hash bits that may differ
+LIVENESS_CACHE_TTL = float(os.environ.get('LIVENESS_CACHE_TTL', 5))
+LIVENESS_CACHE_DISTANCE = int(os.environ.get('LIVENESS_CACHE_DISTANCE', 12))
+# Reject blurry, dark, overexposed or flat frames and unusable face sizes before the models run
+QUALITY_GATE_ENABLED = os.environ.get('FACE_QUALITY_GATE', '1') != '0'
+# Video streams (/stream): detector re-run interval in frames, similarity margin above the
+# threshold for a tracked identity to be trusted without re-recognition, idle timeout
+STREAM_DETECT_INTERVAL = int(os.environ.get('FACE_STREAM_DETECT_INTERVAL', 15))
+STREAM_REVERIFY_INTERVAL = int(os.environ.get('FACE_STREAM_REVERIFY_INTERVAL', 90))
+# Pre-check of each stream's own frames while nobody is in view: 'motion', 'cascade' or 'none'
+STREAM_PRECHECK = os.environ.get('FACE_STREAM_PRECHECK', 'motion')
+STREAM_CERTAIN_MARGIN = 0.05
+STREAM_IDLE_SECONDS = 60
+MAX_STREAMS = 64
+STREAM_FRAME_PREFIX = struct.Struct('>I')  # Length prefix of each frame in a chunked /stream upload
+# /verify-burst: frames accepted per burst, the target error rates of its sequential liveness
+# test and the crop-hash bits within which a frame repeats an earlier one (no new evidence)
+MAX_BURST_FRAMES = 16
+BURST_FALSE_ACCEPT = float(os.environ.get('FACE_BURST_FALSE_ACCEPT', 0.01))
+BURST_FALSE_REJECT = float(os.environ.get('FACE_BURST_FALSE_REJECT', 0.05))
+BURST_DUPLICATE_DISTANCE = int(os.environ.get('FACE_BURST_DUPLICATE_DISTANCE', 8))
+# Cores, server processes, concurrent requests and intra-op threads (see src/thread_budget.py)
+THREAD_BUDGET = thread_budget.ThreadBudget.from_env()
+ENCODE_WORKERS = THREAD_BUDGET.extract_processes  # Processes extracting mock-mode /encode-batch features
 
-# Store image hashes for basic recognition (simulates face encodings)
-stored_image_features = {}
+# Size the torch/OpenCV pools before any model loads; requests beyond the budget queue.
+# A request holds a slot only while it decodes or runs models, never while downloading
+thread_budget.apply(THREAD_BUDGET)
+compute_slots = thread_budget.request_slots(THREAD_BUDGET)
 
-def download_image_from_url(image_url):
-    """Download image from Cloudinary URL and convert to PIL Image"""
-    try:
-        logger.info(f"🔗 Downloading image from URL: {image_url[:100]}...")
-        response = requests.get(image_url, timeout=10)
-        response.raise_for_status()
-        
-        # Convert to PIL Image
-        pil_image = Image.open(io.BytesIO(response.content))
-        
-        # Convert to RGB if necessary
-        if pil_image.mode != 'RGB':
-            pil_image = pil_image.convert('RGB')
-        
-        logger.info(f"✅ Successfully downloaded image: {pil_image.size}")
-        return pil_image
-    except Exception as e:
-        logger.error(f"❌ Error downloading image from URL: {e}")
-        return None
+# Store image features for basic recognition (simulates face encodings).
+# Readers take a snapshot; writers publish a new version (see src/feature_gallery.py)
+feature_gallery = FeatureGallery()
 
-def base64_to_image(base64_string):
-    """Convert base64 string to PIL Image"""
-    try:
-        # Remove data URL prefix if present
-        if ',' in base64_string:
-            base64_string = base64_string.split(',')[1]
-        
-        # Decode base64
-        image_data = base64.b64decode(base64_string)
-        
-        # Convert to PIL Image
-        pil_image = Image.open(io.BytesIO(image_data))
-        
-        # Convert to RGB if necessary
-        if pil_image.mode != 'RGB':
-            pil_image = pil_image.convert('RGB')
-        
-        return pil_image
-    except Exception as e:
-        logger.error(f"Error converting base64 to image: {str(e)}")
-        return None
+# Recent ensemble outputs by face-crop hash, shared by every model generation (see src/liveness_cache.py)
+liveness_cache = LivenessCache(LIVENESS_CACHE_TTL, LIVENESS_CACHE_DISTANCE)
+
+# Image-quality checks in front of detection and liveness (see src/quality_gate.py); None when disabled
+quality_gate = QualityGate() if QUALITY_GATE_ENABLED else None
+
+# Open video streams with their tracking state (see src/face_stream.py)
+streams = StreamRegistry(STREAM_IDLE_SECONDS, MAX_STREAMS)
+
+# Shared pool for downloading/decoding images of batch requests
+decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix='decode')
 
-def process_image_input(data):
-    """Process image from either Cloudinary URL or base64 data"""
+def load_anti_spoof_models():
+    """A warmed-up predictor for the current ANTI_SPOOF_MODEL_DIR (torch is imported on first load)"""
+    from src.anti_spoof_predict import AntiSpoofPredict
+    predictor = AntiSpoofPredict(0, ANTI_SPOOF_MODEL_DIR, backend=anti_spoof_service.ANTI_SPOOF_BACKEND,
+                                 early_exit_margin=anti_spoof_service.ANTI_SPOOF_EARLY_EXIT_MARGIN,
+                                 precheck=anti_spoof_service.ANTI_SPOOF_PRECHECK, liveness_cache=liveness_cache,
+                                 ensemble_threads=THREAD_BUDGET.ensemble_threads)
+    predictor.warm_up()
+    return predictor
+
+# Anti-spoof models, loaded on first use and hot-swappable through /admin/reload-models
+# (see src/hot_reload.py); requests hold a lease on the generation they started with
+anti_spoof_models = ReloadableModels(load_anti_spoof_models, release=lambda predictor: predictor.close())
+
+# Worker processes for bulk mock-mode feature extraction, started on first use
+_extract_pool = None
+
+def get_extract_pool():
+    global _extract_pool
+    if _extract_pool is None:
+        # Single-threaded workers: the budget counts each as one compute thread
+        _extract_pool = ProcessPoolExecutor(max_workers=ENCODE_WORKERS, initializer=thread_budget.apply,
+                                            initargs=(THREAD_BUDGET.single_threaded(),))
+    return _extract_pool
+
+def download_image_bytes(image_url):
+    """Download an encoded image from a Cloudinary URL"""
+    response = requests.get(image_url, timeout=10)
+    response.raise_for_status()
+    return response.content
+
+def fetch_image_bytes(item):
+    """Encoded bytes of a request's image (raw, downloaded or base64-decoded); raises on failure"""
+    if 'image_bytes' in item:
+        return item['image_bytes']
+    if 'image_url' in item:
+        return download_image_bytes(item['image_url'])
+    return base64_buffer(item['image'])
+
+def read_image_input(data):
+    """
+    Encoded bytes of the image of a request, from raw bytes (local RPC), a
+    Cloudinary URL or base64 data; None on failure. Runs outside the compute
+    slots: decoding the bytes (bytes_to_frame) is what needs one.
+    """
     try:
-        # Check if image_url is provided (Cloudinary)
-        if 'image_url' in data:
-            logger.info("📷 Processing image from Cloudinary URL")
-            return download_image_from_url(data['image_url'])
-        
-        # Check if base64 image is provided (fallback)
-        elif 'image' in data:
-            logger.info("📷 Processing base64 image")
-            return base64_to_image(data['image'])
-        
+        # Raw bytes arrive only through the local RPC transport
+        if 'image_bytes' in data:
+            logger.info("📷 Processing raw image bytes")
+        elif 'image_url' in data:
+            logger.info(f"🔗 Downloading image from Cloudinary URL: {data['image_url'][:100]}...")
         else:
-            logger.error("❌ No image data provided (neither image_url nor image)")
-            return None
-            
+            logger.info("📷 Processing base64 image")
+        return fetch_image_bytes(data)
     except Exception as e:
         logger.error(f"❌ Error processing image input: {e}")
         return None
 
-def extract_simple_features(image):
-    """Extract simple features from image for basic recognition"""
-    try:
-        # Resize image to standard size
-        image_resized = image.resize((64, 64))
-        
-        # Convert to grayscale
-        image_gray = image_resized.convert('L')
-        
-        # Get image array
-        image_array = np.array(image_gray)
-        
-        # Extract simple features
-        features = {
-            'mean': float(np.mean(image_array)),
-            'std': float(np.std(image_array)),
-            'histogram': np.histogram(image_array, bins=16)[0].tolist(),
-            'corners': [
-                float(image_array[0, 0]),    # top-left
-                float(image_array[0, -1]),   # top-right
-                float(image_array[-1, 0]),   # bottom-left
-                float(image_array[-1, -1])   # bottom-right
-            ]
-        }
-        
-        return features
-    except Exception as e:
-        logger.error(f"Error extracting features: {str(e)}")
+def bytes_to_frame(image_data):
+    """Decode encoded image bytes (a bytearray from the local RPC, no copy) to a Frame; None on failure"""
+    frame = decode_frame(image_data) if image_data is not None else None
+    if frame is None and image_data is not None:
+        logger.error("Error converting image bytes to image: unsupported image")
+    return frame
+
+def has_image_input(data):
+    """True if the request carries an image in any supported form"""
+    return 'image_url' in data or 'image' in data or 'image_bytes' in data
+
+def build_encoding(features):
+    """Lay the features out as a 128-value encoding like real face encodings"""
+    return (
+        [features['mean'], features['std']] + 
+        features['histogram'] + 
+        features['corners'] + 
+        [0] * (128 - 22)  # Pad to 128 dimensions like real face encodings
+    )
+
+def image_source_key(data):
+    """Bytes identifying the submitted image, used by the hash fallback"""
+    if 'image_bytes' in data:
+        return bytes(data['image_bytes'])
+    elif 'image_url' in data:
+        return data['image_url'].encode()
+    return data['image'].encode()
+
+def _hash_value(raw):
+    return int(hashlib.md5(raw).hexdigest()[:8], 16)
+
+def score_probes(probe_features, probe_keys, stored_encodings, snapshot):
+    """
+    Similarity of every probe image to every enrolled encoding, shape
+    (probes, encodings). Students with features in the gallery snapshot are
+    scored in one matrix operation; the rest use the hash fallback.
+    """
+    row_of, gallery = snapshot.prepared()
+    scores = np.empty((len(probe_features), len(stored_encodings)))
+    
+    known, rows, unknown = [], [], []
+    for column, encoding_data in enumerate(stored_encodings):
+        row = row_of.get(encoding_data['studentId'])
+        if row is None:
+            unknown.append(column)
+        else:
+            known.append(column)
+            rows.append(row)
+    
+    if known:
+        enrolled = PreparedFeatures(*(field[rows] for field in gallery))
+        scores[:, known] = similarity_matrix(prepare_features(probe_features), enrolled)
+    
+    if unknown:
+        # Fallback: use a hash-based approach for consistency (not very accurate but consistent)
+        image_hashes = np.array([_hash_value(key) for key in probe_keys], dtype=np.float64)
+        encoding_hashes = np.array([
+            _hash_value(str(stored_encodings[column]['encoding']).encode()) for column in unknown
+        ], dtype=np.float64)
+        hash_similarity = 1.0 - np.abs(image_hashes[:, None] - encoding_hashes[None, :]) / 0xFFFFFFFF
+        scores[:, unknown] = np.maximum(0, hash_similarity)
+    
+    return scores
+
+def recognition_result(scores, stored_encodings):
+    """Turn one probe's scores into the /recognize response body and status"""
+    best_index = int(np.argmax(scores))
+    best_similarity = float(scores[best_index])
+    best_match = stored_encodings[best_index] if best_similarity > 0 else None
+    if best_match is None:
+        best_similarity = 0
+    
+    # Check if best match meets threshold - STRICT 90% confidence requirement
+    confidence_threshold = 0.70  # 70% similarity = 90%+ confidence for attendance
+    
+    if best_similarity < confidence_threshold:
+        return {
+            "success": False,
+            "message": f"Face recognition confidence too low: {best_similarity * 100:.1f}%. Minimum 90% required for attendance.",
+            "best_similarity": round(best_similarity, 3),
+            "required_threshold": "90%",
+            "security_note": "High confidence required to prevent false attendance marking"
+        }, 404
+    
+    # Convert similarity to confidence percentage - MORE STRICT
+    confidence = min(100, best_similarity * 100)
+    
+    # Additional check: Only allow attendance if confidence >= 90%
+    if confidence < 90:
+        return {
+            "success": False,
+            "message": f"Confidence {confidence:.1f}% is below 90% threshold. Cannot mark attendance.",
+            "confidence": round(confidence, 1),
+            "required_confidence": "90%",
+            "security_note": "High confidence required for genuine attendance marking"
+        }, 404
+    
+    logger.info(f"Enhanced face recognized: Student {best_match['studentId']} with {confidence:.1f}% confidence")
+    
+    return {
+        "success": True,
+        "message": "Face recognized successfully (ENHANCED MODE - Using basic image analysis)",
+        "studentId": best_match['studentId'],
+        "confidence": round(confidence, 1),
+        "similarity": round(best_similarity, 3),
+        "distance": round(1 - best_similarity, 3),
+        "spoof_score": MOCK_SPOOF_SCORE,
+        "face_location": MOCK_FACE_LOCATION,
+        "timestamp": datetime.now().isoformat(),
+        "note": "Using basic image analysis for better recognition than pure mock mode."
+    }, 200
+
+def pipeline_mode(data):
+    """Mode of one request: a "pipeline" field overrides FACE_PIPELINE_MODE. None if unknown"""
+    mode = data.get('pipeline', PIPELINE_MODE)
+    return mode if mode in PIPELINE_MODES else None
+
+def unknown_pipeline_response(data):
+    return {
+        "success": False,
+        "message": f"Unknown pipeline mode {data.get('pipeline')!r}, expected one of {list(PIPELINE_MODES)}"
+    }, 400
+
+def use_liveness_cache(data):
+    """A request can opt out of the liveness cache with "liveness_cache": false (it cannot opt in)"""
+    return data.get('liveness_cache', True) is not False
+
+def quality_body(issue):
+    """Structured reason of a quality-gate rejection"""
+    return {
+        "reason": issue.reason,
+        "value": round(issue.value, 3),
+        "limit": issue.limit
+    }
+
+def quality_rejection(issue, timer, **fields):
+    logger.info(f"Quality gate rejected image: {issue.reason} ({issue.value:.1f} vs limit {issue.limit})")
+    return {
+        "success": False,
+        "message": f"Image quality too low: {issue.reason.replace('_', ' ')}",
+        "quality": quality_body(issue),
+        **fields,
+        "timings_ms": timer.report()
+    }, 400
+
+def check_frame_quality(frame, timer):
+    """QualityIssue of a decoded Frame, or None (also when the gate is disabled)"""
+    if quality_gate is None:
         return None
+    with timer.stage('quality'):
+        return quality_gate.check_frame(frame.gray)
 
-def compare_features(features1, features2):
-    """Compare two feature sets and return similarity score"""
-    try:
-        # Compare means
-        mean_diff = abs(features1['mean'] - features2['mean']) / 255.0
-        
-        # Compare standard deviations
-        std_diff = abs(features1['std'] - features2['std']) / 255.0
-        
-        # Compare histograms
-        hist1 = np.array(features1['histogram'])
-        hist2 = np.array(features2['histogram'])
-        hist_correlation = np.corrcoef(hist1, hist2)[0, 1]
-        if np.isnan(hist_correlation):
-            hist_correlation = 0
-        
-        # Compare corners
-        corners1 = np.array(features1['corners'])
-        corners2 = np.array(features2['corners'])
-        corners_diff = np.mean(np.abs(corners1 - corners2)) / 255.0
-        
-        # Calculate overall similarity (higher is more similar)
-        similarity = (
-            (1 - mean_diff) * 0.2 +
-            (1 - std_diff) * 0.2 +
-            abs(hist_correlation) * 0.4 +
-            (1 - corners_diff) * 0.2
-        )
-        
-        return max(0, min(1, similarity))
-    except Exception as e:
-        logger.error(f"Error comparing features: {str(e)}")
-        return 0
+def analyze_image(frame, timer, use_cache=True, mode='fused'):
+    """
+    Pipeline of one decoded Frame, shared by the single-image and batch
+    endpoints: returns (FaceAnalysis, None), or (None, (error body, status))
+    when there is no usable live face. In 'fused' mode the quality gate runs
+    before detection (frame) and before liveness (face size); 'mock' takes the
+    whole-frame features with the fixed spoof score and location.
+    """
+    if mode == 'mock':
+        with timer.stage('features'):
+            features = gray_image_features(frame.gray)
+        return face_with_features(FaceAnalysis(MOCK_FACE_LOCATION, MOCK_SPOOF_SCORE, True, features), timer)
+    issue = check_frame_quality(frame, timer)
+    if issue is not None:
+        return None, quality_rejection(issue, timer)
+    face = None
+    with anti_spoof_models.lease() as predictor:
+        with timer.stage('detect'):
+            bbox = predictor.find_bbox(frame.bgr, frame.gray)
+        if bbox is not None:
+            issue = quality_gate.check_face(frame.width, frame.height, bbox) if quality_gate else None
+            if issue is None:
+                face = score_face(frame, bbox, predictor, timer, use_cache)
+    if issue is not None:
+        return None, quality_rejection(issue, timer, face_location=bbox)
+    if face is None:
+        return None, ({
+            "success": False,
+            "message": "No face detected in image",
+            "timings_ms": timer.report()
+        }, 400)
+    if not face.is_real:
+        logger.info(f"Anti-spoofing rejected face at {face.bbox} (spoof_score={face.spoof_score:.3f})")
+        return None, ({
+            "success": False,
+            "message": "Face failed the anti-spoofing check",
+            "spoof_score": round(face.spoof_score, 3),
+            "face_location": face.bbox,
+            "timings_ms": timer.report()
+        }, 400)
+    return face_with_features(face, timer)
+
+def face_with_features(face, timer):
+    if face.features is None:
+        return None, ({
+            "success": False,
+            "message": "Could not extract features from image",
+            "timings_ms": timer.report()
+        }, 400)
+    return face, None
+
+def analyze_encoded(image_data, mode, use_cache=True):
+    """
+    Decode encoded image bytes and run analyze_image: one batch item. Returns
+    (FaceAnalysis or None, error or None, stage timings). Top-level and
+    picklable, so mock-mode /encode-batch can run it in a worker process.
+    """
+    timer = StageTimer()
+    with timer.stage('decode'):
+        frame = decode_frame(image_data)
+    if frame is None:
+        return None, ({
+            "success": False,
+            "message": "Failed to process image data"
+        }, 400), timer.report()
+    face, error = analyze_image(frame, timer, use_cache, mode)
+    return face, error, timer.report()
+
+def recognize_faces(frame, data, stored_encodings, timer, mode='fused'):
+    """
+    Multi-face /recognize: every face of the frame is checked for liveness in one
+    ensemble pass and the live ones are matched in one scoring pass, so a group
+    frame can mark several students. Each student is credited to at most one
+    face. In 'mock' mode the whole frame is the one face, as on the single-face path.
+    """
+    if mode == 'mock':
+        face, error = analyze_image(frame, timer, mode=mode)
+        if error is not None:
+            return error
+        faces, issues = [(face.bbox, None)], [None]
+        spoof_scores, features = {0: face.spoof_score}, {0: face.features}
+    else:
+        issue = check_frame_quality(frame, timer)
+        if issue is not None:
+            return quality_rejection(issue, timer, faces=[], pipeline=mode)
+        with anti_spoof_models.lease() as predictor:
+            with timer.stage('detect'):
+                faces = predictor.get_faces(frame.bgr, frame.gray)
+            if not faces:
+                return {
+                    "success": False,
+                    "message": "No face detected in image",
+                    "faces": [],
+                    "pipeline": mode,
+                    "timings_ms": timer.report()
+                }, 404
+            bboxes = [bbox for bbox, _ in faces]
+            # Faces too small or too large to score skip liveness and matching
+            issues = [quality_gate.check_face(frame.width, frame.height, bbox) if quality_gate else None
+                      for bbox in bboxes]
+            usable = [i for i, issue in enumerate(issues) if issue is None]
+            with timer.stage('liveness'):
+                # Summed softmax over the ensemble, one row per usable face; class 1 is a real face
+                rows = predictor.ensemble.predict_faces([(frame.bgr, bboxes[i]) for i in usable],
+                                                        use_liveness_cache(data)) / len(predictor.registry)
+        spoof_scores = {i: float(row[1]) for i, row in zip(usable, rows)}
+        # Spoofed faces are never matched, so their features are not extracted
+        with timer.stage('features'):
+            features = {i: face_features(frame, bboxes[i]) for i, row in zip(usable, rows)
+                        if int(np.argmax(row)) == 1}
+    
+    source_key = image_source_key(data)
+    scored = [i for i, probe in features.items() if probe is not None]
+    with timer.stage('match'):
+        scores = score_probes([features[i] for i in scored],
+                              [source_key + str(faces[i][0]).encode() for i in scored],
+                              stored_encodings, feature_gallery.snapshot()) if scored else []
+    scores_of = dict(zip(scored, scores))
+    
+    results = []
+    for i, (bbox, detection_score) in enumerate(faces):
+        if issues[i] is not None:
+            body = {
+                "success": False,
+                "message": f"Image quality too low: {issues[i].reason.replace('_', ' ')}",
+                "quality": quality_body(issues[i])
+            }
+        elif i not in features:
+            body = {
+                "success": False,
+                "message": "Face failed the anti-spoofing check"
+            }
+        elif i not in scores_of:
+            body = {
+                "success": False,
+                "message": "Could not extract features from face"
+            }
+        else:
+            body, _ = recognition_result(scores_of[i], stored_encodings)
+        body.update({
+            "face_location": bbox,
+            "detection_confidence": round(detection_score, 3) if detection_score is not None else None,
+            "spoof_score": round(spoof_scores[i], 3) if i in spoof_scores else None
+        })
+        results.append(body)
+    
+    # A student standing in several faces (e.g. a photo held up) is credited once, to the best match
+    students = {}
+    for body in sorted((body for body in results if body["success"]), key=lambda body: -body["similarity"]):
+        if body["studentId"] in students:
+            body.update({"success": False, "message": "Student already matched to another face in this frame"})
+        else:
+            students[body["studentId"]] = body["confidence"]
+    
+    logger.info(f"Multi-face recognition: {len(students)} of {len(faces)} faces matched")
+    return {
+        "success": bool(students),
+        "message": f"{len(students)} of {len(faces)} faces recognized",
+        "students": [{"studentId": student_id, "confidence": confidence}
+                     for student_id, confidence in students.items()],
+        "faces": results,
+        "pipeline": mode,
+        "timings_ms": timer.report(),
+        "timestamp": datetime.now().isoformat()
+    }, 200 if students else 404
 
 @app.route('/', methods=['GET'])
 def health_check():
@@ -170,212 +489,713 @@ def health_check():
         "note": "Using basic image analysis for better recognition than pure mock mode."
     })
 
-@app.route('/encode', methods=['POST'])
-def encode_face():
+def encode_request(data):
     """
-    Enhanced face encoding endpoint with basic image analysis
-    Supports both Cloudinary URLs and base64 images
+    Core of /encode, shared by the HTTP route and the local RPC transport.
+    Returns (response body, status code).
     """
     try:
-        data = request.get_json()
-        
         if not data:
-            return jsonify({
+            return {
                 "success": False,
                 "message": "No data provided"
-            }), 400
+            }, 400
         
         # Check for either image_url or image field
-        if 'image_url' not in data and 'image' not in data:
-            return jsonify({
+        if not has_image_input(data):
+            return {
                 "success": False,
                 "message": "No image data provided (image_url or image required)"
-            }), 400
+            }, 400
         
         student_id = data.get('studentId', 'unknown')
+        mode = pipeline_mode(data)
+        if mode is None:
+            return unknown_pipeline_response(data)
+        timer = StageTimer()
         
         logger.info(f"🎯 Processing enhanced face encoding for student: {student_id}")
         
-        # Process image from either Cloudinary URL or base64
-        image = process_image_input(data)
-        if image is None:
-            return jsonify({
-                "success": False,
-                "message": "Failed to process image data"
-            }), 400
-        
-        # Extract simple features
-        features = extract_simple_features(image)
-        if features is None:
-            return jsonify({
-                "success": False,
-                "message": "Could not extract features from image"
-            }), 400
+        # Image from either Cloudinary URL or base64, fetched before taking a compute slot
+        with timer.stage('fetch'):
+            image_data = read_image_input(data)
+        with compute_slots:
+            with timer.stage('decode'):
+                frame = bytes_to_frame(image_data)
+            if frame is None:
+                return {
+                    "success": False,
+                    "message": "Failed to process image data"
+                }, 400
+            
+            # Detection, liveness and features of the detected face (whole frame in mock mode)
+            face, error = analyze_image(frame, timer, use_liveness_cache(data), mode)
+        if error is not None:
+            return error
         
         # Store features for this student
-        stored_image_features[student_id] = features
+        feature_gallery.put(student_id, face.features)
         
         # Generate encoding (use features as encoding)
-        encoding = (
-            [features['mean'], features['std']] + 
-            features['histogram'] + 
-            features['corners'] + 
-            [0] * (128 - 22)  # Pad to 128 dimensions like real face encodings
-        )
+        encoding = build_encoding(face.features)
+        timings = timer.report()
         
-        logger.info(f"Successfully generated enhanced encoding for student: {student_id}")
+        logger.info(f"Successfully generated enhanced encoding for student: {student_id} ({mode}, {timings})")
         
-        return jsonify({
+        return {
             "success": True,
             "message": "Face encoded successfully (ENHANCED MODE - Using basic image analysis)",
             "encoding": encoding,
             "studentId": student_id,
-            "spoof_score": 1,  # Mock anti-spoofing score
-            "face_location": [50, 200, 250, 100],  # Mock face location
+            "spoof_score": round(face.spoof_score, 3),
+            "face_location": face.bbox,
+            "pipeline": mode,
+            "timings_ms": timings,
             "timestamp": datetime.now().isoformat(),
             "note": "Using basic image analysis for better recognition than pure mock mode."
-        })
+        }, 200
         
     except Exception as e:
         logger.error(f"Error in enhanced face encoding: {str(e)}")
-        return jsonify({
+        return {
             "success": False,
             "message": "Internal server error during face encoding",
             "error": str(e)
-        }), 500
+        }, 500
 
-@app.route('/recognize', methods=['POST'])
-def recognize_face():
+def recognize_request(data):
     """
-    Enhanced face recognition endpoint with basic image analysis
-    Supports both Cloudinary URLs and base64 images
+    Core of /recognize, shared by the HTTP route and the local RPC transport.
+    Returns (response body, status code).
     """
     try:
-        data = request.get_json()
-        
         if not data:
-            return jsonify({
+            return {
                 "success": False,
                 "message": "No data provided"
-            }), 400
+            }, 400
         
         # Check for either image_url or image field
-        if 'image_url' not in data and 'image' not in data:
-            return jsonify({
+        if not has_image_input(data):
+            return {
                 "success": False,
                 "message": "No image data provided (image_url or image required)"
-            }), 400
+            }, 400
             
         if 'encodings' not in data:
-            return jsonify({
+            return {
                 "success": False,
                 "message": "Missing face encodings data"
-            }), 400
+            }, 400
         
         stored_encodings = data['encodings']
         
         if not stored_encodings:
-            return jsonify({
+            return {
                 "success": False,
                 "message": "No enrolled students found for comparison"
-            }), 400
+            }, 400
+        
+        mode = pipeline_mode(data)
+        if mode is None:
+            return unknown_pipeline_response(data)
+        timer = StageTimer()
         
         logger.info(f"🎯 Processing enhanced face recognition against {len(stored_encodings)} enrolled students")
         
-        # Process image from either Cloudinary URL or base64
-        image = process_image_input(data)
-        if image is None:
-            return jsonify({
+        # Image from either Cloudinary URL or base64, fetched before taking a compute slot
+        with timer.stage('fetch'):
+            image_data = read_image_input(data)
+        with compute_slots:
+            with timer.stage('decode'):
+                frame = bytes_to_frame(image_data)
+            if frame is None:
+                return {
+                    "success": False,
+                    "message": "Failed to process image data"
+                }, 400
+            
+            if data.get('multi_face'):
+                return recognize_faces(frame, data, stored_encodings, timer, mode)
+            
+            face, error = analyze_image(frame, timer, use_liveness_cache(data), mode)
+        if error is not None:
+            return error
+        
+        # Compare with stored features, all against one consistent version
+        with timer.stage('match'):
+            scores = score_probes([face.features], [image_source_key(data)],
+                                  stored_encodings, feature_gallery.snapshot())[0]
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            for encoding_data, similarity in zip(stored_encodings, scores):
+                logger.debug(f"Student {encoding_data['studentId']}: similarity={similarity:.3f}")
+        
+        body, status = recognition_result(scores, stored_encodings)
+        body.update({"spoof_score": round(face.spoof_score, 3), "face_location": face.bbox,
+                     "pipeline": mode, "timings_ms": timer.report()})
+        return body, status
+        
+    except Exception as e:
+        logger.error(f"Error in enhanced face recognition: {str(e)}")
+        return {
+            "success": False,
+            "message": "Internal server error during face recognition",
+            "error": str(e)
+        }, 500
+
+def _encode_batch_error(index, student_id, message, status=400):
+    return {
+        "index": index,
+        "studentId": student_id,
+        "status": status,
+        "success": False,
+        "message": message
+    }
+
+def _batch_item_error(index, error, **fields):
+    """Per-item result of a batch image that analyze_image turned down"""
+    body, status = error
+    return {"index": index, **fields, "status": status, **body}
+
+def encode_batch_request(items, options=None):
+    """
+    Core of /encode-batch: fetch images concurrently, run each through the
+    same pipeline as /encode and commit every enrolment to the gallery in one
+    write. ``options`` carries the request-wide "pipeline" and
+    "liveness_cache" fields. Returns (response body, status code).
+    """
+    try:
+        options = options or {}
+        mode = pipeline_mode(options)
+        if mode is None:
+            return unknown_pipeline_response(options)
+        use_cache = use_liveness_cache(options)
+        
+        if not items:
+            return {
                 "success": False,
-                "message": "Failed to process image data"
-            }), 400
+                "message": "No enrolments provided"
+            }, 400
         
-        # Extract features from current image
-        current_features = extract_simple_features(image)
-        if current_features is None:
-            return jsonify({
+        if len(items) > MAX_ENCODE_BATCH_ITEMS:
+            return {
                 "success": False,
-                "message": "Could not extract features from image"
-            }), 400
+                "message": f"Too many enrolments: {len(items)} (maximum {MAX_ENCODE_BATCH_ITEMS} per batch)"
+            }, 400
         
-        # Compare with stored features
-        best_match = None
-        best_similarity = 0
+        logger.info(f"🎯 Processing batch encoding of {len(items)} enrolments")
         
-        for encoding_data in stored_encodings:
-            student_id = encoding_data['studentId']
+        results = [None] * len(items)
+        enrolled = {}
+        # Mock features are plain CPU work, spread over worker processes; the fused
+        # pipeline runs here, on the models this process has loaded
+        extract_pool = get_extract_pool() if mode == 'mock' else None
+        
+        for chunk_start in range(0, len(items), ENCODE_CHUNK_SIZE):
+            chunk = range(chunk_start, min(chunk_start + ENCODE_CHUNK_SIZE, len(items)))
             
-            # Use stored features if available, otherwise use encoding data
-            if student_id in stored_image_features:
-                stored_features = stored_image_features[student_id]
-                similarity = compare_features(current_features, stored_features)
-            else:
-                # Fallback: use a hash-based approach for consistency
-                # Generate hash from image data or URL
-                if 'image_url' in data:
-                    image_data = data['image_url']
+            downloads = {}
+            for index in chunk:
+                item = items[index]
+                student_id = item.get('studentId') if isinstance(item, dict) else None
+                if not student_id:
+                    results[index] = _encode_batch_error(index, student_id, "studentId is required")
+                elif 'image_url' not in item and 'image' not in item:
+                    results[index] = _encode_batch_error(
+                        index, student_id, "No image data provided (image_url or image required)")
                 else:
-                    image_data = data['image']
-                image_hash = hashlib.md5(image_data.encode()).hexdigest()
-                encoding_hash = hashlib.md5(str(encoding_data['encoding']).encode()).hexdigest()
-                
-                # Simple hash comparison (not very accurate but consistent)
-                hash_similarity = 1.0 - (abs(int(image_hash[:8], 16) - int(encoding_hash[:8], 16)) / 0xFFFFFFFF)
-                similarity = max(0, hash_similarity)
+                    downloads[index] = decode_pool.submit(fetch_image_bytes, item)
             
-            logger.info(f"Student {student_id}: similarity={similarity:.3f}")
+            analyses = {}
+            for index, download in downloads.items():
+                try:
+                    image_data = download.result()
+                except Exception as e:
+                    logger.error(f"❌ Error fetching image for batch item {index}: {e}")
+                    results[index] = _encode_batch_error(index, items[index]['studentId'], "Failed to process image data")
+                    continue
+                analyses[index] = extract_pool.submit(analyze_encoded, image_data, mode, use_cache) \
+                    if extract_pool else image_data
             
-            if similarity > best_similarity:
-                best_similarity = similarity
-                best_match = encoding_data
+            for index, analysis in analyses.items():
+                student_id = items[index]['studentId']
+                try:
+                    if extract_pool:
+                        # Waiting on the worker processes (budgeted on their own) holds no slot
+                        face, error, timings = analysis.result()
+                    else:
+                        # One slot per image, so single requests interleave with a long batch
+                        with compute_slots:
+                            face, error, timings = analyze_encoded(analysis, mode, use_cache)
+                except Exception as e:
+                    logger.error(f"❌ Feature extraction failed for batch item {index}: {e}")
+                    results[index] = _encode_batch_error(index, student_id, "Could not extract features from image")
+                    continue
+                if error is not None:
+                    results[index] = _batch_item_error(index, error, studentId=student_id)
+                    continue
+                enrolled[student_id] = face.features
+                results[index] = {
+                    "index": index,
+                    "studentId": student_id,
+                    "status": 200,
+                    "success": True,
+                    "encoding": build_encoding(face.features),
+                    "spoof_score": round(face.spoof_score, 3),
+                    "face_location": face.bbox,
+                    "timings_ms": timings
+                }
+        
+        # One gallery version for the whole batch
+        if enrolled:
+            feature_gallery.update(enrolled)
+        
+        encoded = sum(1 for result in results if result["success"])
+        logger.info(f"Successfully encoded {encoded} of {len(items)} enrolments")
         
-        # Check if best match meets threshold - STRICT 90% confidence requirement
-        confidence_threshold = 0.70  # 70% similarity = 90%+ confidence for attendance
+        return {
+            "success": True,
+            "message": f"Encoded {encoded} of {len(items)} enrolments (ENHANCED MODE - Using basic image analysis)",
+            "count": len(items),
+            "encoded": encoded,
+            "failed": len(items) - encoded,
+            "pipeline": mode,
+            "results": results,
+            "timestamp": datetime.now().isoformat()
+        }, 200
+        
+    except Exception as e:
+        logger.error(f"Error in batch face encoding: {str(e)}")
+        return {
+            "success": False,
+            "message": "Internal server error during batch face encoding",
+            "error": str(e)
+        }, 500
+
+def recognize_batch_request(items, stored_encodings, options=None):
+    """
+    Core of /recognize-batch: fetch all images in parallel, run each through
+    the same pipeline as /recognize, then score every live face against the
+    enrolled gallery in one matrix operation. ``options`` carries the
+    request-wide "pipeline" and "liveness_cache" fields.
+    Returns (response body, status code).
+    """
+    try:
+        options = options or {}
+        mode = pipeline_mode(options)
+        if mode is None:
+            return unknown_pipeline_response(options)
+        use_cache = use_liveness_cache(options)
         
-        if best_similarity < confidence_threshold:
-            return jsonify({
+        if not items:
+            return {
                 "success": False,
-                "message": f"Face recognition confidence too low: {best_similarity * 100:.1f}%. Minimum 90% required for attendance.",
-                "best_similarity": round(best_similarity, 3),
-                "required_threshold": "90%",
-                "security_note": "High confidence required to prevent false attendance marking"
-            }), 404
-        
-        # Convert similarity to confidence percentage - MORE STRICT
-        confidence = min(100, best_similarity * 100)
-        
-        # Additional check: Only allow attendance if confidence >= 90%
-        if confidence < 90:
-            return jsonify({
+                "message": "No images provided"
+            }, 400
+        
+        if len(items) > MAX_BATCH_IMAGES:
+            return {
+                "success": False,
+                "message": f"Too many images: {len(items)} (maximum {MAX_BATCH_IMAGES} per batch)"
+            }, 400
+        
+        if not stored_encodings:
+            return {
                 "success": False,
-                "message": f"Confidence {confidence:.1f}% is below 90% threshold. Cannot mark attendance.",
-                "confidence": round(confidence, 1),
-                "required_confidence": "90%",
-                "security_note": "High confidence required for genuine attendance marking"
-            }), 404
+                "message": "No enrolled students found for comparison"
+            }, 400
+        
+        logger.info(f"🎯 Processing batch recognition of {len(items)} images against {len(stored_encodings)} enrolled students")
+        
+        results = [None] * len(items)
+        jobs = {}
+        for index, item in enumerate(items):
+            if not isinstance(item, dict) or not has_image_input(item):
+                results[index] = {
+                    "index": index,
+                    "status": 400,
+                    "success": False,
+                    "message": "No image data provided (image_url or image required)"
+                }
+            else:
+                jobs[index] = decode_pool.submit(fetch_image_bytes, item)
         
-        logger.info(f"Enhanced face recognized: Student {best_match['studentId']} with {confidence:.1f}% confidence")
+        probes = {}
+        for index, job in jobs.items():
+            try:
+                image_data = job.result()
+                # One slot per image, taken once its download is done
+                with compute_slots:
+                    face, error, timings = analyze_encoded(image_data, mode, use_cache)
+            except Exception as e:
+                logger.error(f"❌ Error fetching image for batch item {index}: {e}")
+                face, error, timings = None, ({
+                    "success": False,
+                    "message": "Failed to process image data"
+                }, 400), None
+            if error is not None:
+                results[index] = _batch_item_error(index, error)
+            else:
+                probes[index] = (face, timings)
+        
+        if probes:
+            scores = score_probes([face.features for face, _ in probes.values()],
+                                  [image_source_key(items[i]) for i in probes],
+                                  stored_encodings, feature_gallery.snapshot())
+            for (index, (face, timings)), probe_scores in zip(probes.items(), scores):
+                body, status = recognition_result(probe_scores, stored_encodings)
+                body.update({"spoof_score": round(face.spoof_score, 3), "face_location": face.bbox,
+                             "timings_ms": timings})
+                results[index] = {"index": index, "status": status, **body}
         
-        return jsonify({
+        recognized = sum(1 for result in results if result["success"])
+        return {
             "success": True,
-            "message": "Face recognized successfully (ENHANCED MODE - Using basic image analysis)",
-            "studentId": best_match['studentId'],
-            "confidence": round(confidence, 1),
-            "similarity": round(best_similarity, 3),
-            "distance": round(1 - best_similarity, 3),
-            "spoof_score": 1,
-            "face_location": [50, 200, 250, 100],
-            "timestamp": datetime.now().isoformat(),
-            "note": "Using basic image analysis for better recognition than pure mock mode."
-        })
+            "message": f"Recognized {recognized} of {len(items)} images",
+            "count": len(items),
+            "recognized": recognized,
+            "pipeline": mode,
+            "results": results,
+            "timestamp": datetime.now().isoformat()
+        }, 200
         
     except Exception as e:
-        logger.error(f"Error in enhanced face recognition: {str(e)}")
-        return jsonify({
+        logger.error(f"Error in batch face recognition: {str(e)}")
+        return {
             "success": False,
-            "message": "Internal server error during face recognition",
+            "message": "Internal server error during batch face recognition",
             "error": str(e)
-        }), 500
+        }, 500
+
+def verify_burst_request(items, stored_encodings):
+    """
+    Core of /verify-burst: sequential liveness over a burst of frames of one
+    face, stopping at the first confident decision, then identity from the
+    frames that were scored. Without encodings only liveness is returned.
+    Returns (response body, status code).
+    """
+    try:
+        if not items:
+            return {
+                "success": False,
+                "message": "No images provided"
+            }, 400
+        
+        if len(items) > MAX_BURST_FRAMES:
+            return {
+                "success": False,
+                "message": f"Too many frames: {len(items)} (maximum {MAX_BURST_FRAMES} per burst)"
+            }, 400
+        
+        timer = StageTimer()
+        test = SequentialLivenessTest(BURST_FALSE_ACCEPT, BURST_FALSE_REJECT)
+        # Fetched (downloaded in parallel) without a compute slot; decoded lazily under one,
+        # so frames after the decision are never decoded
+        with timer.stage('fetch'):
+            payloads = list(decode_pool.map(read_image_input, items))
+        frames = (bytes_to_frame(image_data) for image_data in payloads)
+        with compute_slots, anti_spoof_models.lease() as predictor:
+            burst = verify_burst(frames, predictor, timer, test, duplicate_distance=BURST_DUPLICATE_DISTANCE)
+        
+        body = {
+            "liveness": burst.decision or "undecided",
+            "spoof_score": round(burst.spoof_score, 3),
+            "evidence": round(burst.llr, 3),
+            "frames_received": len(items),
+            "frames_processed": burst.frames_processed,
+            "frames_without_face": burst.frames_without_face,
+            "frames_duplicate": burst.frames_duplicate,
+            "face_location": burst.faces[-1].bbox if burst.faces else None
+        }
+        logger.info(f"Burst liveness {body['liveness']} after {burst.frames_processed} of {len(items)} frames "
+                    f"(evidence {burst.llr:.2f})")
+        
+        if not burst.faces:
+            status = 400
+            body.update({"success": False, "message": "No face detected in the burst"})
+        elif burst.decision != 'real':
+            status = 400
+            body.update({"success": False, "message": "Face failed the anti-spoofing check"
+                         if burst.decision == 'fake' else "Liveness inconclusive, please try again"})
+        elif not stored_encodings:
+            status = 200
+            body.update({"success": True, "message": "Live face verified"})
+        else:
+            features = [face.features for face in burst.faces if face.features is not None]
+            with timer.stage('match'):
+                # Every scored frame votes: mean similarity per enrolled student
+                scores = score_probes(features, [image_source_key(items[0])] * len(features),
+                                      stored_encodings, feature_gallery.snapshot()).mean(axis=0)
+            result, status = recognition_result(scores, stored_encodings)
+            result.pop("spoof_score", None)
+            result.pop("face_location", None)
+            body.update(result)
+        body["timings_ms"] = timer.report()
+        return body, status
+        
+    except Exception as e:
+        logger.error(f"Error in burst verification: {str(e)}")
+        return {
+            "success": False,
+            "message": "Internal server error during burst verification",
+            "error": str(e)
+        }, 500
+
+def stream_detect(frame, timer):
+    """FaceStream detection callback: the most confident face, or None"""
+    with anti_spoof_models.lease() as predictor, timer.stage('detect'):
+        return predictor.find_bbox(frame.bgr, frame.gray)
+
+def stream_recognizer(stream_id, stored_encodings):
+    """FaceStream recognition callback: liveness and matching of the tracked face"""
+    probe_key = stream_id.encode()
+    
+    def recognize(frame, bbox, timer):
+        with anti_spoof_models.lease() as predictor:
+            # Re-recognition of a stream must look at the current frame, not a cached one
+            face = score_face(frame, bbox, predictor, timer, use_cache=False)
+        if not face.is_real:
+            return {
+                "success": False,
+                "message": "Face failed the anti-spoofing check",
+                "spoof_score": round(face.spoof_score, 3)
+            }, False
+        if face.features is None:
+            return {
+                "success": False,
+                "message": "Could not extract features from face"
+            }, False
+        with timer.stage('match'):
+            scores = score_probes([face.features], [probe_key], stored_encodings, feature_gallery.snapshot())[0]
+        body, _ = recognition_result(scores, stored_encodings)
+        body["spoof_score"] = round(face.spoof_score, 3)
+        body.pop("face_location", None)
+        certain = body["success"] and body["similarity"] >= SIMILARITY_THRESHOLD + STREAM_CERTAIN_MARGIN
+        return body, certain
+    
+    return recognize
+
+def open_stream_request(data):
+    """
+    Core of POST /stream: a new stream matching against ``encodings``, with
+    optional detect_interval / reverify_interval overrides.
+    Returns (response body, status code).
+    """
+    stored_encodings = (data or {}).get('encodings')
+    if not stored_encodings:
+        return {
+            "success": False,
+            "message": "No enrolled students found for comparison"
+        }, 400
+    
+    stream_id = uuid.uuid4().hex
+    stream = FaceStream(stream_detect, stream_recognizer(stream_id, stored_encodings),
+                        detect_interval=int(data.get('detect_interval', STREAM_DETECT_INTERVAL)),
+                        reverify_interval=int(data.get('reverify_interval', STREAM_REVERIFY_INTERVAL)),
+                        precheck=make_precheck(STREAM_PRECHECK))
+    if not streams.add(stream_id, stream):
+        return {
+            "success": False,
+            "message": f"Too many open streams (maximum {MAX_STREAMS})"
+        }, 503
+    
+    logger.info(f"🎥 Opened stream {stream_id} against {len(stored_encodings)} enrolled students")
+    return {
+        "success": True,
+        "streamId": stream_id,
+        "detect_interval": stream.detect_interval,
+        "reverify_interval": stream.reverify_interval
+    }, 201
+
+def stream_frame_request(stream, image_data, block=True):
+    """
+    One frame of a stream: decode, track (or detect) and, when the identity is
+    uncertain, recognize. Returns (response body, status code). With
+    ``block=False`` a frame arriving while the stream is busy is skipped before
+    it waits for a compute slot or is decoded.
+    """
+    with stream.claim(block) as claimed:
+        if not claimed:
+            return stream.skipped_response(), 200
+        try:
+            timer = StageTimer()
+            with compute_slots:
+                with timer.stage('decode'):
+                    frame = decode_frame(image_data)
+                if frame is None:
+                    return {
+                        "success": False,
+                        "message": "Failed to process image data"
+                    }, 400
+                body = stream.process(frame, timer)
+            body["timings_ms"] = timer.report()
+            return body, 200
+        except Exception as e:
+            logger.error(f"Error in stream frame: {str(e)}")
+            return {
+                "success": False,
+                "message": "Internal server error during stream processing",
+                "error": str(e)
+            }, 500
+
+def read_stream_frames(stream_body):
+    """Encoded frames of a chunked upload, each prefixed by its length (4 bytes, big endian)"""
+    while True:
+        prefix = stream_body.read(STREAM_FRAME_PREFIX.size)
+        if len(prefix) < STREAM_FRAME_PREFIX.size:
+            return
+        size, = STREAM_FRAME_PREFIX.unpack(prefix)
+        payload = bytearray()
+        while len(payload) < size:
+            chunk = stream_body.read(size - len(payload))
+            if not chunk:
+                return
+            payload += chunk
+        yield payload
+
+def read_image_batch():
+    """
+    Images of a /recognize-batch or /verify-burst request: JSON {"images": [base64
+    string | {"image": ...} | {"image_url": ...}], "encodings": [...], ...} or
+    multipart/form-data with files under "images" and the other fields as form
+    fields ("encodings" as JSON). Returns ((items, encodings, options), None), or
+    (None, (error body, status)) when the encodings do not parse.
+    """
+    try:
+        if request.files:
+            items = [{'image_bytes': f.read()} for f in request.files.getlist('images')]
+            return (items, json.loads(request.form.get('encodings') or '[]'), request.form), None
+        data = request.get_json(silent=True) or {}
+        items = [{'image': item} if isinstance(item, str) else item
+                 for item in data.get('images') or []]
+        return (items, data.get('encodings'), data), None
+    except ValueError as e:
+        return None, ({
+            "success": False,
+            "message": "Invalid encodings data",
+            "error": str(e)
+        }, 400)
+
+@app.route('/encode', methods=['POST'])
+def encode_face():
+    """
+    Enhanced face encoding endpoint with basic image analysis
+    Supports both Cloudinary URLs and base64 images
+    """
+    body, status = encode_request(request.get_json(silent=True))
+    return jsonify(body), status
+
+@app.route('/encode-batch', methods=['POST'])
+def encode_batch():
+    """
+    Bulk enrolment. Accepts JSON {"items": [{"studentId": ..., "image_url" | "image": ...}]}
+    (a bare list is accepted too) and reports success or error per item. Optional
+    "pipeline" and "liveness_cache" fields apply to every item, as for /encode.
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        items, options = data.get('items'), data
+    else:
+        items, options = data, {}
+    body, status = encode_batch_request(items or [], options)
+    return jsonify(body), status
+
+@app.route('/recognize', methods=['POST'])
+def recognize_face():
+    """
+    Enhanced face recognition endpoint with basic image analysis
+    Supports both Cloudinary URLs and base64 images
+    """
+    body, status = recognize_request(request.get_json(silent=True))
+    return jsonify(body), status
+
+@app.route('/recognize-batch', methods=['POST'])
+def recognize_batch():
+    """
+    Recognize many images in one call. Accepts JSON
+    {"images": [base64 string | {"image": ...} | {"image_url": ...}], "encodings": [...]}
+    or multipart/form-data with files under "images" and "encodings" as a JSON field.
+    "pipeline" selects the mode for every image, as for /recognize.
+    """
+    images, error = read_image_batch()
+    if error is not None:
+        return jsonify(error[0]), error[1]
+    items, stored_encodings, options = images
+    body, status = recognize_batch_request(items, stored_encodings, options)
+    return jsonify(body), status
+
+@app.route('/verify-burst', methods=['POST'])
+def verify_burst_route():
+    """
+    Liveness and identity from a burst of frames (about a second of capture).
+    Accepts the same JSON or multipart layout as /recognize-batch; "encodings"
+    is optional. Frames are used in order and processing stops once liveness
+    is decided.
+    """
+    images, error = read_image_batch()
+    if error is not None:
+        return jsonify(error[0]), error[1]
+    items, stored_encodings, _ = images
+    body, status = verify_burst_request(items, stored_encodings)
+    return jsonify(body), status
+
+@app.route('/stream', methods=['POST'])
+def open_stream():
+    """
+    Open a video stream for a kiosk camera. JSON {"encodings": [...]} as for
+    /recognize; returns a streamId for /stream/<id>/frame and /stream/<id>/frames.
+    """
+    body, status = open_stream_request(request.get_json(silent=True))
+    return jsonify(body), status
+
+@app.route('/stream/<stream_id>/frame', methods=['POST'])
+def stream_frame(stream_id):
+    """
+    One frame of a stream, as the raw encoded image body (image/jpeg, ...) or
+    JSON {"image": base64}. A frame arriving while the stream's previous one is
+    still processing is skipped, so a live camera never builds a backlog.
+    """
+    stream = streams.get(stream_id)
+    if stream is None:
+        return jsonify({"success": False, "message": "Unknown or expired stream"}), 404
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        try:
+            image_data = base64_buffer(str(data.get('image', '')))
+        except ValueError:
+            return jsonify({"success": False, "message": "Failed to process image data"}), 400
+    else:
+        image_data = request.get_data()
+    body, status = stream_frame_request(stream, image_data, block=False)
+    return jsonify(body), status
+
+@app.route('/stream/<stream_id>/frames', methods=['POST'])
+def stream_frames(stream_id):
+    """
+    Chunked upload of many frames: the body is a sequence of length-prefixed
+    (4 bytes, big endian) encoded images. Results are streamed back as one
+    JSON line per frame while the upload continues.
+    """
+    stream = streams.get(stream_id)
+    if stream is None:
+        return jsonify({"success": False, "message": "Unknown or expired stream"}), 404
+    
+    def results():
+        for image_data in read_stream_frames(request.stream):
+            body, _ = stream_frame_request(stream, image_data)
+            yield json.dumps(body) + "\n"
+    
+    return Response(stream_with_context(results()), mimetype='application/x-ndjson')
+
+@app.route('/stream/<stream_id>', methods=['DELETE'])
+def close_stream(stream_id):
+    """Close a stream; returns how many frames needed the detector and recognition"""
+    stream = streams.close(stream_id)
+    if stream is None:
+        return jsonify({"success": False, "message": "Unknown or expired stream"}), 404
+    logger.info(f"🎥 Closed stream {stream_id}: {dict(stream.stats)}")
+    return jsonify({"success": True, "streamId": stream_id, "stats": stream.stats})
 
 @app.route('/config', methods=['GET'])
 def get_config():
@@ -384,23 +1204,137 @@ def get_config():
         "confidence_threshold": CONFIDENCE_THRESHOLD,
         "similarity_threshold": SIMILARITY_THRESHOLD,
         "minimum_confidence_for_attendance": "90%",
-        "anti_spoof_enabled": False,
+        "anti_spoof_enabled": PIPELINE_MODE == 'fused',
+        "pipeline_mode": PIPELINE_MODE,
+        "liveness_cache_enabled": liveness_cache.enabled,
+        "quality_gate_enabled": quality_gate is not None,
         "face_recognition_model": "basic_analysis_strict",
         "version": "2.1.0-enhanced-strict",
         "mode": "high_security",
-        "note": "Using strict 90% confidence threshold for genuine attendance"
+        "note": "Using strict 90% confidence threshold for genuine attendance",
+        "thread_budget": THREAD_BUDGET._asdict()
     })
 
 @app.route('/clear-cache', methods=['POST'])
 def clear_cache():
     """Clear stored image features cache"""
-    global stored_image_features
-    stored_image_features = {}
+    feature_gallery.clear()
     return jsonify({
         "success": True,
         "message": "Feature cache cleared"
     })
 
+@app.route('/admin/reload-models', methods=['POST'])
+def reload_models():
+    """
+    Load and warm up the anti-spoof models in the background, then swap them in.
+    With a model watcher running, the other workers follow through the reload
+    sentinel; without one only this worker reloads.
+    """
+    watcher = current_model_watcher()
+    if watcher is not None:
+        started = watcher.request_reload()
+    else:
+        started = anti_spoof_models.reload_in_background()
+    return jsonify({
+        "success": True,
+        "started": started,
+        "all_workers": watcher is not None,
+        "message": "Reload started" if started else "A reload is already running",
+        "models": anti_spoof_models.status()
+    }), 202
+
+@app.route('/admin/liveness-cache', methods=['GET'])
+def liveness_cache_status():
+    """Liveness cache settings, size and hit rate"""
+    return jsonify({
+        "success": True,
+        "liveness_cache": liveness_cache.status()
+    })
+
+@app.route('/admin/liveness-cache', methods=['DELETE'])
+def clear_liveness_cache():
+    """Drop every cached liveness result (the counters are kept)"""
+    liveness_cache.clear()
+    return jsonify({
+        "success": True,
+        "liveness_cache": liveness_cache.status()
+    })
+
+@app.route('/admin/models', methods=['GET'])
+def models_status():
+    """Live anti-spoof model generation, draining generations and the last reload"""
+    return jsonify({
+        "success": True,
+        "model_dir": ANTI_SPOOF_MODEL_DIR,
+        "models": anti_spoof_models.status()
+    })
+
+def start_model_watcher():
+    """Reload the anti-spoof models when their files change, if ANTI_SPOOF_WATCH_INTERVAL is set"""
+    if ANTI_SPOOF_WATCH_INTERVAL <= 0:
+        return None
+    watcher = SourceWatcher(anti_spoof_models, ANTI_SPOOF_MODEL_DIR, ANTI_SPOOF_WATCH_INTERVAL,
+                            sentinel=ANTI_SPOOF_RELOAD_SENTINEL).start()
+    logger.info(f"👀 Watching {ANTI_SPOOF_MODEL_DIR} and {ANTI_SPOOF_RELOAD_SENTINEL} for model changes "
+                f"every {ANTI_SPOOF_WATCH_INTERVAL:g} s")
+    return watcher
+
+def current_model_watcher():
+    """The model watcher started in this process, or None"""
+    pid, services = _background_services
+    return services[1] if pid == os.getpid() else None
+
+def start_local_rpc(listener=None):
+    """
+    Serve /encode and /recognize over a Unix socket when FACE_RPC_SOCKET is set,
+    on ``listener`` when the socket was bound before the workers forked
+    """
+    if not LOCAL_RPC_SOCKET:
+        return None
+    # Imported here: AF_UNIX servers are not available on every platform
+    from src.local_rpc import LocalRpcServer
+    try:
+        server = LocalRpcServer(LOCAL_RPC_SOCKET, {
+            'encode': encode_request,
+            'recognize': recognize_request,
+        }, listener=listener)
+    except OSError as e:
+        if e.errno != errno.EADDRINUSE:
+            raise
+        # Workers that did not inherit a listener: the first one to start serves the socket
+        logger.info(f"🔌 Local RPC socket {LOCAL_RPC_SOCKET} is served by another worker")
+        return None
+    server.serve_in_background()
+    logger.info(f"🔌 Local RPC transport listening on: {LOCAL_RPC_SOCKET}")
+    return server
+
+# (pid, (rpc server, model watcher)) of the process that started them
+_background_services = (None, None)
+_background_lock = threading.Lock()
+
+def start_background_services(rpc_listener=None):
+    """Start the local RPC transport and the model watcher, once per process.
+
+    Threads do not survive a fork, so this runs in each worker: from
+    ``create_app()``, the gunicorn ``post_worker_init`` hook (gunicorn.conf.py)
+    or the Werkzeug reloader child in debug mode. ``rpc_listener`` is the RPC
+    socket bound by the gunicorn master, accepted on by every worker.
+    """
+    global _background_services
+    with _background_lock:
+        pid, services = _background_services
+        if pid != os.getpid():
+            logger.info(f"🧵 Thread budget: {THREAD_BUDGET}")
+            services = (start_local_rpc(rpc_listener), start_model_watcher())
+            _background_services = (os.getpid(), services)
+        return services
+
+def create_app():
+    """App factory for WSGI servers: ``gunicorn 'face_recognition_server_enhanced:create_app()'``"""
+    start_background_services()
+    return app
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({
@@ -421,6 +1355,10 @@ if __name__ == "__main__":
     logger.info("🔧 Using basic image analysis for better recognition than pure mock")
     logger.info("💡 For full functionality, install: dlib, face-recognition packages")
     
+    # debug=True runs the app in a reloader child process; bind the socket only there
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
+    
     app.run(
         host="0.0.0.0", 
         port=8085, 
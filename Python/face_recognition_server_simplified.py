@@ -6,16 +6,15 @@ This version works without dlib/face-recognition for initial setup
 
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-import base64
-import io
 import json
 import logging
 import os
 import time
 from datetime import datetime
-from PIL import Image
 import numpy as np
 
+from src.image_ingest import decode_base64_frame
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,28 +24,47 @@ CORS(app)  # Enable CORS for all domains
 
 # Configuration
 CONFIDENCE_THRESHOLD = 0.6
+# 'mock' (default): no models needed; 'fused': real face detection and anti-spoofing
+# (src/face_pipeline.py) in front of the mock encodings
+PIPELINE_MODE = os.environ.get('FACE_PIPELINE_MODE', 'mock')
+ANTI_SPOOF_MODEL_DIR = os.environ.get('ANTI_SPOOF_MODEL_DIR', './resources/anti_spoof_models')
 
-def base64_to_image(base64_string):
-    """Convert base64 string to PIL Image"""
-    try:
-        # Remove data URL prefix if present
-        if ',' in base64_string:
-            base64_string = base64_string.split(',')[1]
-        
-        # Decode base64
-        image_data = base64.b64decode(base64_string)
-        
-        # Convert to PIL Image
-        pil_image = Image.open(io.BytesIO(image_data))
-        
-        # Convert to RGB if necessary
-        if pil_image.mode != 'RGB':
-            pil_image = pil_image.convert('RGB')
-        
-        return pil_image
-    except Exception as e:
-        logger.error(f"Error converting base64 to image: {str(e)}")
-        return None
+def analyze_image(frame):
+    """
+    Fused pipeline on a decoded Frame: (FaceAnalysis or None, stage timings in ms).
+    Models are loaded on the first call.
+    """
+    from src.anti_spoof_service import get_predictor
+    from src.face_pipeline import StageTimer, analyze_face
+    timer = StageTimer()
+    face = analyze_face(frame, get_predictor(ANTI_SPOOF_MODEL_DIR, 0), timer)
+    return face, timer.report()
+
+def liveness_fields(frame):
+    """
+    spoof_score/face_location for a response, and an error response if the
+    face is missing or not live. Mock values unless FACE_PIPELINE_MODE is 'fused'.
+    """
+    if PIPELINE_MODE != 'fused':
+        return {"spoof_score": 1, "face_location": [50, 200, 250, 100]}, None
+    face, timings = analyze_image(frame)
+    if face is None:
+        return None, (jsonify({
+            "success": False,
+            "message": "No face detected in image",
+            "timings_ms": timings
+        }), 400)
+    fields = {"spoof_score": round(face.spoof_score, 3), "face_location": face.bbox, "timings_ms": timings}
+    if not face.is_real:
+        return None, (jsonify(dict(fields, success=False, message="Face failed the anti-spoofing check")), 400)
+    return fields, None
+
+def base64_to_frame(base64_string):
+    """Decode a base64 (data URL) image to a Frame (src/image_ingest.py)"""
+    frame = decode_base64_frame(base64_string)
+    if frame is None:
+        logger.error("Error converting base64 to image: invalid base64 or unsupported image")
+    return frame
 
 @app.route('/', methods=['GET'])
 def health_check():
@@ -79,13 +97,17 @@ def encode_face():
         logger.info(f"Processing mock face encoding for student: {student_id}")
         
         # Convert base64 to image to validate it's a valid image
-        image = base64_to_image(image_base64)
-        if image is None:
+        frame = base64_to_frame(image_base64)
+        if frame is None:
             return jsonify({
                 "success": False,
                 "message": "Invalid image data"
             }), 400
         
+        liveness, error = liveness_fields(frame)
+        if error is not None:
+            return error
+        
         # Generate mock encoding (128-dimensional vector)
         mock_encoding = np.random.rand(128).tolist()
         
@@ -96,8 +118,7 @@ def encode_face():
             "message": "Face encoded successfully (MOCK MODE - Install face-recognition for real encoding)",
             "encoding": mock_encoding,
             "studentId": student_id,
-            "spoof_score": 1,  # Mock anti-spoofing score
-            "face_location": [50, 200, 250, 100],  # Mock face location
+            **liveness,
             "timestamp": datetime.now().isoformat(),
             "note": "This is a mock encoding for testing. Install dlib and face-recognition packages for real functionality."
         })
@@ -137,13 +158,17 @@ def recognize_face():
         logger.info(f"Processing mock face recognition against {len(stored_encodings)} enrolled students")
         
         # Convert base64 to image to validate it's a valid image
-        image = base64_to_image(image_base64)
-        if image is None:
+        frame = base64_to_frame(image_base64)
+        if frame is None:
             return jsonify({
                 "success": False,
                 "message": "Invalid image data"
             }), 400
         
+        liveness, error = liveness_fields(frame)
+        if error is not None:
+            return error
+        
         # Mock recognition: simulate actual face recognition behavior
         import random
         import hashlib
@@ -162,7 +187,7 @@ def recognize_face():
             return jsonify({
                 "success": False,
                 "message": "Face not recognized. Please try again with better lighting.",
-                "spoof_score": 1,
+                "spoof_score": liveness["spoof_score"],
                 "confidence": round(random.uniform(30, 60), 1)
             }), 404
         
@@ -176,8 +201,7 @@ def recognize_face():
             "studentId": recognized_student['studentId'],
             "confidence": round(mock_confidence, 1),
             "distance": round(random.uniform(0.1, 0.4), 3),
-            "spoof_score": 1,
-            "face_location": [50, 200, 250, 100],
+            **liveness,
             "timestamp": datetime.now().isoformat(),
             "note": "This is mock recognition for testing. Install dlib and face-recognition packages for real functionality."
         })
@@ -195,7 +219,8 @@ def get_config():
     """Get server configuration"""
     return jsonify({
         "confidence_threshold": CONFIDENCE_THRESHOLD,
-        "anti_spoof_enabled": False,
+        "anti_spoof_enabled": PIPELINE_MODE == 'fused',
+        "pipeline_mode": PIPELINE_MODE,
         "face_recognition_model": "mock",
         "version": "2.0.0-simplified",
         "mode": "testing",
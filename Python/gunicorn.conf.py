@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# @File : gunicorn.conf.py
+"""
+Gunicorn settings for the enhanced server:
+
+    gunicorn -c gunicorn.conf.py face_recognition_server_enhanced:app
+
+Each worker starts its own model watcher. If FACE_RPC_SOCKET is set, the
+master binds the local RPC socket once and every worker accepts on it, like
+the HTTP port (see face_recognition_server_enhanced.start_background_services). Every worker
+loads its own models: with more than one, set ANTI_SPOOF_WATCH_INTERVAL so
+that /admin/reload-models reaches all of them (see README).
+"""
+
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8085')
+workers = int(os.environ.get('GUNICORN_WORKERS', '1'))
+# Requests wait on downloads and the compute slots, not only on the CPU
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+
+# Local RPC socket bound in the master, inherited by the workers at fork
+rpc_listener = None
+
+
+def on_starting(server):
+    global rpc_listener
+    path = os.environ.get('FACE_RPC_SOCKET')
+    if path:
+        from src.local_rpc import bind_listener
+        rpc_listener = bind_listener(path)
+
+
+def on_exit(server):
+    if rpc_listener is not None:
+        rpc_listener.close()
+        os.unlink(os.environ['FACE_RPC_SOCKET'])
+
+
+def post_worker_init(worker):
+    # Also correct with --preload: threads started in the master do not survive the fork
+    from face_recognition_server_enhanced import start_background_services
+    start_background_services(rpc_listener)
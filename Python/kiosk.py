@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# @File : kiosk.py
+"""
+The two processes of a kiosk sharing camera frames through a frame ring
+(src/frame_ring.py) instead of encoding them for HTTP:
+
+    python kiosk.py capture --ring kiosk --source 0
+    python kiosk.py liveness --ring kiosk
+
+``capture`` creates the ring and decodes camera (or video file) frames
+straight into its slots until the source ends or it is interrupted.
+``liveness`` attaches to the ring and runs the newest frame through a
+FaceStream (src/face_stream.py): its own motion pre-check, detection, face
+tracking and anti-spoofing of the tracked face, printing one JSON line per
+frame it processed. Frames that arrive while it is busy are skipped.
+"""
+
+import argparse
+import json
+import time
+import warnings
+
+from src.frame_ring import FrameRing, consume, run_capture
+
+warnings.filterwarnings('ignore')
+
+
+def capture(args):
+    ring = FrameRing.create(args.ring, args.slots, args.height, args.width)
+    source = int(args.source) if args.source.isdigit() else args.source
+    print("ring {}: {} slots of {}x{}, capturing from {}".format(ring.name, args.slots, args.height, args.width,
+                                                                source))
+    try:
+        run_capture(ring, source, args.fps or None)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Lets the reader finish its frame and exit before the block is unlinked
+        ring.request_stop()
+        time.sleep(args.linger)
+        print("frames captured: {}, read up to: {}".format(ring.write_seq, ring.read_seq))
+        ring.close()
+
+
+def liveness(args):
+    from src.anti_spoof_predict import AntiSpoofPredict
+    from src.face_pipeline import StageTimer, score_face
+    from src.face_precheck import make_precheck
+    from src.face_stream import FaceStream
+    from src.image_ingest import Frame
+
+    predictor = AntiSpoofPredict(args.device_id, args.model_dir, backend=args.backend)
+    predictor.warm_up()
+
+    def detect(frame, timer):
+        with timer.stage('detect'):
+            return predictor.find_bbox(frame.bgr, frame.gray)
+
+    def recognize(frame, bbox, timer):
+        # Every check looks at the current frame; a live face is trusted until reverify_interval
+        face = score_face(frame, bbox, predictor, timer, use_cache=False)
+        return {
+            "success": face.is_real,
+            "liveness": "real" if face.is_real else "fake",
+            "spoof_score": round(face.spoof_score, 3)
+        }, face.is_real
+
+    # One camera per ring, so the stateful motion pre-check is safe here
+    stream = FaceStream(detect, recognize, detect_interval=args.detect_interval,
+                        reverify_interval=args.reverify_interval, precheck=make_precheck(args.precheck))
+
+    def process(view):
+        timer = StageTimer()
+        # The slot is used in place: no copy, no decode
+        body = stream.process(Frame(view), timer)
+        body["timings_ms"] = timer.report()
+        return body
+
+    ring = FrameRing.attach(args.ring)
+    print("ring {}: {} slots of {}x{}".format(ring.name, ring.slots, ring.shape[0], ring.shape[1]))
+    try:
+        for seq, stamp, body in consume(ring, process):
+            body.update({"seq": seq, "latency_ms": round((time.time() - stamp) * 1e3, 2)})
+            print(json.dumps(body), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+        predictor.close()
+        print(json.dumps({"stats": stream.stats}))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="kiosk capture and liveness processes over a frame ring")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("capture", help="create the ring and fill it from a camera or video file")
+    p.add_argument("--ring", default="face_kiosk", help="shared memory name of the ring")
+    p.add_argument("--source", default="0", help="camera index or video file/URL")
+    p.add_argument("--height", type=int, default=640)
+    p.add_argument("--width", type=int, default=480)
+    p.add_argument("--slots", type=int, default=4)
+    p.add_argument("--fps", type=float, default=0, help="frame rate cap (0 = as fast as the source)")
+    p.add_argument("--linger", type=float, default=0.5, help="seconds the ring outlives the source")
+    p.set_defaults(func=capture)
+
+    p = sub.add_parser("liveness", help="detect, track and anti-spoof the newest frame of the ring")
+    p.add_argument("--ring", default="face_kiosk", help="shared memory name of the ring")
+    p.add_argument("--model_dir", default="./resources/anti_spoof_models")
+    p.add_argument("--device_id", type=int, default=0)
+    p.add_argument("--backend", default="torchscript")
+    p.add_argument("--precheck", default="motion", help="'motion', 'cascade' or 'none'")
+    p.add_argument("--detect_interval", type=int, default=15)
+    p.add_argument("--reverify_interval", type=int, default=90)
+    p.set_defaults(func=liveness)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.func(args)
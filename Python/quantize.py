@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# @File : quantize.py
+"""
+Write INT8 artifacts for every anti-spoof model and report latency, size and
+real/fake accuracy against the float (frozen TorchScript) models.
+
+    python quantize.py --mode static --calibration_dir ./datasets/calibration
+    python quantize.py --mode dynamic --eval_dir ./datasets/eval
+
+Images are full frames; faces are found with the detector and cropped per model
+like at inference. In ``0``/``1``/``2`` class directories (1 = real face) they
+also count towards accuracy. Serve the result with ANTI_SPOOF_BACKEND=int8.
+"""
+
+import argparse
+import io
+import os
+import time
+import warnings
+
+import numpy as np
+import torch
+
+from src.anti_spoof_predict import Detection
+from src.generate_patches import CropImage
+from src.model_registry import load_frozen_model, load_model
+from src.quantization import (MODES, default_engine, load_image_folder, load_quantized_model,
+                              model_inputs, quantize_dynamic, quantize_static, save_quantized)
+
+warnings.filterwarnings('ignore')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="INT8 quantization of the anti-spoof models")
+    parser.add_argument("--model_dir", type=str, default="./resources/anti_spoof_models")
+    parser.add_argument("--mode", choices=MODES, default="static")
+    parser.add_argument("--calibration_dir", type=str, default=None,
+                        help="images to observe activation ranges on (static mode)")
+    parser.add_argument("--eval_dir", type=str, default=None,
+                        help="labelled images for the accuracy report (default: calibration_dir)")
+    parser.add_argument("--engine", type=str, default=None,
+                        help="quantized engine, e.g. onednn/x86/qnnpack (default: fastest available)")
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+    if args.mode == "static" and not args.calibration_dir:
+        parser.error("--calibration_dir is required in static mode")
+    args.eval_dir = args.eval_dir or args.calibration_dir
+    args.engine = args.engine or default_engine()
+    return args
+
+
+def serialized_size(state_dict):
+    buffer = io.BytesIO()
+    torch.save(state_dict, buffer)
+    return buffer.tell()
+
+
+@torch.no_grad()
+def latency_ms(model, batch, repeats):
+    for _ in range(3):
+        model(batch)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model(batch)
+    return (time.perf_counter() - start) / repeats * 1e3
+
+
+@torch.no_grad()
+def softmax(model, inputs):
+    return torch.softmax(model(inputs), dim=1).numpy()
+
+
+def real_accuracy(predictions, labels):
+    """Real/fake accuracy: class 1 is a real face, 0 and 2 are attacks"""
+    return float(np.mean((np.argmax(predictions, axis=1) == 1) == (labels == 1)))
+
+
+def main(args):
+    detector = Detection()
+    image_cropper = CropImage()
+    calibration = load_image_folder(args.calibration_dir) if args.calibration_dir else []
+    evaluation = load_image_folder(args.eval_dir) if args.eval_dir else []
+    labelled = [sample for sample in evaluation if sample[2] is not None]
+    labels = np.array([label for _, _, label in labelled])
+    print("mode {}, engine {}, {} calibration images, {} labelled evaluation images".format(
+        args.mode, args.engine, len(calibration), len(labelled)))
+
+    ensemble_float, ensemble_int8 = 0, 0
+    for model_name in sorted(os.listdir(args.model_dir)):
+        if not model_name.endswith(".pth"):
+            continue
+        model_path = os.path.join(args.model_dir, model_name)
+        if args.mode == "static":
+            float_entry = load_model(model_path, "cpu")
+            calibration_inputs = model_inputs(calibration, float_entry.spec, detector, image_cropper)
+            quantized = quantize_static(float_entry.model, calibration_inputs, args.engine)
+        else:
+            quantized = quantize_dynamic(load_model(model_path, "cpu", fuse=True).model)
+        path = save_quantized(quantized, model_path, args.mode, args.engine)
+
+        # Float baseline: what the default torchscript backend serves
+        reference = load_frozen_model(model_path, torch.device("cpu"))
+        entry = load_quantized_model(model_path)
+        example = torch.rand(1, 3, entry.spec.h_input, entry.spec.w_input) * 255
+        float_size = serialized_size(load_model(model_path, "cpu", fuse=True).model.state_dict())
+        print("{:<32} size {:.2f} -> {:.2f} MB  latency {:.2f} -> {:.2f} ms  ({})".format(
+            model_name, float_size / 2 ** 20, os.path.getsize(path) / 2 ** 20,
+            latency_ms(reference.model, example, args.repeats), latency_ms(entry.model, example, args.repeats),
+            os.path.basename(path)))
+
+        if labelled:
+            inputs = model_inputs(labelled, entry.spec, detector, image_cropper)
+            float_predictions = softmax(reference.model, inputs)
+            int8_predictions = softmax(entry.model, inputs)
+            ensemble_float = ensemble_float + float_predictions
+            ensemble_int8 = ensemble_int8 + int8_predictions
+            print("{:<32} real/fake accuracy {:.3f} -> {:.3f}  label agreement {:.3f}  max |softmax diff| {:.3f}".format(
+                "", real_accuracy(float_predictions, labels), real_accuracy(int8_predictions, labels),
+                float(np.mean(np.argmax(float_predictions, 1) == np.argmax(int8_predictions, 1))),
+                float(np.abs(float_predictions - int8_predictions).max())))
+
+    if labelled:
+        print("{:<32} real/fake accuracy {:.3f} -> {:.3f}  (delta {:+.3f})".format(
+            "ensemble", real_accuracy(ensemble_float, labels), real_accuracy(ensemble_int8, labels),
+            real_accuracy(ensemble_int8, labels) - real_accuracy(ensemble_float, labels)))
+
+
+if __name__ == "__main__":
+    main(parse_args())
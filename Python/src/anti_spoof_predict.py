@@ -5,99 +5,137 @@
 # @File : anti_spoof_predict.py
 # @Software : PyCharm
 
-import os
-import cv2
-import math
-import torch
 import numpy as np
-import torch.nn.functional as F
 
 
-from src.model_lib.MiniFASNet import MiniFASNetV1, MiniFASNetV2,MiniFASNetV1SE,MiniFASNetV2SE
-from src.data_io import transform as trans
-from src.utility import get_kernel, parse_model_name
+# torch is imported lazily: the 'opencv' backend runs without it
+from src.detector_engine import NMS_THRESHOLD, shared_engine
+from src.ensemble import EnsembleExecutor, to_batch_array
+from src.face_precheck import SHARED_PRECHECKS, make_precheck
+from src.onnx_models import OnnxModelRegistry
 
-MODEL_MAPPING = {
-    'MiniFASNetV1': MiniFASNetV1,
-    'MiniFASNetV2': MiniFASNetV2,
-    'MiniFASNetV1SE':MiniFASNetV1SE,
-    'MiniFASNetV2SE':MiniFASNetV2SE
-}
+
+def __getattr__(name):
+    # MODEL_MAPPING now lives in model_registry; kept importable from here
+    if name == 'MODEL_MAPPING':
+        from src.model_registry import MODEL_MAPPING
+        return MODEL_MAPPING
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def _torch_device(device_id):
+    import torch
+    return torch.device("cuda:{}".format(device_id) if torch.cuda.is_available() else "cpu")
 
 
 class Detection:
     def __init__(self):
         caffemodel = "./resources/detection_model/Widerface-RetinaFace.caffemodel"
         deploy = "./resources/detection_model/deploy.prototxt"
-        self.detector = cv2.dnn.readNetFromCaffe(deploy, caffemodel)
+        # Shared by every Detection of the process; one cv2.dnn net per thread
+        self.engine = shared_engine(deploy, caffemodel)
         self.detector_confidence = 0.6
+        self.nms_threshold = NMS_THRESHOLD
+        # Optional cheap check (see face_precheck.py); when it says no face, the DNN is skipped
+        self.precheck = None
 
     def get_bbox(self, img):
-        height, width = img.shape[0], img.shape[1]
-        aspect_ratio = width / height
-        if img.shape[1] * img.shape[0] >= 192 * 192:
-            img = cv2.resize(img,
-                             (int(192 * math.sqrt(aspect_ratio)),
-                              int(192 / math.sqrt(aspect_ratio))), interpolation=cv2.INTER_LINEAR)
-
-        blob = cv2.dnn.blobFromImage(img, 1, mean=(104, 117, 123))
-        self.detector.setInput(blob, 'data')
-        out = self.detector.forward('detection_out').squeeze()
-        max_conf_index = np.argmax(out[:, 2])
-        left, top, right, bottom = out[max_conf_index, 3]*width, out[max_conf_index, 4]*height, \
-                                   out[max_conf_index, 5]*width, out[max_conf_index, 6]*height
-        bbox = [int(left), int(top), int(right-left+1), int(bottom-top+1)]
-        return bbox
+        return self.engine.best_bboxes([img])[0]
+
+    def get_faces(self, img, gray=None):
+        """
+        Every face above detector_confidence, after NMS: [(bbox, score)], most
+        confident first. ``gray`` is the frame's grayscale when the caller already
+        has it (image_ingest.Frame); the pre-check then skips its own conversion.
+        """
+        if self.precheck is not None and not self.precheck(img if gray is None else gray):
+            return []
+        return self.engine.detect_faces([img], self.detector_confidence, self.nms_threshold)[0]
+
+    def find_bbox(self, img, gray=None):
+        """Staged get_bbox: the best face above detector_confidence, None when there is none"""
+        faces = self.get_faces(img, gray)
+        return faces[0][0] if faces else None
+
+    def find_bboxes(self, images):
+        """
+        find_bbox for several frames of one camera (e.g. a burst) in batched
+        detector passes; None where there is no face. No pre-check is run.
+        """
+        return [faces[0][0] if faces else None
+                for faces in self.engine.detect_faces(images, self.detector_confidence, self.nms_threshold)]
 
 
 class AntiSpoofPredict(Detection):
-    def __init__(self, device_id):
+    def __init__(self, device_id, model_dir=None, backend='torchscript', early_exit_margin=None,
+                 precheck='none', liveness_cache=None, ensemble_threads=None):
         super(AntiSpoofPredict, self).__init__()
-        self.device = torch.device("cuda:{}".format(device_id)
-                                   if torch.cuda.is_available() else "cpu")
+        # One predictor serves every camera, so per-camera checks ('motion') go on the stream
+        if precheck not in SHARED_PRECHECKS:
+            raise ValueError("pre-check {!r} cannot be shared by a predictor, expected one of {} "
+                             "(give each stream its own, see FaceStream)".format(precheck, SHARED_PRECHECKS))
+        self.precheck = make_precheck(precheck)
+        self.backend = backend
+        # With a model_dir every model is loaded (and warmed up) once here and
+        # predict() runs from memory. 'opencv' serves the ONNX exports through
+        # cv2.dnn on the CPU; the others are ModelRegistry backends.
+        self.registry = None
+        if backend == 'opencv':
+            self.device = 'cpu'
+            if model_dir:
+                self.registry = OnnxModelRegistry(model_dir)
+        else:
+            # Imported here: the opencv backend runs without torch
+            from src.model_registry import BACKENDS, ModelRegistry
+            if backend not in BACKENDS:
+                raise ValueError("unknown backend {!r}, expected one of {}".format(backend, BACKENDS))
+            self.device = _torch_device(device_id)
+            if model_dir:
+                self.registry = ModelRegistry(model_dir, self.device, backend=backend)
+        # early_exit_margin: see EnsembleExecutor; None always runs every model.
+        # liveness_cache: a liveness_cache.LivenessCache, may be shared across predictors.
+        # ensemble_threads: models run at once per request (thread_budget); None runs all
+        self.ensemble = EnsembleExecutor(self.registry, workers=ensemble_threads, early_exit_margin=early_exit_margin,
+                                         cache=liveness_cache) if self.registry is not None else None
+
+    def warm_up(self, height=640, width=480):
+        """One detection and one ensemble pass on a blank frame, so the first request runs warm"""
+        image = np.zeros((height, width, 3), dtype=np.uint8)
+        self.get_bbox(image)
+        if self.ensemble is not None:
+            self.ensemble.predict_faces([(image, [width // 4, height // 4, width // 2, height // 2])],
+                                        use_cache=False)
+
+    def close(self):
+        if self.ensemble is not None:
+            self.ensemble.close()
 
     def _load_model(self, model_path):
-        # define model
-        model_name = os.path.basename(model_path)
-        h_input, w_input, model_type, _ = parse_model_name(model_name)
-        self.kernel_size = get_kernel(h_input, w_input,)
-        self.model = MODEL_MAPPING[model_type](conv6_kernel=self.kernel_size).to(self.device)
-
-        # load model weight
-        state_dict = torch.load(model_path, map_location=self.device)
-        keys = iter(state_dict)
-        first_layer_name = keys.__next__()
-        if first_layer_name.find('module.') >= 0:
-            from collections import OrderedDict
-            new_state_dict = OrderedDict()
-            for key, value in state_dict.items():
-                name_key = key[7:]
-                new_state_dict[name_key] = value
-            self.model.load_state_dict(new_state_dict)
-        else:
-            self.model.load_state_dict(state_dict)
-        return None
+        from src.model_registry import load_model
+        entry = load_model(model_path, self.device)
+        self.kernel_size = entry.kernel_size
+        self.model = entry.model
+        return entry
+
+    def predict_faces(self, img, bboxes):
+        """Summed ensemble softmax for several faces of one image, one row per bbox"""
+        return self.ensemble.predict(img, bboxes)
 
     def predict(self, img, model_path):
+        entry = self.registry.get_by_name(model_path) if self.registry is not None else None
+        if entry is not None:
+            return self.registry.forward(entry, to_batch_array(img[np.newaxis]))
+
+        import torch
+        import torch.nn.functional as F
+        from src.data_io import transform as trans
         test_transform = trans.Compose([
             trans.ToTensor(),
         ])
         img = test_transform(img)
         img = img.unsqueeze(0).to(self.device)
-        self._load_model(model_path)
-        self.model.eval()
+        entry = self._load_model(model_path)
         with torch.no_grad():
-            result = self.model.forward(img)
-            result = F.softmax(result).cpu().numpy()
+            result = entry.model.forward(img)
+            result = F.softmax(result, dim=1).cpu().numpy()
         return result
-
-
-
-
-
-
-
-
-
-
-
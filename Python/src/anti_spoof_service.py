@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# @File : anti_spoof_service.py
+"""
+Process-wide anti-spoof settings, read from the environment, and the shared
+predictors built from them. Used by both servers, test.py and benchmark.py.
+"""
+
+import os
+import time
+
+from src.anti_spoof_predict import AntiSpoofPredict
+
+# 'torchscript', 'eager', 'int8' (quantize.py artifacts) or 'opencv' (ONNX through cv2.dnn, no torch import)
+ANTI_SPOOF_BACKEND = os.environ.get('ANTI_SPOOF_BACKEND', 'torchscript')
+
+# Softmax margin above which the ensemble stops after its cheapest models
+# (calibrate with `benchmark.py early-exit`); unset runs every model
+ANTI_SPOOF_EARLY_EXIT_MARGIN = float(os.environ['ANTI_SPOOF_EARLY_EXIT_MARGIN']) \
+    if os.environ.get('ANTI_SPOOF_EARLY_EXIT_MARGIN') else None
+
+# Cheap no-face check before the detector DNN: 'none' or 'cascade' ('motion' is per stream, see face_stream.py)
+ANTI_SPOOF_PRECHECK = os.environ.get('ANTI_SPOOF_PRECHECK', 'none')
+
+# One predictor (detector + loaded models) per (model_dir, device_id), reused across images
+_predictors = {}
+
+
+def get_predictor(model_dir, device_id, backend=None):
+    backend = backend or ANTI_SPOOF_BACKEND
+    key = (model_dir, device_id, backend)
+    if key not in _predictors:
+        _predictors[key] = AntiSpoofPredict(device_id, model_dir, backend=backend,
+                                            early_exit_margin=ANTI_SPOOF_EARLY_EXIT_MARGIN,
+                                            precheck=ANTI_SPOOF_PRECHECK)
+    return _predictors[key]
+
+
+def predict_liveness(image, model_test):
+    """Run the ensemble on a BGR frame; returns (bbox, summed softmax, seconds spent in models)"""
+    image_bbox = model_test.get_bbox(image)
+    start = time.time()
+    # sum the prediction from every model's result, all models in one pass
+    prediction = model_test.predict_faces(image, [image_bbox])
+    test_speed = time.time()-start
+    return image_bbox, prediction, test_speed
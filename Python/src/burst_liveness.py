@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# @File : burst_liveness.py
+"""
+Liveness over a burst of frames (about a second of capture) instead of one.
+
+``SequentialLivenessTest`` is Wald's sequential probability ratio test on the
+per-frame ensemble output: each frame adds the log-odds of its real-face
+probability, clipped to ``max_evidence`` so no single frame decides alone, and
+the test stops once the sum crosses the bound for the requested false-accept
+and false-reject rates.
+
+``verify_burst`` feeds the test in small chunks (a group sequential test: the
+bounds are checked after each chunk): frames are decoded lazily and each chunk
+goes through the detector and the anti-spoof ensemble as one batch, so frames
+after the deciding chunk are never decoded, detected or scored. The test
+assumes every frame is a new look at the face: a frame whose face crop hashes
+(liveness_cache.crop_hash) within ``duplicate_distance`` bits of one already
+scored, such as the same still re-sent or re-encoded, is collapsed into it and
+adds no evidence.
+"""
+
+import math
+from collections import namedtuple
+from itertools import islice
+
+from src.face_pipeline import FaceAnalysis, face_features
+from src.liveness_cache import crop_hash, hash_distance
+
+# With the default bounds no decision takes fewer than two frames, so the
+# first batch is exactly the minimum burst
+BURST_BATCH = 2
+
+# Crop-hash bits (of 256) within which two frames are the same image: re-encoding
+# moves ~5 bits and sensor noise ~2, while a 2 px head movement moves ~18
+DUPLICATE_DISTANCE = 8
+
+# decision: 'real', 'fake' or None (undecided after every frame); llr: summed
+# evidence; spoof_score: mean real-face probability of the scored frames;
+# frames_processed: frames decoded and detected before stopping; frames_without_face: of
+# those, frames that did not decode or had no face; frames_duplicate: of those, frames
+# collapsed into an earlier one; faces: FaceAnalysis per scored frame
+BurstResult = namedtuple('BurstResult', ['decision', 'llr', 'spoof_score', 'frames_processed',
+                                         'frames_without_face', 'frames_duplicate', 'faces'])
+
+
+class SequentialLivenessTest:
+    def __init__(self, false_accept=0.01, false_reject=0.05, max_evidence=2.5):
+        # Accept as real above upper, reject as a spoof below lower (Wald's bounds)
+        self.upper = math.log((1 - false_reject) / false_accept)
+        self.lower = math.log(false_reject / (1 - false_accept))
+        self.max_evidence = max_evidence
+        self.llr = 0.0
+        self.scores = []
+
+    @property
+    def decision(self):
+        if self.llr >= self.upper:
+            return 'real'
+        if self.llr <= self.lower:
+            return 'fake'
+        return None
+
+    def update(self, real_probability):
+        """Add one frame's real-face probability; returns the decision so far"""
+        p = min(max(real_probability, 1e-6), 1 - 1e-6)
+        evidence = math.log(p / (1 - p))
+        self.llr += min(max(evidence, -self.max_evidence), self.max_evidence)
+        self.scores.append(real_probability)
+        return self.decision
+
+    @property
+    def score(self):
+        return sum(self.scores) / len(self.scores) if self.scores else 0.0
+
+
+def verify_burst(frames, predictor, timer, test=None, batch=BURST_BATCH, duplicate_distance=DUPLICATE_DISTANCE):
+    """
+    Sequential liveness over ``frames``, an iterable of image_ingest.Frame (or
+    None for frames that failed to decode), consumed lazily ``batch`` at a time.
+    ``predictor`` is an AntiSpoofPredict. Returns a BurstResult.
+    """
+    test = test or SequentialLivenessTest()
+    frames = iter(frames)
+    processed, without_face, duplicates, scored = 0, 0, 0, []
+    # crop_hash of every frame scored so far
+    seen = []
+    while test.decision is None:
+        with timer.stage('decode'):
+            chunk = list(islice(frames, batch))
+        if not chunk:
+            break
+        decoded = [i for i, frame in enumerate(chunk) if frame is not None]
+        with timer.stage('detect'):
+            bboxes = predictor.find_bboxes([chunk[i].bgr for i in decoded]) if decoded else []
+        bbox_of = {i: bbox for i, bbox in zip(decoded, bboxes) if bbox is not None}
+        predictions = {}
+        if bbox_of:
+            with timer.stage('liveness'):
+                located = sorted(bbox_of)
+                inputs = predictor.ensemble.prepare([(chunk[i].bgr, bbox_of[i]) for i in located])
+                fresh = []
+                for row, key in enumerate(crop_hash(patch) for patch in inputs[0][1]):
+                    if all(hash_distance(key, other) > duplicate_distance for other in seen):
+                        seen.append(key)
+                        fresh.append(row)
+                duplicates += len(located) - len(fresh)
+                if fresh:
+                    # Summed softmax over the ensemble, one row per face; class 1 is a real face.
+                    # Never from the liveness cache: every fresh frame gives its own evidence
+                    rows = predictor.ensemble.predict_prepared(
+                        [(entry, faces[fresh]) for entry, faces in inputs], use_cache=False) / len(predictor.registry)
+                    predictions = {located[row]: prediction for row, prediction in zip(fresh, rows)}
+        processed += len(chunk)
+        without_face += len(chunk) - len(bbox_of)
+        for i in sorted(predictions):
+            scored.append((chunk[i], bbox_of[i], predictions[i]))
+            test.update(float(predictions[i][1]))
+    with timer.stage('features'):
+        # Features only of the frames that gave evidence; identity is fused over them
+        faces = [FaceAnalysis(bbox, float(prediction[1]), int(prediction.argmax()) == 1, face_features(frame, bbox))
+                 for frame, bbox, prediction in scored]
+    return BurstResult(test.decision, test.llr, test.score, processed, without_face, duplicates, faces)
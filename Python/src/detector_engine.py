@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# @File : detector_engine.py
+"""
+Batched face detection on the Caffe RetinaFace net.
+
+cv2.dnn nets are not thread-safe, so the engine gives every calling thread its
+own net (created on first use) instead of serialising requests on one. Images
+are resized the way ``Detection.get_bbox`` always did (about 192x192 pixels at
+the original aspect ratio), grouped by that size, and each group runs as one
+batch. The mean-subtracted NCHW blob (what ``cv2.dnn.blobFromImages`` builds) is
+written into a per-thread buffer that is reused across calls.
+"""
+
+import math
+import threading
+
+import cv2
+import numpy as np
+
+DETECTION_SIZE = 192
+MEAN = (104, 117, 123)
+NMS_THRESHOLD = 0.4
+
+
+def detection_size(height, width):
+    """(w, h) the detector sees for a frame; small frames are not resized"""
+    if height * width < DETECTION_SIZE * DETECTION_SIZE:
+        return width, height
+    aspect_ratio = width / height
+    return int(DETECTION_SIZE * math.sqrt(aspect_ratio)), int(DETECTION_SIZE / math.sqrt(aspect_ratio))
+
+
+def _bbox(detection, width, height):
+    """``[left, top, width, height]`` in pixels of one detection row"""
+    left, top = detection[3] * width, detection[4] * height
+    right, bottom = detection[5] * width, detection[6] * height
+    return [int(left), int(top), int(right - left + 1), int(bottom - top + 1)]
+
+
+class DetectorEngine:
+    def __init__(self, deploy, caffemodel):
+        self.deploy = deploy
+        self.caffemodel = caffemodel
+        self._mean = np.array(MEAN, dtype=np.float32).reshape(3, 1, 1)
+        self._local = threading.local()
+        self._nets_lock = threading.Lock()
+        self.nets = 0
+
+    def _thread_state(self):
+        state = self._local
+        if not hasattr(state, 'net'):
+            state.net = cv2.dnn.readNetFromCaffe(self.deploy, self.caffemodel)
+            state.buffers = {}
+            with self._nets_lock:
+                self.nets += 1
+        return state
+
+    def _blob(self, state, images, size):
+        """(N, 3, h, w) float32 view of this thread's buffer for ``size``, filled with ``images``"""
+        w, h = size
+        buffer = state.buffers.get(size)
+        if buffer is None or len(buffer) < len(images):
+            capacity = 1 << (len(images) - 1).bit_length()
+            buffer = state.buffers[size] = np.empty((capacity, 3, h, w), dtype=np.float32)
+        for i, image in enumerate(images):
+            if image.shape[1] != w or image.shape[0] != h:
+                image = cv2.resize(image, size, interpolation=cv2.INTER_LINEAR)
+            np.subtract(image.transpose(2, 0, 1), self._mean, out=buffer[i])
+        return buffer[:len(images)]
+
+    def forward(self, images):
+        """
+        Raw detections per image: an (K, 7) array of rows
+        ``(image_id, label, confidence, left, top, right, bottom)`` with box
+        coordinates relative to the frame.
+        """
+        state = self._thread_state()
+        groups = {}
+        for index, image in enumerate(images):
+            groups.setdefault(detection_size(image.shape[0], image.shape[1]), []).append(index)
+        results = [None] * len(images)
+        for size, indices in groups.items():
+            state.net.setInput(self._blob(state, [images[i] for i in indices], size), 'data')
+            out = state.net.forward('detection_out').reshape(-1, 7)
+            for position, index in enumerate(indices):
+                # The output is shared and overwritten by the next forward
+                results[index] = out[out[:, 0] == position].copy()
+        return results
+
+    def best_bboxes(self, images):
+        """``[left, top, width, height]`` of the most confident face of each image"""
+        bboxes = []
+        for image, detections in zip(images, self.forward(images)):
+            height, width = image.shape[0], image.shape[1]
+            best = detections[np.argmax(detections[:, 2])] if len(detections) else np.zeros(7)
+            bboxes.append(_bbox(best, width, height))
+        return bboxes
+
+    def detect_faces(self, images, confidence, nms_threshold=NMS_THRESHOLD):
+        """
+        Every face of each image scoring at least ``confidence``, after
+        non-maximum suppression at IoU ``nms_threshold``: a list per image of
+        ``(bbox, score)``, most confident first, bboxes as ``[left, top, width, height]``.
+        """
+        faces = []
+        for image, detections in zip(images, self.forward(images)):
+            height, width = image.shape[0], image.shape[1]
+            detections = detections[detections[:, 2] >= confidence]
+            boxes = [_bbox(detection, width, height) for detection in detections]
+            scores = detections[:, 2].tolist()
+            keep = cv2.dnn.NMSBoxes(boxes, scores, confidence, nms_threshold) if boxes else []
+            keep = sorted(np.asarray(keep).reshape(-1).tolist(), key=lambda i: -scores[i])
+            faces.append([(boxes[i], scores[i]) for i in keep])
+        return faces
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def shared_engine(deploy, caffemodel):
+    """One engine (and so one net per thread) per model for the whole process"""
+    key = (deploy, caffemodel)
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = DetectorEngine(deploy, caffemodel)
+        return _engines[key]
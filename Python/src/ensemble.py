@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# @File : ensemble.py
+"""
+Run the whole anti-spoof ensemble over many faces at once: crops for every
+(face, model) pair are prepared up front, each model sees all faces as one
+batch, and the models run concurrently on a small thread pool (torch releases
+the GIL inside forward). N faces x M models therefore costs M forward passes.
+Works with any registry exposing iteration, ``len`` and ``forward(entry, batch)``
+(ModelRegistry, OnnxModelRegistry), and imports no torch itself.
+
+With ``early_exit_margin`` the members run one after another instead, cheapest
+first, and a face stops as soon as the running mean softmax is confident enough
+(top-1 minus top-2 probability >= margin). Its sum is rescaled to M members so
+scores keep the meaning test() gives them. ``calibrate_margin`` picks the margin
+on labelled data.
+
+With a ``cache`` (liveness_cache.LivenessCache) predict_prepared() looks each
+face up by the hash of its first model input and runs the models only for the
+faces it has not seen in the cache window.
+"""
+
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.generate_patches import CropImage
+from src.liveness_cache import crop_hash
+
+# Cache entries of one executor are not valid for another (other models or weights)
+_cache_namespaces = itertools.count()
+
+
+def to_batch_array(patches):
+    """(N, H, W, C) uint8 patches -> (N, C, H, W) float32, like trans.ToTensor per image"""
+    return np.ascontiguousarray(patches.transpose(0, 3, 1, 2), dtype=np.float32)
+
+
+def softmax_margin(probabilities):
+    """Top-1 minus top-2 probability of each row"""
+    ordered = np.sort(probabilities, axis=1)
+    return ordered[:, -1] - ordered[:, -2]
+
+
+def calibrate_margin(first_probabilities, ensemble_labels, target_agreement=1.0):
+    """
+    Smallest margin at which the cheapest member alone agrees with the full
+    ensemble's label on at least ``target_agreement`` of the faces it would let
+    exit. Returns None when no margin qualifies (never exit early).
+    """
+    margins = softmax_margin(first_probabilities)
+    agrees = np.argmax(first_probabilities, axis=1) == np.asarray(ensemble_labels)
+    best = None
+    for margin in np.unique(margins)[::-1]:
+        if agrees[margins >= margin].mean() < target_agreement:
+            break
+        best = float(margin)
+    return best
+
+
+class EnsembleExecutor:
+    def __init__(self, registry, image_cropper=None, workers=None, early_exit_margin=None, cache=None):
+        self.registry = registry
+        self.image_cropper = image_cropper or CropImage()
+        self.early_exit_margin = early_exit_margin
+        self.cache = cache
+        self._cache_namespace = next(_cache_namespaces)
+        workers = len(registry) if workers is None else workers
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ensemble') \
+            if workers > 1 else None
+        self._members_by_cost = None
+
+    def _stage(self, plans, faces):
+        """
+        (N, H, W, 3) uint8 patches of ``faces`` per ``(scale, out_w, out_h)`` plan.
+        All crop boxes are computed in one vectorised pass and every patch is
+        resized straight into its preallocated batch.
+        """
+        staging = [np.empty((len(faces), out_h, out_w, 3), dtype=np.uint8) for _, out_w, out_h in plans]
+        boxes = self.image_cropper.get_new_boxes(
+            [(image.shape[1], image.shape[0]) for image, _ in faces], [bbox for _, bbox in faces],
+            [1.0 if scale is None else scale for scale, _, _ in plans])
+        for i, (image, bbox) in enumerate(faces):
+            self.image_cropper.crop_many(image, bbox, plans, out=[batch[i] for batch in staging], boxes=boxes[i])
+        return staging
+
+    def prepare_entries(self, entries, faces):
+        """Batched inputs of ``entries`` for ``faces``: one (N, C, H, W) float32 array per entry"""
+        plans = [(entry.spec.scale, entry.spec.w_input, entry.spec.h_input) for entry in entries]
+        return [to_batch_array(batch) for batch in self._stage(plans, faces)]
+
+    def _crop(self, entry, faces):
+        return self.prepare_entries([entry], faces)[0]
+
+    def prepare(self, faces):
+        """Crop every face for every model; returns [(entry, (N, C, H, W) float32 array)]"""
+        entries = list(self.registry)
+        return list(zip(entries, self.prepare_entries(entries, faces)))
+
+    @property
+    def members_by_cost(self):
+        """Registry entries, cheapest single-face forward first (timed once)"""
+        if self._members_by_cost is None:
+            costs = []
+            for entry in self.registry:
+                batch = np.zeros((1, 3, entry.spec.h_input, entry.spec.w_input), dtype=np.float32)
+                timings = []
+                for _ in range(3):
+                    start = time.perf_counter()
+                    self.registry.forward(entry, batch)
+                    timings.append(time.perf_counter() - start)
+                costs.append(min(timings))
+            self._members_by_cost = [entry for _, entry in sorted(
+                zip(costs, self.registry), key=lambda item: item[0])]
+        return self._members_by_cost
+
+    def _gated(self, count, member_input, margin):
+        total = np.zeros((count, 3))
+        used = np.zeros(count, dtype=int)
+        pending = np.arange(count)
+        for entry in self.members_by_cost:
+            total[pending] += self.registry.forward(entry, member_input(entry, pending))
+            used[pending] += 1
+            confident = softmax_margin(total[pending] / used[pending, None]) >= margin
+            pending = pending[~confident]
+            if not len(pending):
+                break
+        return total * (len(self.registry) / np.maximum(used, 1))[:, None], used
+
+    def predict_faces_gated(self, faces, margin):
+        """
+        Early-exit ensemble: returns the summed softmax rescaled to all members,
+        one row per face, and how many members ran for each face.
+        """
+        return self._gated(len(faces), lambda entry, pending: self._crop(entry, [faces[i] for i in pending]),
+                           margin)
+
+    def predict_prepared(self, inputs, use_cache=True):
+        """
+        predict_faces for inputs already built by prepare(). ``use_cache=False``
+        runs the models even when the cache holds the faces (e.g. frames of one
+        burst, which must each give their own evidence).
+        """
+        if not inputs or not len(inputs[0][1]):
+            return np.zeros((0, 3))
+        if not use_cache or self.cache is None or not self.cache.enabled:
+            return self._predict_uncached(inputs)
+        keys = [crop_hash(patch) for patch in inputs[0][1]]
+        outputs = [self.cache.lookup(self._cache_namespace, key) for key in keys]
+        missing = [i for i, row in enumerate(outputs) if row is None]
+        if missing:
+            computed = self._predict_uncached([(entry, batch[missing]) for entry, batch in inputs])
+            for i, row in zip(missing, computed):
+                self.cache.store(self._cache_namespace, keys[i], row)
+                outputs[i] = row
+        return np.array(outputs)
+
+    def _predict_uncached(self, inputs):
+        if self.early_exit_margin is not None:
+            batch_of = {entry.name: batch for entry, batch in inputs}
+            return self._gated(len(inputs[0][1]), lambda entry, pending: batch_of[entry.name][pending],
+                               self.early_exit_margin)[0]
+        if self._pool is None:
+            outputs = [self.registry.forward(entry, batch) for entry, batch in inputs]
+        else:
+            outputs = list(self._pool.map(lambda item: self.registry.forward(*item), inputs))
+        return np.sum(outputs, axis=0)
+
+    def predict_faces(self, faces, use_cache=True):
+        """
+        ``faces`` is a list of ``(image, bbox)``; returns the summed softmax of all
+        models, one row per face (the same sum test() builds for a single face).
+        """
+        if not faces:
+            return np.zeros((0, 3))
+        cached = use_cache and self.cache is not None and self.cache.enabled
+        if self.early_exit_margin is not None and not cached:
+            return self.predict_faces_gated(faces, self.early_exit_margin)[0]
+        return self.predict_prepared(self.prepare(faces), use_cache)
+
+    def predict(self, image, bboxes):
+        return self.predict_faces([(image, bbox) for bbox in bboxes])
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# @File : face_pipeline.py
+"""
+The per-frame path behind /encode, /recognize and every image of their batch
+variants: detection, liveness and features computed from one decoded frame
+(image_ingest.Frame).
+
+``analyze_face`` detects on the frame's BGR array, cuts the patches of every
+anti-spoof model in one crop pass and takes the features from the same face
+in the frame's grayscale, which the pre-check has already shared; no stage
+decodes or converts the image again. The caller decodes the frame and does
+the matching; ``StageTimer`` collects how long each stage took for the response.
+
+``PIPELINE_MODES``: 'fused' runs the models; 'mock' keeps the original
+behaviour (whole-frame features, fixed spoof_score and face_location) for
+setups without the models.
+"""
+
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+from src.simple_features import gray_image_features
+
+PIPELINE_MODES = ('fused', 'mock')
+MOCK_SPOOF_SCORE = 1
+MOCK_FACE_LOCATION = [50, 200, 250, 100]
+
+# bbox: [left, top, width, height]; spoof_score: mean probability of a real face;
+# features: simple_features dict of the face
+FaceAnalysis = namedtuple('FaceAnalysis', ['bbox', 'spoof_score', 'is_real', 'features'])
+
+
+class StageTimer:
+    """Wall time per pipeline stage, in milliseconds, in the order the stages ran"""
+
+    def __init__(self):
+        self.timings = OrderedDict()
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + (time.perf_counter() - start) * 1e3
+
+    def report(self):
+        timings = OrderedDict((name, round(ms, 2)) for name, ms in self.timings.items())
+        timings['total'] = round((time.perf_counter() - self._start) * 1e3, 2)
+        return timings
+
+
+def face_features(frame, bbox):
+    """
+    simple_features of the ``[left, top, width, height]`` box (clamped to the
+    frame) in the frame's grayscale; None when the box is empty.
+    """
+    left, top, width, height = bbox
+    face = frame.gray[max(0, top):max(0, top + height), max(0, left):max(0, left + width)]
+    return gray_image_features(face) if face.size else None
+
+
+def score_face(frame, bbox, predictor, timer, use_cache=True):
+    """
+    Liveness and features of the face at ``bbox`` (from the detector or a
+    tracker): a FaceAnalysis. ``use_cache=False`` bypasses the ensemble's
+    liveness cache.
+    """
+    with timer.stage('crop'):
+        inputs = predictor.ensemble.prepare([(frame.bgr, bbox)])
+    with timer.stage('liveness'):
+        # Summed softmax over the ensemble; class 1 is a real face
+        prediction = predictor.ensemble.predict_prepared(inputs, use_cache)[0] / len(predictor.registry)
+    with timer.stage('features'):
+        features = face_features(frame, bbox)
+    return FaceAnalysis(bbox, float(prediction[1]), int(prediction.argmax()) == 1, features)
+
+
+def analyze_face(frame, predictor, timer, use_cache=True):
+    """
+    Detect the most confident face of ``frame`` and score it with the
+    anti-spoof ensemble of ``predictor`` (an AntiSpoofPredict). Returns a
+    FaceAnalysis, or None when no face is found.
+    """
+    with timer.stage('detect'):
+        bbox = predictor.find_bbox(frame.bgr, frame.gray)
+    if bbox is None:
+        return None
+    return score_face(frame, bbox, predictor, timer, use_cache)
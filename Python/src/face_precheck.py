@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# @File : face_precheck.py
+"""
+Cheap "is anybody there?" checks that run before the RetinaFace DNN.
+
+Kiosk auto-capture sends many frames with nobody in view; a pre-check that
+says no lets ``Detection`` skip the detector (and everything after it).
+Both checks are tuned for recall, since a missed face costs a retry while a
+false alarm costs only the DNN pass that would have run anyway:
+
+* ``CascadePrecheck``: OpenCV's bundled Haar frontal-face cascade on a
+  downscaled grayscale frame, with permissive settings. Stateless.
+* ``MotionPrecheck``: mean absolute difference to the previous frame of one
+  camera, plus a periodic pass so somebody standing still is not missed.
+  Stateful, so use one instance per stream (face_stream.FaceStream, the frame
+  ring consumer); a predictor shared by every request only takes
+  ``SHARED_PRECHECKS``.
+"""
+
+import os
+import threading
+
+import cv2
+import numpy as np
+
+PRECHECKS = ('none', 'cascade', 'motion')
+# Stateless checks, safe to share across cameras and threads
+SHARED_PRECHECKS = ('none', 'cascade')
+CASCADE_FILE = 'haarcascade_frontalface_default.xml'
+
+
+def _gray(image, width):
+    """Grayscale copy of a BGR frame, downscaled to ``width`` pixels wide"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    if gray.shape[1] > width:
+        height = max(1, int(gray.shape[0] * width / gray.shape[1]))
+        gray = cv2.resize(gray, (width, height), interpolation=cv2.INTER_LINEAR)
+    return gray
+
+
+class CascadePrecheck:
+    def __init__(self, width=80, scale_factor=1.1, min_neighbors=1, min_face=0.3,
+                 cascade_path=None):
+        self.width = width
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        # Smallest face to look for, as a fraction of the frame width. Kiosk users
+        # stand close; the cascade's 24 px window sets the floor at this width
+        self.min_face = min_face
+        self.cascade_path = cascade_path or os.path.join(cv2.data.haarcascades, CASCADE_FILE)
+        # Cascades keep scratch buffers; one per thread, like the detector nets
+        self._local = threading.local()
+
+    def _cascade(self):
+        cascade = getattr(self._local, 'cascade', None)
+        if cascade is None:
+            cascade = self._local.cascade = cv2.CascadeClassifier(self.cascade_path)
+            if cascade.empty():
+                raise IOError("could not load face cascade {}".format(self.cascade_path))
+        return cascade
+
+    def __call__(self, image):
+        gray = cv2.equalizeHist(_gray(image, self.width))
+        side = max(24, int(gray.shape[1] * self.min_face))
+        faces = self._cascade().detectMultiScale(gray, scaleFactor=self.scale_factor,
+                                                 minNeighbors=self.min_neighbors, minSize=(side, side))
+        return len(faces) > 0
+
+
+class MotionPrecheck:
+    def __init__(self, threshold=4.0, width=64, refresh=15):
+        # Mean absolute gray-level change that counts as motion
+        self.threshold = threshold
+        self.width = width
+        # Let every refresh-th frame through regardless of motion
+        self.refresh = refresh
+        self._previous = None
+        self._since_pass = 0
+
+    def __call__(self, image):
+        gray = cv2.GaussianBlur(_gray(image, self.width), (3, 3), 0)
+        previous, self._previous = self._previous, gray
+        self._since_pass += 1
+        moved = previous is None or previous.shape != gray.shape or \
+            float(np.mean(cv2.absdiff(gray, previous))) >= self.threshold
+        if moved or self._since_pass >= self.refresh:
+            self._since_pass = 0
+            return True
+        return False
+
+
+def make_precheck(name):
+    """Pre-check for a PRECHECKS name; None for 'none'"""
+    if name not in PRECHECKS:
+        raise ValueError("unknown pre-check {!r}, expected one of {}".format(name, PRECHECKS))
+    if name == 'cascade':
+        return CascadePrecheck()
+    if name == 'motion':
+        return MotionPrecheck()
+    return None
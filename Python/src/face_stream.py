@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+# @File : face_stream.py
+"""
+Per-stream state for continuous recognition (kiosk video).
+
+A ``FaceStream`` follows one face over the frames of a stream instead of
+treating every frame as a new /recognize call:
+
+* tracking: ``FaceTracker`` looks for the face seen at the last detection in
+  a window around its previous position, by normalised cross-correlation
+  (``cv2.matchTemplate``) on a downscaled copy of the frame's grayscale. That
+  is a fraction of a millisecond, against several for the detector DNN.
+* detection runs on the first frame, every ``detect_interval`` frames to
+  re-anchor the track, and whenever the tracker loses the face. While nobody
+  is tracked, an optional per-stream ``precheck`` (face_precheck, e.g. a
+  MotionPrecheck holding this camera's previous frame) can skip it.
+* recognition (liveness, features, matching) runs only while the identity of
+  the track is uncertain: a new face, no confident match yet (retried every
+  ``retry_interval`` frames), or a confident match older than
+  ``reverify_interval`` frames.
+
+Detection and recognition are callbacks into the server, so the stream holds
+no model or gallery state. ``StreamRegistry`` keeps the open streams and drops
+idle ones.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import cv2
+
+TRACK_WIDTH = 160
+# Below this side (in downscaled pixels) a template matches too loosely to track
+MIN_TEMPLATE_SIDE = 8
+
+
+def box_iou(a, b):
+    """Intersection over union of two ``[left, top, width, height]`` boxes"""
+    left, top = max(a[0], b[0]), max(a[1], b[1])
+    right, bottom = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union > 0 else 0.0
+
+
+class FaceTracker:
+    def __init__(self, width=TRACK_WIDTH, search=0.5, min_score=0.6, min_contrast=0.5):
+        # Frames are tracked at this width
+        self.width = width
+        # Search window margin around the last box, as a fraction of its size
+        self.search = search
+        # Lowest correlation that still counts as the same face
+        self.min_score = min_score
+        # Correlation ignores contrast, so a blurred or washed-out frame still
+        # matches; the match must keep this fraction of the template's contrast
+        self.min_contrast = min_contrast
+        self.bbox = None
+        self._template = None
+        self._template_std = 0.0
+        self._box = None
+        self._scale = 1.0
+
+    def _small(self, gray):
+        self._scale = min(1.0, self.width / gray.shape[1])
+        if self._scale == 1.0:
+            return gray
+        size = (self.width, max(1, int(round(gray.shape[0] * self._scale))))
+        # Linear is ~8x cheaper than area here; the aliasing does not hurt the correlation
+        return cv2.resize(gray, size, interpolation=cv2.INTER_LINEAR)
+
+    def start(self, gray, bbox):
+        """Take the face at ``bbox`` (from the detector) as the template; False if too small to track"""
+        small = self._small(gray)
+        x, y = max(0, int(round(bbox[0] * self._scale))), max(0, int(round(bbox[1] * self._scale)))
+        w = min(small.shape[1] - x, int(round(bbox[2] * self._scale)))
+        h = min(small.shape[0] - y, int(round(bbox[3] * self._scale)))
+        self.bbox = list(bbox)
+        if min(w, h) < MIN_TEMPLATE_SIDE:
+            self._template = None
+            return False
+        self._template = small[y:y + h, x:x + w].copy()
+        self._template_std = float(self._template.std())
+        self._box = (x, y, w, h)
+        return True
+
+    def update(self, gray):
+        """``(bbox, score)`` of the face in this frame; bbox is None when the track is lost"""
+        if self._template is None:
+            return None, 0.0
+        small = self._small(gray)
+        x, y, w, h = self._box
+        margin_x, margin_y = int(w * self.search) + 1, int(h * self.search) + 1
+        left, top = max(0, x - margin_x), max(0, y - margin_y)
+        window = small[top:min(small.shape[0], y + h + margin_y), left:min(small.shape[1], x + w + margin_x)]
+        if window.shape[0] < h or window.shape[1] < w:
+            return None, 0.0
+        _, score, _, (dx, dy) = cv2.minMaxLoc(cv2.matchTemplate(window, self._template, cv2.TM_CCOEFF_NORMED))
+        if score < self.min_score or \
+                window[dy:dy + h, dx:dx + w].std() < self.min_contrast * self._template_std:
+            return None, score
+        x, y = left + dx, top + dy
+        self._box = (x, y, w, h)
+        # Position from the small frame, size kept from the detection
+        self.bbox = [int(round(x / self._scale)), int(round(y / self._scale)), self.bbox[2], self.bbox[3]]
+        return self.bbox, score
+
+
+class FaceStream:
+    """
+    ``detect(frame, timer)`` returns the bbox of the main face or None;
+    ``recognize(frame, bbox, timer)`` returns ``(result dict, certain)``, where
+    ``certain`` means the identity needs no further checks. Frames are
+    image_ingest.Frame objects; timers are face_pipeline.StageTimer objects.
+    """
+
+    def __init__(self, detect, recognize, detect_interval=15, retry_interval=5, reverify_interval=90,
+                 same_face_iou=0.3, tracker=None, precheck=None):
+        self.detect = detect
+        self.recognize = recognize
+        self.detect_interval = detect_interval
+        self.retry_interval = retry_interval
+        self.reverify_interval = reverify_interval
+        # A re-detected box overlapping the lost track this much is the same person
+        self.same_face_iou = same_face_iou
+        self.tracker = tracker or FaceTracker()
+        # Owned by this stream: stateful checks must only ever see its frames
+        self.precheck = precheck
+        self.bbox = None
+        self.result = None
+        self.certain = False
+        self.frame_index = 0
+        self._detected_at = None
+        self._recognized_at = None
+        # Reentrant: process() runs inside a caller's claim()
+        self._lock = threading.RLock()
+        # Skips are counted by threads that do not hold the stream
+        self._skip_lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.stats = OrderedDict((key, 0) for key in (
+            'frames', 'skipped', 'prechecked', 'detections', 'tracked', 'lost', 'recognitions'))
+
+    def _forget(self):
+        self.bbox = None
+        self.result = None
+        self.certain = False
+        self._recognized_at = None
+
+    def _locate(self, frame, timer):
+        """Box of the face in this frame and where it came from ('tracker' or 'detector')"""
+        due = self._detected_at is None or self.frame_index - self._detected_at >= self.detect_interval
+        if self.bbox is not None and not due:
+            with timer.stage('track'):
+                bbox, _ = self.tracker.update(frame.gray)
+            if bbox is not None:
+                self.stats['tracked'] += 1
+                return bbox, 'tracker'
+            self.stats['lost'] += 1
+        if self.bbox is None and self.precheck is not None:
+            with timer.stage('precheck'):
+                present = self.precheck(frame.gray)
+            if not present:
+                # Nobody was in view and the pre-check sees no change: skip the detector
+                self.stats['prechecked'] += 1
+                return None, None
+        self.stats['detections'] += 1
+        self._detected_at = self.frame_index
+        bbox = self.detect(frame, timer)
+        if bbox is None:
+            self._forget()
+            return None, None
+        if self.bbox is None or box_iou(bbox, self.bbox) < self.same_face_iou:
+            # Somebody else (or nobody was tracked): their identity is unknown
+            self._forget()
+        with timer.stage('track'):
+            self.tracker.start(frame.gray, bbox)
+        return bbox, 'detector'
+
+    def _recognition_due(self):
+        if self.result is None:
+            return True
+        age = self.frame_index - self._recognized_at
+        return age >= (self.reverify_interval if self.certain else self.retry_interval)
+
+    @contextmanager
+    def claim(self, block=True):
+        """
+        Hold the stream for one frame; yields whether it was obtained. With
+        ``block=False`` a busy stream yields False at once and counts a skip, so
+        the caller can drop a live-video frame before decoding it.
+        """
+        if not self._lock.acquire(blocking=block):
+            with self._skip_lock:
+                self.stats['skipped'] += 1
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self._lock.release()
+
+    def skipped_response(self):
+        return self._response(None, skipped=True)
+
+    def process(self, frame, timer, block=True):
+        """
+        Advance the stream by one frame; returns the per-frame result. With
+        ``block=False`` a frame arriving while the previous one is still being
+        processed is skipped (live video) instead of queued.
+        """
+        with self.claim(block) as claimed:
+            if not claimed:
+                return self.skipped_response()
+            self.last_used = time.monotonic()
+            self.frame_index += 1
+            self.stats['frames'] += 1
+            bbox, source = self._locate(frame, timer)
+            self.bbox = bbox
+            recognized = False
+            if bbox is not None and self._recognition_due():
+                self.result, self.certain = self.recognize(frame, bbox, timer)
+                self._recognized_at = self.frame_index
+                self.stats['recognitions'] += 1
+                recognized = True
+            return self._response(source, recognized=recognized)
+
+    def _response(self, source, recognized=False, skipped=False):
+        body = dict(self.result) if self.result is not None and self.bbox is not None else {
+            "success": False,
+            "message": "No face detected in frame"
+        }
+        body.update({
+            "frame": self.frame_index,
+            "face_location": self.bbox,
+            "source": source,
+            "recognized": recognized,
+            "certain": self.certain
+        })
+        if skipped:
+            body.update({"skipped": True, "message": "Frame skipped: previous frame still processing"})
+        return body
+
+
+class StreamRegistry:
+    """Open streams by id; streams idle for ``idle_seconds`` are closed on the next open"""
+
+    def __init__(self, idle_seconds=60.0, max_streams=64):
+        self.idle_seconds = idle_seconds
+        self.max_streams = max_streams
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        for stream_id in [key for key, stream in self._streams.items() if stream.last_used < cutoff]:
+            del self._streams[stream_id]
+
+    def add(self, stream_id, stream):
+        """Register ``stream``; False when max_streams are open"""
+        with self._lock:
+            self._evict_idle()
+            if len(self._streams) >= self.max_streams:
+                return False
+            self._streams[stream_id] = stream
+            return True
+
+    def get(self, stream_id):
+        with self._lock:
+            return self._streams.get(stream_id)
+
+    def close(self, stream_id):
+        with self._lock:
+            return self._streams.pop(stream_id, None)
+
+    def __len__(self):
+        return len(self._streams)
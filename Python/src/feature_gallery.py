@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# @File : feature_gallery.py
+"""
+Copy-on-write store for enrolled image features shared between request threads.
+
+Readers call ``snapshot()`` and get an immutable mapping that stays consistent
+for as long as they hold it. Writers never touch a published snapshot: they copy
+it, apply their changes and swap the new version in with a single reference
+assignment, so readers never block and never see a half-applied update.
+Concurrent writers are combined, so a burst of enrolments costs one copy.
+"""
+
+import threading
+from collections.abc import Mapping
+
+from src.simple_features import prepare_features
+
+_CLEAR = object()
+
+
+class GallerySnapshot(Mapping):
+    """Read-only view of the gallery at one version. Never mutated once published."""
+
+    __slots__ = ('_features', 'version', '_prepared')
+
+    def __init__(self, features, version):
+        self._features = features
+        self.version = version
+        self._prepared = None
+
+    def __getitem__(self, student_id):
+        return self._features[student_id]
+
+    def __iter__(self):
+        return iter(self._features)
+
+    def __len__(self):
+        return len(self._features)
+
+    def __contains__(self, student_id):
+        return student_id in self._features
+
+    def prepared(self):
+        """
+        Return ``(row_of, PreparedFeatures)`` for the whole snapshot, where
+        ``row_of`` maps student id to row. Built on first use and then shared by
+        every request reading this version.
+        """
+        prepared = self._prepared
+        if prepared is None:
+            # Racing readers may both build it; the results are identical
+            student_ids = list(self._features)
+            prepared = ({student_id: row for row, student_id in enumerate(student_ids)},
+                        prepare_features([self._features[s] for s in student_ids]))
+            self._prepared = prepared
+        return prepared
+
+
+class FeatureGallery:
+    """
+    Holds the current ``GallerySnapshot`` and serialises writers.
+
+    Feature values are stored by reference and must not be mutated after they
+    are handed to the gallery.
+    """
+
+    def __init__(self, features=None):
+        self._snapshot = GallerySnapshot(dict(features or {}), 0)
+        self._write_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = []
+
+    def snapshot(self):
+        """Return the current version. A plain attribute read, so it never blocks."""
+        return self._snapshot
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def put(self, student_id, features):
+        return self.update({student_id: features})
+
+    def update(self, items):
+        """Add or replace many entries; they become visible together."""
+        return self._submit(dict(items))
+
+    def clear(self):
+        return self._submit(_CLEAR)
+
+    def _submit(self, change):
+        with self._pending_lock:
+            self._pending.append(change)
+
+        with self._write_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                # An earlier writer drained and published our change already
+                return self._snapshot
+
+            current = self._snapshot
+            features = dict(current._features)
+            for change in pending:
+                if change is _CLEAR:
+                    features = {}
+                else:
+                    features.update(change)
+            self._snapshot = GallerySnapshot(features, current.version + 1)
+            return self._snapshot
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# @File : frame_ring.py
+"""
+Shared-memory ring of fixed-size BGR frame slots for a capture process and a
+recognizer running on the same kiosk.
+
+The block starts with a small control header followed by the slots:
+
+    header  uint64[16]    magic, slots, height, width, channels,
+                          write_seq (frames committed), latest slot,
+                          pinned slot + 1 (0 = none), read_seq, stop flag
+    seqs    uint64[slots] sequence number of the frame held by each slot,
+                          0 while the writer is filling it
+    stamps  float64[slots] capture time of each slot (time.time())
+    frames  uint8[slots, height, width, channels]
+
+Readers get a NumPy view straight into a slot, so there is no copy and no
+encode/decode. The reader pins the slot it is working on and the writer
+round-robins over the other slots, so a slow recognizer is never overwritten
+mid-frame; it simply skips to the newest frame when it comes back. The pin is
+advisory (the writer may already be past the check when the reader pins), so
+``is_current(seq)`` is still checked after the view has been used.
+"""
+
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+MAGIC = 0x46524D52494E4731  # "FRMRING1"
+HEADER_WORDS = 16
+_SLOTS, _HEIGHT, _WIDTH, _CHANNELS, _WRITE_SEQ, _LATEST, _PINNED, _READ_SEQ, _STOP = range(1, 10)
+
+
+class FrameRing:
+    def __init__(self, shm, owner):
+        self._shm = shm
+        self._owner = owner
+        header = np.ndarray((HEADER_WORDS,), dtype=np.uint64, buffer=shm.buf)
+        if int(header[0]) != MAGIC:
+            raise ValueError("shared memory block {} is not a frame ring".format(shm.name))
+        self.slots = int(header[_SLOTS])
+        self.shape = (int(header[_HEIGHT]), int(header[_WIDTH]), int(header[_CHANNELS]))
+
+        offset = HEADER_WORDS * 8
+        self._header = header
+        self._seqs = np.ndarray((self.slots,), dtype=np.uint64, buffer=shm.buf, offset=offset)
+        offset += self.slots * 8
+        self._stamps = np.ndarray((self.slots,), dtype=np.float64, buffer=shm.buf, offset=offset)
+        offset += self.slots * 8
+        self._frames = np.ndarray((self.slots,) + self.shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+        self._writing = None
+
+    @staticmethod
+    def _size(slots, height, width, channels):
+        return (HEADER_WORDS + 2 * slots) * 8 + slots * height * width * channels
+
+    @classmethod
+    def create(cls, name, slots, height, width, channels=3):
+        if slots < 3:
+            raise ValueError("a frame ring needs at least 3 slots")
+        shm = shared_memory.SharedMemory(name=name, create=True,
+                                         size=cls._size(slots, height, width, channels))
+        header = np.ndarray((HEADER_WORDS,), dtype=np.uint64, buffer=shm.buf)
+        header[:] = 0
+        header[_SLOTS], header[_HEIGHT], header[_WIDTH], header[_CHANNELS] = slots, height, width, channels
+        np.ndarray((2 * slots,), dtype=np.uint64, buffer=shm.buf, offset=HEADER_WORDS * 8)[:] = 0
+        header[0] = MAGIC
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        try:
+            # The creator owns the block; keep the resource tracker from unlinking it at our exit
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:  # Python < 3.13
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    # ---- writer side ----
+
+    def begin_write(self):
+        """Return ``(seq, slot)``; fill ``slot`` in place, then call ``commit(seq)``."""
+        seq = int(self._header[_WRITE_SEQ]) + 1
+        index = (int(self._header[_LATEST]) + 1) % self.slots
+        if index + 1 == int(self._header[_PINNED]):
+            index = (index + 1) % self.slots
+        self._seqs[index] = 0
+        self._writing = index
+        return seq, self._frames[index]
+
+    def commit(self, seq, stamp=None):
+        index = self._writing
+        self._stamps[index] = time.time() if stamp is None else stamp
+        self._seqs[index] = seq
+        self._header[_LATEST] = index
+        self._header[_WRITE_SEQ] = seq
+
+    def write(self, frame):
+        seq, slot = self.begin_write()
+        np.copyto(slot, frame)
+        self.commit(seq)
+        return seq
+
+    # ---- reader side ----
+
+    @property
+    def write_seq(self):
+        return int(self._header[_WRITE_SEQ])
+
+    def latest(self, after_seq=0):
+        """
+        Pin the newest frame newer than ``after_seq`` and return
+        ``(seq, frame_view, stamp)``, or None if there is none yet.
+        """
+        if int(self._header[_WRITE_SEQ]) <= after_seq:
+            return None
+        index = int(self._header[_LATEST])
+        self._header[_PINNED] = index + 1
+        seq = int(self._seqs[index])
+        stamp = float(self._stamps[index])
+        if seq <= after_seq:
+            # Writer moved on between the two reads; try again next poll
+            self._header[_PINNED] = 0
+            return None
+        return seq, self._frames[index], stamp
+
+    def is_current(self, seq):
+        """True while the slot holding ``seq`` has not been reused by the writer."""
+        index = int(self._header[_PINNED]) - 1
+        return index >= 0 and int(self._seqs[index]) == seq
+
+    def mark_read(self, seq):
+        """Release the pinned slot and record progress for the writer side."""
+        self._header[_PINNED] = 0
+        self._header[_READ_SEQ] = seq
+
+    @property
+    def read_seq(self):
+        return int(self._header[_READ_SEQ])
+
+    # ---- control ----
+
+    def request_stop(self):
+        self._header[_STOP] = 1
+
+    @property
+    def stopped(self):
+        return bool(self._header[_STOP])
+
+    def close(self):
+        # Views must go before the buffer can be released
+        del self._header, self._seqs, self._stamps, self._frames
+        self._shm.close()
+        if self._owner:
+            # A reader sharing our resource tracker (a child process on Python < 3.13)
+            # dropped the registration in attach(); unlink() unregisters it again
+            resource_tracker.register(self._shm._name, 'shared_memory')
+            self._shm.unlink()
+
+
+def run_capture(ring, source=0, max_fps=None):
+    """Capture-process loop: decode camera frames straight into ring slots."""
+    import cv2
+
+    capture = cv2.VideoCapture(source)
+    height, width, _ = ring.shape
+    interval = 1.0 / max_fps if max_fps else 0
+    try:
+        while not ring.stopped:
+            start = time.time()
+            seq, slot = ring.begin_write()
+            ok, frame = capture.read(slot)
+            if not ok:
+                break
+            if frame.shape != slot.shape:
+                # Camera resolution differs from the ring geometry
+                cv2.resize(frame, (width, height), dst=slot)
+            elif not np.shares_memory(frame, slot):
+                np.copyto(slot, frame)
+            ring.commit(seq, start)
+            if interval:
+                time.sleep(max(0, interval - (time.time() - start)))
+    finally:
+        capture.release()
+
+
+def consume(ring, process, poll_interval=0.001, stop=None):
+    """
+    Recognizer loop: run ``process(frame_view)`` on the newest frame each time
+    one arrives and yield ``(seq, stamp, result)``. Frames overwritten while
+    being processed are dropped instead of yielding a result from torn pixels.
+    """
+    last_seq = 0
+    while not ring.stopped and not (stop is not None and stop.is_set()):
+        item = ring.latest(last_seq)
+        if item is None:
+            time.sleep(poll_interval)
+            continue
+        seq, frame, stamp = item
+        result = process(frame)
+        current = ring.is_current(seq)
+        ring.mark_read(seq)
+        last_seq = seq
+        if current:
+            yield seq, stamp, result
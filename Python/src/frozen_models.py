@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# @File : frozen_models.py
+"""
+TorchScript export of the anti-spoof models: each BatchNorm-folded MiniFASNet
+is traced at its parsed input size, frozen and cached on disk next to its
+``.pth`` as ``<name>.frozen.pt``, then optimized for inference when loaded.
+The cache is rebuilt when the checkpoint or the torch version changes.
+
+Bundles (model_bundle.py) carry the same frozen archive per model as a blob
+(``dump_frozen``/``load_frozen_bytes``), tagged with the torch version that
+wrote it, so loading one does not trace anything.
+"""
+
+import io
+import json
+import logging
+import os
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+FROZEN_SUFFIX = '.frozen.pt'
+# Name of the frozen archive among a bundle member's blobs
+FROZEN_BLOB = 'torchscript'
+_META_FILE = 'source.json'
+
+
+def frozen_path(model_path):
+    return os.path.splitext(model_path)[0] + FROZEN_SUFFIX
+
+
+def _source_meta(model_path):
+    stat = os.stat(model_path)
+    return {
+        'source': os.path.basename(model_path),
+        'size': stat.st_size,
+        'mtime': int(stat.st_mtime),
+        'torch': torch.__version__,
+    }
+
+
+def freeze(model, h_input, w_input, device):
+    """Trace an eval-mode model at (1, 3, h, w) and freeze it"""
+    example = torch.zeros(1, 3, h_input, w_input, device=device)
+    with torch.no_grad():
+        traced = torch.jit.trace(model.eval(), example)
+    return torch.jit.freeze(traced)
+
+
+def load_frozen(model_path, spec, build_model, device):
+    """
+    Return the frozen, inference-optimized graph for ``model_path``, from the
+    on-disk cache when it is still valid, otherwise built with ``build_model()``
+    and cached. The optimization pass runs after loading because its output
+    (e.g. MKLDNN-packed weights) is specific to the machine and not serializable.
+    """
+    cache_path = frozen_path(model_path)
+    meta = _source_meta(model_path)
+    if os.path.exists(cache_path):
+        extra_files = {_META_FILE: ''}
+        try:
+            frozen = torch.jit.load(cache_path, map_location=device, _extra_files=extra_files)
+            if json.loads(extra_files[_META_FILE] or '{}') == meta:
+                return torch.jit.optimize_for_inference(frozen)
+        except (RuntimeError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable frozen model {cache_path}: {e}")
+
+    frozen = freeze(build_model(), spec.h_input, spec.w_input, device)
+    try:
+        torch.jit.save(frozen, cache_path, _extra_files={_META_FILE: json.dumps(meta)})
+    except OSError as e:
+        logger.warning(f"Could not cache frozen model at {cache_path}: {e}")
+    return torch.jit.optimize_for_inference(frozen)
+
+
+def dump_frozen(frozen):
+    """TorchScript archive of a frozen (not yet optimized) graph, as bytes"""
+    buffer = io.BytesIO()
+    torch.jit.save(frozen, buffer, _extra_files={_META_FILE: json.dumps({'torch': torch.__version__})})
+    return buffer.getvalue()
+
+
+def load_frozen_bytes(data, device):
+    """
+    Inference-optimized graph from ``dump_frozen`` output, or None when it was
+    written by another torch version or cannot be read.
+    """
+    extra_files = {_META_FILE: ''}
+    try:
+        frozen = torch.jit.load(io.BytesIO(data), map_location=device, _extra_files=extra_files)
+    except (RuntimeError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable frozen model: {e}")
+        return None
+    if json.loads(extra_files[_META_FILE] or '{}').get('torch') != torch.__version__:
+        return None
+    return torch.jit.optimize_for_inference(frozen)
+
+
+def warm_up(model, h_input, w_input, device, batch_sizes=(1, 2), runs=3):
+    """
+    Run a few dummy batches so the first request doesn't pay for lazy
+    initialisation (allocator, TorchScript profiling runs for batched shapes).
+    """
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            example = torch.zeros(batch_size, 3, h_input, w_input, device=device)
+            for _ in range(runs):
+                model(example)
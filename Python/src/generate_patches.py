@@ -11,6 +11,10 @@ Create patch from original input image by using bbox coordinate
 import cv2
 import numpy as np
 
+# Below this many (face, scale) boxes the scalar arithmetic of _get_new_box is
+# cheaper than the fixed overhead of the vectorised pass (~45 us)
+VECTORISE_MIN_BOXES = 32
+
 
 class CropImage:
     @staticmethod
@@ -50,6 +54,44 @@ class CropImage:
         return int(left_top_x), int(left_top_y),\
                int(right_bottom_x), int(right_bottom_y)
 
+    @staticmethod
+    def get_new_boxes(src_sizes, bboxes, scales):
+        """
+        _get_new_box for N faces x K scales in one vectorised pass. ``src_sizes``
+        is (N, 2) of (src_w, src_h), ``bboxes`` (N, 4); returns an (N, K, 4) int array.
+        Fewer than VECTORISE_MIN_BOXES boxes are computed one by one instead
+        (N lists of K tuples, the same values).
+        """
+        if len(bboxes) * len(scales) < VECTORISE_MIN_BOXES:
+            return [[CropImage._get_new_box(src_w, src_h, bbox, scale) for scale in scales]
+                    for (src_w, src_h), bbox in zip(src_sizes, bboxes)]
+        src_sizes = np.asarray(src_sizes, dtype=np.float64).reshape(-1, 2, 1)
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4, 1)
+        src_w, src_h = src_sizes[:, 0], src_sizes[:, 1]
+        x, y, box_w, box_h = bboxes[:, 0], bboxes[:, 1], bboxes[:, 2], bboxes[:, 3]
+        scale = np.minimum((src_h-1)/box_h, np.minimum((src_w-1)/box_w, np.asarray(scales, dtype=np.float64)))
+
+        new_width = box_w * scale
+        new_height = box_h * scale
+        center_x, center_y = box_w/2+x, box_h/2+y
+
+        left_top_x = center_x-new_width/2
+        left_top_y = center_y-new_height/2
+        right_bottom_x = center_x+new_width/2
+        right_bottom_y = center_y+new_height/2
+
+        shift = np.minimum(left_top_x, 0)
+        left_top_x, right_bottom_x = left_top_x-shift, right_bottom_x-shift
+        shift = np.minimum(left_top_y, 0)
+        left_top_y, right_bottom_y = left_top_y-shift, right_bottom_y-shift
+
+        shift = np.maximum(right_bottom_x-src_w+1, 0)
+        left_top_x, right_bottom_x = left_top_x-shift, right_bottom_x-shift
+        shift = np.maximum(right_bottom_y-src_h+1, 0)
+        left_top_y, right_bottom_y = left_top_y-shift, right_bottom_y-shift
+
+        return np.trunc(np.stack([left_top_x, left_top_y, right_bottom_x, right_bottom_y], axis=-1)).astype(int)
+
     def crop(self, org_img, bbox, scale, out_w, out_h, crop=True):
 
         if not crop:
@@ -63,3 +105,25 @@ class CropImage:
                           left_top_x: right_bottom_x+1]
             dst_img = cv2.resize(img, (out_w, out_h))
         return dst_img
+
+    def crop_many(self, org_img, bbox, plans, out=None, boxes=None):
+        """
+        The patches of one face for several ``(scale, out_w, out_h)`` plans (scale
+        None resizes the whole frame). ``out`` may give one (out_h, out_w, 3) uint8
+        destination per plan, e.g. rows of preallocated batch buffers, which are
+        written in place. ``boxes`` are the plans' boxes from get_new_boxes when
+        the caller computed them for many faces at once. Returns the patches.
+        """
+        if boxes is None:
+            src_h, src_w = org_img.shape[:2]
+            boxes = self.get_new_boxes([(src_w, src_h)], [bbox],
+                                       [1.0 if scale is None else scale for scale, _, _ in plans])[0]
+        out = [None] * len(plans) if out is None else out
+        for i, ((scale, out_w, out_h), box) in enumerate(zip(plans, boxes)):
+            if scale is None:
+                img = org_img
+            else:
+                left_top_x, left_top_y, right_bottom_x, right_bottom_y = box
+                img = org_img[left_top_y: right_bottom_y+1, left_top_x: right_bottom_x+1]
+            out[i] = cv2.resize(img, (out_w, out_h), dst=out[i])
+        return out
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# @File : hot_reload.py
+"""
+Replace a loaded model set without restarting the server.
+
+``ReloadableModels`` holds the current generation of an expensive object (the
+anti-spoof predictor). Requests ``lease()`` it for the duration of their work;
+``reload()`` builds and warms up the next generation off the request path, then
+swaps it in with a single reference assignment, so new requests move over at
+once while in-flight ones finish on the generation they started with. A retired
+generation is released (``release(value)``) when its last lease ends.
+
+``SourceWatcher`` polls the model files and reloads when they change and have
+been stable for one interval, so a copy in progress is not picked up half-written.
+It also polls an optional sentinel file: ``request_reload()`` reloads in this
+process and touches the sentinel, so the watchers of every other process
+serving the same models (e.g. gunicorn workers) reload too.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+# Files a model directory is loaded from. Caches the loaders write themselves
+# (.frozen.pt, .onnx exports) are left out, or every reload would trigger the next
+SOURCE_SUFFIXES = ('.pth', '.int8.pt')
+
+
+def source_signature(path, suffixes=SOURCE_SUFFIXES):
+    """(name, size, mtime) of a model file (bundle), or of the model files in a directory"""
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return ((os.path.basename(path), stat.st_size, stat.st_mtime_ns),)
+    signature = []
+    for name in sorted(os.listdir(path)):
+        file_path = os.path.join(path, name)
+        if name.endswith(suffixes) and os.path.isfile(file_path):
+            stat = os.stat(file_path)
+            signature.append((name, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+class _Generation:
+    __slots__ = ('value', 'version', 'leases', 'retired', 'loaded_at')
+
+    def __init__(self, value, version):
+        self.value = value
+        self.version = version
+        self.leases = 0
+        self.retired = False
+        self.loaded_at = time.time()
+
+
+class ReloadableModels:
+    """
+    ``load()`` returns a ready (warmed-up) model set; it runs on first use and
+    on every reload. ``release(value)`` frees a retired set once it has drained.
+    """
+
+    def __init__(self, load, release=None, background_nice=10):
+        self._load = load
+        self._release = release
+        # Reloads run at a lower priority so serving threads keep the CPU
+        self.background_nice = background_nice
+        self._current = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._reloading = False
+        self._retired = []
+        self.last_reload = None
+
+    def _ensure_loaded(self):
+        with self._reload_lock:
+            if self._current is None:
+                self._swap(self._load())
+
+    @contextmanager
+    def lease(self):
+        """Yield the current model set; it stays valid (not released) until the block exits"""
+        if self._current is None:
+            self._ensure_loaded()
+        with self._lock:
+            generation = self._current
+            generation.leases += 1
+        try:
+            yield generation.value
+        finally:
+            with self._lock:
+                generation.leases -= 1
+                drained = generation.retired and generation.leases == 0
+            if drained:
+                self._dispose(generation)
+
+    def _swap(self, value):
+        """Publish ``value`` as the next generation; returns seconds new requests were held up"""
+        start = time.perf_counter()
+        with self._lock:
+            previous = self._current
+            self._current = _Generation(value, previous.version + 1 if previous else 1)
+            drained = False
+            if previous is not None:
+                previous.retired = True
+                drained = previous.leases == 0
+                if not drained:
+                    self._retired.append(previous)
+        swap_seconds = time.perf_counter() - start
+        if drained:
+            self._dispose(previous)
+        return swap_seconds
+
+    def _dispose(self, generation):
+        with self._lock:
+            if generation in self._retired:
+                self._retired.remove(generation)
+        logger.info(f"Releasing model generation {generation.version}")
+        if self._release is not None:
+            self._release(generation.value)
+
+    def reload(self):
+        """
+        Load and warm up a new model set in the calling thread and swap it in.
+        Concurrent calls are serialised. On failure the current set keeps serving
+        and the exception propagates. Returns a summary of the reload.
+        """
+        with self._reload_lock:
+            start = time.perf_counter()
+            value = self._load()
+            load_seconds = time.perf_counter() - start
+            swap_seconds = self._swap(value)
+            self.last_reload = {
+                'version': self._current.version,
+                'load_seconds': round(load_seconds, 3),
+                'swap_ms': round(swap_seconds * 1e3, 4),
+                'finished_at': time.time(),
+            }
+            logger.info(f"Model generation {self._current.version} live after {load_seconds:.2f} s")
+            return self.last_reload
+
+    def _background_reload(self):
+        try:
+            if self.background_nice:
+                try:
+                    # On Linux this lowers the priority of this thread only
+                    os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.background_nice)
+                except (AttributeError, OSError):
+                    pass
+            self.reload()
+        except Exception as e:
+            logger.exception("Model reload failed; keeping the current models")
+            self.last_reload = {'error': str(e), 'finished_at': time.time()}
+        finally:
+            self._reloading = False
+
+    def reload_in_background(self):
+        """Start a reload on a worker thread; False if one is already running"""
+        with self._lock:
+            if self._reloading:
+                return False
+            self._reloading = True
+        threading.Thread(target=self._background_reload, name='model-reload', daemon=True).start()
+        return True
+
+    def status(self):
+        with self._lock:
+            current = self._current
+            return {
+                'version': current.version if current else None,
+                'loaded_at': current.loaded_at if current else None,
+                'in_flight': current.leases if current else 0,
+                'draining': [{'version': g.version, 'in_flight': g.leases} for g in self._retired],
+                'reloading': self._reloading,
+                'last_reload': self.last_reload,
+            }
+
+
+class SourceWatcher:
+    """Reload ``models`` in the background whenever the files at ``path`` or the ``sentinel`` file change"""
+
+    def __init__(self, models, path, interval=5.0, sentinel=None):
+        self.models = models
+        self.path = path
+        self.interval = interval
+        self.sentinel = sentinel
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._loaded = None
+
+    def _signature(self):
+        try:
+            signature = source_signature(self.path)
+        except OSError:
+            return None
+        if self.sentinel is not None and os.path.isfile(self.sentinel):
+            signature += source_signature(self.sentinel)
+        return signature
+
+    def _run(self):
+        candidate = self._loaded
+        while not self._stop.wait(self.interval):
+            signature = self._signature()
+            with self._lock:
+                if signature is None or signature == self._loaded:
+                    candidate = signature
+                    continue
+                if signature == candidate:
+                    # Unchanged for a whole interval: the copy is complete
+                    if self.models.reload_in_background():
+                        self._loaded = signature
+                candidate = signature
+
+    def request_reload(self):
+        """Reload here now and touch the sentinel so the other watchers follow; False if already reloading"""
+        with self._lock:
+            if self.sentinel is not None:
+                with open(self.sentinel, 'a'):
+                    os.utime(self.sentinel)
+            # This process reloads now, not again when it sees its own touch
+            self._loaded = self._signature()
+            return self.models.reload_in_background()
+
+    def start(self):
+        self._loaded = self._signature()
+        self._thread = threading.Thread(target=self._run, name='model-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
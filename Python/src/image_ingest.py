@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# @File : image_ingest.py
+"""
+One decode per request, shared by every stage.
+
+``decode_frame`` runs ``cv2.imdecode`` directly on the request buffer (bytes,
+bytearray or memoryview, wrapped with ``np.frombuffer`` so the encoded data is
+not copied) and returns a ``Frame``: the BGR array that detection and the
+anti-spoof crops use, plus a grayscale version computed on first use and then
+shared by the no-face pre-check and feature extraction.
+"""
+
+import binascii
+
+import cv2
+import numpy as np
+
+
+class Frame:
+    """A decoded image: ``bgr`` (H, W, 3) uint8 and, on demand, ``gray`` (H, W) uint8"""
+
+    __slots__ = ('bgr', '_gray')
+
+    def __init__(self, bgr):
+        self.bgr = bgr
+        self._gray = None
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def width(self):
+        return self.bgr.shape[1]
+
+    @property
+    def height(self):
+        return self.bgr.shape[0]
+
+
+def decode_frame(buffer):
+    """Frame of an encoded image (JPEG, PNG, ...) in ``buffer``; None if it cannot be decoded"""
+    data = np.frombuffer(memoryview(buffer), dtype=np.uint8)
+    if data.size == 0:
+        return None
+    bgr = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    return None if bgr is None else Frame(bgr)
+
+
+def base64_buffer(base64_string):
+    """Encoded image bytes of a base64 string, with or without a data URL prefix"""
+    # Skip the "data:image/jpeg;base64," prefix on a view instead of a sliced copy;
+    # a2b_base64 reads the view directly (b64decode would copy it to bytes first)
+    payload = memoryview(base64_string.encode('ascii'))
+    return binascii.a2b_base64(payload[base64_string.find(',') + 1:])
+
+
+def decode_base64_frame(base64_string):
+    """decode_frame of a base64 (data URL) image; None if it is not valid base64 or not an image"""
+    try:
+        return decode_frame(base64_buffer(base64_string))
+    except (binascii.Error, UnicodeEncodeError, ValueError):
+        return None
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# @File : liveness_cache.py
+"""
+Short-lived cache of anti-spoof ensemble outputs, keyed by a perceptual hash
+of the face crop.
+
+Auto-capture retries and double submissions send the same face again within
+seconds; the crop the first model sees (``CropImage`` output, the same pixels
+the ensemble scores) then hashes to nearly the same value and the cached
+softmax is returned instead of running every model again.
+
+``crop_hash`` is a difference hash: the crop is shrunk to ``HASH_SIDE + 1`` x
+``HASH_SIDE`` gray levels and each bit says whether a pixel is brighter than
+its right neighbour, so small shifts, re-encoding and exposure changes move only
+a few of the ``HASH_SIDE ** 2`` bits. Two crops match when at most
+``max_distance`` bits differ and the entry is younger than ``ttl`` seconds.
+
+A hash cannot tell a face from a screen or print showing the same face in the
+same place; the window is kept to seconds for that reason, and gates that
+must score every capture run with ``ttl=0`` (disabled) or bypass the cache per
+call.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+HASH_SIDE = 16
+
+
+def crop_hash(patch):
+    """Difference hash of a (C, H, W) model input or (H, W[, C]) crop, as an int of HASH_SIDE ** 2 bits"""
+    patch = np.asarray(patch, dtype=np.float32)
+    if patch.ndim == 3:
+        # Channels first (model input) or last (crop)
+        patch = patch.mean(axis=0 if patch.shape[0] <= 4 else 2)
+    small = cv2.resize(patch, (HASH_SIDE + 1, HASH_SIDE), interpolation=cv2.INTER_AREA)
+    bits = np.packbits(small[:, 1:] > small[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+def hash_distance(key, other):
+    """Bits that differ between two crop_hash values"""
+    return bin(key ^ other).count('1')
+
+
+class LivenessCache:
+    def __init__(self, ttl=5.0, max_distance=12, capacity=256):
+        # Seconds an output stays reusable; 0 disables the cache
+        self.ttl = ttl
+        # Hamming distance (of HASH_SIDE ** 2 bits) up to which two crops are the same capture
+        self.max_distance = max_distance
+        self.capacity = capacity
+        # (namespace, hash) -> (softmax row, stored at); oldest first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = OrderedDict((key, 0) for key in ('hits', 'misses', 'stores', 'expired', 'evicted'))
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def _expire(self, now):
+        while self._entries:
+            key, (_, stored_at) = next(iter(self._entries.items()))
+            if now - stored_at < self.ttl:
+                break
+            del self._entries[key]
+            self.stats['expired'] += 1
+
+    def lookup(self, namespace, key):
+        """Cached row for a crop hashing to ``key``, or None; ``namespace`` separates model generations"""
+        with self._lock:
+            self._expire(time.monotonic())
+            best, best_distance = None, self.max_distance + 1
+            for (entry_namespace, entry_key), (row, _) in self._entries.items():
+                if entry_namespace != namespace:
+                    continue
+                distance = hash_distance(entry_key, key)
+                if distance < best_distance:
+                    best, best_distance = row, distance
+            self.stats['hits' if best is not None else 'misses'] += 1
+            return best
+
+    def store(self, namespace, key, row):
+        with self._lock:
+            self._entries.pop((namespace, key), None)
+            self._entries[(namespace, key)] = (np.array(row), time.monotonic())
+            self.stats['stores'] += 1
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.stats['evicted'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def status(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(self.stats, enabled=self.enabled, ttl_seconds=self.ttl, max_distance=self.max_distance,
+                        entries=len(self._entries), hit_rate=round(self.stats['hits'] / lookups, 3) if lookups else None)
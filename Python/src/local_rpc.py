@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# @File : local_rpc.py
+"""
+Unix-domain-socket transport for callers on the same host as the face server.
+
+Every message is one frame:
+
+    uint16 code | uint32 header_len | uint32 blob_len | header JSON | blob
+
+all integers big-endian. In a request ``code`` is the operation (see ``OPS``),
+the header carries the same fields as the HTTP JSON body and the blob, when
+present, is the raw encoded image (no base64). In a response ``code`` is the
+HTTP-equivalent status and the header is the JSON body the route would return.
+A connection can carry any number of request/response pairs in sequence and
+is served by its own thread, so callers wanting concurrency open several.
+"""
+
+import errno
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+FRAME = struct.Struct('>HII')
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+OPS = {
+    'encode': 1,
+    'recognize': 2,
+}
+
+
+class RpcError(Exception):
+    pass
+
+
+def _recv_exact(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            if received == 0:
+                return None
+            raise RpcError("connection closed mid-frame")
+        received += n
+    return buf
+
+
+def send_frame(sock, code, header, blob=b''):
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    sock.sendall(FRAME.pack(code, len(header_bytes), len(blob)) + header_bytes)
+    if blob:
+        sock.sendall(blob)
+
+
+def recv_frame(sock):
+    """Return ``(code, header, blob)`` or ``None`` when the peer closed cleanly."""
+    prefix = _recv_exact(sock, FRAME.size)
+    if prefix is None:
+        return None
+    code, header_len, blob_len = FRAME.unpack(prefix)
+    if header_len + blob_len > MAX_FRAME_BYTES:
+        raise RpcError("frame of {} bytes exceeds limit".format(header_len + blob_len))
+    header = json.loads(_recv_exact(sock, header_len)) if header_len else {}
+    blob = _recv_exact(sock, blob_len) if blob_len else b''
+    return code, header, blob
+
+
+def _is_listening(path):
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+class _RpcHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        handlers = self.server.handlers
+        while True:
+            try:
+                frame = recv_frame(self.request)
+            except (RpcError, ValueError, OSError) as e:
+                logger.error(f"❌ Local RPC framing error: {e}")
+                return
+            if frame is None:
+                return
+            op, header, blob = frame
+            handler = handlers.get(op)
+            if handler is None:
+                send_frame(self.request, 404, {"success": False, "message": "Unknown operation"})
+                continue
+            if blob:
+                header['image_bytes'] = blob
+            body, status = handler(header)
+            try:
+                send_frame(self.request, status, body)
+            except OSError as e:
+                # The caller gave up (timed out) and closed its connection
+                logger.warning(f"⚠️ Local RPC caller left before the response: {e}")
+                return
+
+
+def bind_listener(path, backlog=socketserver.UnixStreamServer.request_queue_size):
+    """
+    A Unix stream socket bound to ``path`` and listening. Raises
+    ``OSError(EADDRINUSE)`` when another process is already serving ``path``;
+    a stale socket file is replaced.
+    """
+    if os.path.exists(path):
+        if _is_listening(path):
+            raise OSError(errno.EADDRINUSE, "already served by another process", path)
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(path)
+        os.chmod(path, 0o660)
+        sock.listen(backlog)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class LocalRpcServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, handlers, listener=None):
+        """
+        ``handlers`` maps operation names to ``fn(data) -> (body, status)``.
+        ``listener`` is a socket already listening on ``path`` (``bind_listener``),
+        e.g. bound by a gunicorn master and inherited by every worker, which then
+        all accept on it; without one the server binds ``path`` itself.
+        """
+        self.handlers = {OPS[name]: fn for name, fn in handlers.items()}
+        # A shared listener's file belongs to whoever bound it
+        self._owns_path = listener is None
+        super(LocalRpcServer, self).__init__(path, _RpcHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = listener if listener is not None else bind_listener(path, self.request_queue_size)
+
+    def serve_in_background(self):
+        thread = threading.Thread(target=self.serve_forever, name='local-rpc', daemon=True)
+        thread.start()
+        return thread
+
+    def server_close(self):
+        super(LocalRpcServer, self).server_close()
+        if self._owns_path and os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class LocalRpcClient:
+    """Blocking client keeping one connection open; not thread-safe."""
+
+    def __init__(self, path, timeout=30):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+
+    def call(self, op, header, blob=b''):
+        send_frame(self.sock, OPS[op], header, blob)
+        frame = recv_frame(self.sock)
+        if frame is None:
+            raise RpcError("server closed the connection")
+        status, body, _ = frame
+        return body, status
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# @File : model_bundle.py
+"""
+Single-file container for the anti-spoof ensemble.
+
+Layout (little endian)::
+
+    b'FASBNDL1' | uint64 manifest length | manifest (UTF-8 JSON) | tensor data
+
+The manifest lists every member with its metadata (name, input size, scale,
+model type, kernel) and, per tensor, dtype, shape and byte offset into the data
+section. A member may also carry named opaque blobs (e.g. its frozen
+TorchScript archive), listed by offset and size. Tensors and blobs are stored
+raw and 64-byte aligned, so reading a bundle is one copy-on-write ``mmap``:
+arrays are views into the mapping and pages are only touched when used. This module knows nothing about the models; see
+``model_registry.load_bundle_models`` and ``bundle_models.py``.
+"""
+
+import json
+import os
+import struct
+
+import numpy as np
+
+BUNDLE_MAGIC = b'FASBNDL1'
+BUNDLE_SUFFIX = '.fasb'
+BUNDLE_VERSION = 1
+_HEADER = struct.Struct('<8sQ')
+_ALIGN = 64
+
+
+def _aligned(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def is_bundle(path):
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(BUNDLE_MAGIC)) == BUNDLE_MAGIC
+
+
+def write_bundle(path, members):
+    """
+    ``members`` is a list of ``(metadata dict, {name: array})`` or
+    ``(metadata dict, {name: array}, {name: bytes})``; arrays may be NumPy
+    arrays or CPU tensors, the optional third dict holds the member's blobs.
+    Written to a temporary file and renamed into place, so readers never see a
+    partial bundle.
+    """
+    manifest = {'version': BUNDLE_VERSION, 'models': []}
+    arrays = []
+    offset = 0
+    for member in members:
+        metadata, state_dict = member[:2]
+        tensors = {}
+        for key, value in state_dict.items():
+            array = np.ascontiguousarray(value.numpy() if hasattr(value, 'numpy') else value)
+            offset = _aligned(offset)
+            tensors[key] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            arrays.append((offset, array))
+            offset += array.nbytes
+        blobs = {}
+        for key, value in (member[2] if len(member) > 2 else {}).items():
+            offset = _aligned(offset)
+            blobs[key] = {'offset': offset, 'size': len(value)}
+            arrays.append((offset, np.frombuffer(value, dtype=np.uint8)))
+            offset += len(value)
+        manifest['models'].append(dict(metadata, tensors=tensors, blobs=blobs))
+    data_size = offset
+
+    manifest_bytes = json.dumps(manifest).encode('utf-8')
+    data_start = _aligned(_HEADER.size + len(manifest_bytes))
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(BUNDLE_MAGIC, len(manifest_bytes)))
+        f.write(manifest_bytes)
+        for array_offset, array in arrays:
+            f.seek(data_start + array_offset)
+            f.write(array.tobytes())
+        f.truncate(data_start + data_size)
+    os.replace(tmp_path, path)
+
+
+def read_bundle(path):
+    """
+    Return ``[(metadata dict, {name: array})]``. The arrays are writable views of
+    a private (copy-on-write) mapping of the file, valid as long as they are referenced.
+    ``metadata['blobs']`` maps each blob name to a uint8 view of the same mapping.
+    """
+    with open(path, 'rb') as f:
+        magic, manifest_length = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != BUNDLE_MAGIC:
+            raise ValueError("{} is not a model bundle".format(path))
+        manifest = json.loads(f.read(manifest_length).decode('utf-8'))
+    if manifest.get('version') != BUNDLE_VERSION:
+        raise ValueError("{}: unsupported bundle version {}".format(path, manifest.get('version')))
+
+    data = np.memmap(path, dtype=np.uint8, mode='c')
+    data_start = _aligned(_HEADER.size + manifest_length)
+    members = []
+    for metadata in manifest['models']:
+        tensors = {}
+        for key, info in metadata.pop('tensors').items():
+            dtype = np.dtype(info['dtype'])
+            start = data_start + info['offset']
+            count = int(np.prod(info['shape'], dtype=np.int64))
+            tensors[key] = data[start:start + count * dtype.itemsize].view(dtype).reshape(info['shape'])
+        metadata['blobs'] = {key: data[data_start + info['offset']:data_start + info['offset'] + info['size']]
+                             for key, info in metadata.get('blobs', {}).items()}
+        members.append((metadata, tensors))
+    return members
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# @File : fusion.py
+"""
+Inference preparation for MiniFASNet: fold every BatchNorm into the layer in
+front of it and drop training-only pieces (dropout, the FT branch of
+MultiFTNet). The result computes the same function as the eval-mode model.
+"""
+
+import torch
+from torch.nn import Conv2d, Identity, Linear
+
+from src.model_lib.MiniFASNet import Conv_block, Linear_block, MiniFASNet, SEModule
+from src.model_lib.MultiFTNet import MultiFTNet
+
+
+def _bn_scale_shift(bn):
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    shift = bn.bias - bn.running_mean * scale
+    return scale, shift
+
+
+def fold_conv_bn(conv, bn):
+    """Return a Conv2d with bias equal to ``bn(conv(x))`` in eval mode"""
+    scale, shift = _bn_scale_shift(bn)
+    fused = Conv2d(conv.in_channels, conv.out_channels, kernel_size=conv.kernel_size,
+                   stride=conv.stride, padding=conv.padding, dilation=conv.dilation,
+                   groups=conv.groups, bias=True).to(conv.weight.device)
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(shift)
+    fused.weight.copy_(conv.weight * scale.reshape(-1, 1, 1, 1))
+    fused.bias.copy_(bias * scale + shift)
+    return fused
+
+
+def _fuse_head(model):
+    """Collapse linear -> bn -> dropout -> prob into a single Linear"""
+    scale, shift = _bn_scale_shift(model.bn)
+    prob = model.prob.weight * scale
+    if model.embedding_size != 512:
+        weight = prob @ model.linear.weight
+    else:
+        weight = prob
+    fused = Linear(weight.shape[1], weight.shape[0], bias=True).to(weight.device)
+    fused.weight.copy_(weight)
+    fused.bias.copy_(model.prob.weight @ shift)
+    model.linear = Identity()
+    model.bn = Identity()
+    model.drop = Identity()
+    model.prob = fused
+
+
+def _empty_conv(conv, bn):
+    return Conv2d(conv.in_channels, conv.out_channels, kernel_size=conv.kernel_size,
+                  stride=conv.stride, padding=conv.padding, dilation=conv.dilation,
+                  groups=conv.groups, bias=True, device=conv.weight.device)
+
+
+def _empty_head(model):
+    in_features = model.linear.in_features if model.embedding_size != 512 else model.prob.in_features
+    model.linear = Identity()
+    model.bn = Identity()
+    model.drop = Identity()
+    model.prob = Linear(in_features, model.prob.out_features, bias=True, device=model.prob.weight.device)
+
+
+def _fold(model, fold_conv, fold_head):
+    if isinstance(model, MultiFTNet):
+        # The FT generator only supervises training
+        model = model.model
+    if not isinstance(model, MiniFASNet):
+        raise TypeError("expected a MiniFASNet, got {}".format(type(model).__name__))
+    model.eval()
+
+    for module in model.modules():
+        if isinstance(module, (Conv_block, Linear_block)) and not isinstance(module.bn, Identity):
+            module.conv = fold_conv(module.conv, module.bn)
+            module.bn = Identity()
+        elif isinstance(module, SEModule) and not isinstance(module.bn1, Identity):
+            module.fc1 = fold_conv(module.fc1, module.bn1)
+            module.bn1 = Identity()
+            module.fc2 = fold_conv(module.fc2, module.bn2)
+            module.bn2 = Identity()
+
+    if not isinstance(model.bn, Identity):
+        fold_head(model)
+    return model
+
+
+@torch.no_grad()
+def fuse_model(model):
+    """
+    Fold the BatchNorms of a MiniFASNet (or the classifier of a MultiFTNet) in
+    place and return the inference-only network, set to eval mode.
+    """
+    return _fold(model, fold_conv_bn, _fuse_head)
+
+
+def fused_skeleton(model):
+    """
+    The layer structure ``fuse_model`` produces, without computing any weights:
+    for a network built on the meta device that then loads fused weights.
+    """
+    return _fold(model, _empty_conv, _empty_head)
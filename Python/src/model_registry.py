@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# @File : model_registry.py
+"""
+Load every anti-spoof model of a directory once and serve inference from memory.
+"""
+
+import inspect
+import os
+from collections import OrderedDict
+
+import torch
+
+from src.model_lib.MiniFASNet import MiniFASNetV1, MiniFASNetV2, MiniFASNetV1SE, MiniFASNetV2SE
+from src.model_lib.fusion import fuse_model, fused_skeleton
+from src.frozen_models import FROZEN_BLOB, freeze, load_frozen, load_frozen_bytes, warm_up
+from src.model_bundle import is_bundle, read_bundle
+from src.quantization import load_quantized_model
+from src.utility import ModelSpec, RegisteredModel, get_kernel, parse_model_name
+
+MODEL_MAPPING = {
+    'MiniFASNetV1': MiniFASNetV1,
+    'MiniFASNetV2': MiniFASNetV2,
+    'MiniFASNetV1SE': MiniFASNetV1SE,
+    'MiniFASNetV2SE': MiniFASNetV2SE
+}
+
+def load_state_dict(model_path, device):
+    """
+    torch.load a checkpoint, dropping the ``module.`` prefix left by DataParallel.
+    MultiFTNet training snapshots are reduced to their MiniFASNet: the FT
+    generator only supervises training.
+    """
+    state_dict = torch.load(model_path, map_location=device)
+    first_layer_name = next(iter(state_dict))
+    if first_layer_name.find('module.') >= 0:
+        state_dict = OrderedDict((key[7:], value) for key, value in state_dict.items())
+    if any(key.startswith('FTGenerator.') for key in state_dict):
+        state_dict = OrderedDict((key[len('model.'):], value) for key, value in state_dict.items()
+                                 if key.startswith('model.'))
+    return state_dict
+
+
+def load_model(model_path, device, fuse=False):
+    """
+    Build the network described by the file name and load its weights, in eval
+    mode. ``fuse`` folds the BatchNorms for inference (see model_lib/fusion.py).
+    """
+    model_name = os.path.basename(model_path)
+    spec = ModelSpec(*parse_model_name(model_name))
+    kernel_size = get_kernel(spec.h_input, spec.w_input)
+    model = MODEL_MAPPING[spec.model_type](conv6_kernel=kernel_size).to(device)
+    model.load_state_dict(load_state_dict(model_path, device))
+    model.eval()
+    if fuse:
+        model = fuse_model(model)
+    return RegisteredModel(model_name, spec, kernel_size, model)
+
+
+def load_frozen_model(model_path, device):
+    """Fused model as a frozen TorchScript graph, cached next to the checkpoint"""
+    model_name = os.path.basename(model_path)
+    spec = ModelSpec(*parse_model_name(model_name))
+    frozen = load_frozen(model_path, spec, lambda: load_model(model_path, device, fuse=True).model, device)
+    return RegisteredModel(model_name, spec, get_kernel(spec.h_input, spec.w_input), frozen)
+
+
+def bundle_metadata(entry):
+    """Manifest entry of a model in a bundle (see model_bundle.py)"""
+    return {'name': entry.name, 'model_type': entry.spec.model_type, 'h_input': entry.spec.h_input,
+            'w_input': entry.spec.w_input, 'scale': entry.spec.scale, 'kernel': list(entry.kernel_size)}
+
+
+# torch < 2.1 cannot adopt the mapped arrays and copies them instead
+_CAN_ASSIGN = 'assign' in inspect.signature(torch.nn.Module.load_state_dict).parameters
+
+
+def _bundle_model(spec, kernel_size, tensors, device):
+    state_dict = {key: torch.from_numpy(array) for key, array in tensors.items()}
+    if _CAN_ASSIGN:
+        with torch.device('meta'):
+            model = MODEL_MAPPING[spec.model_type](conv6_kernel=kernel_size)
+        model = fused_skeleton(model)
+        model.load_state_dict(state_dict, assign=True)
+    else:
+        model = fused_skeleton(MODEL_MAPPING[spec.model_type](conv6_kernel=kernel_size))
+        model.load_state_dict(state_dict)
+    return model.to(device).eval()
+
+
+def load_bundle_models(bundle_path, device, frozen=False):
+    """
+    The BatchNorm-folded models of a bundle, in eval mode. Networks are built on
+    the meta device (no allocation, no initialisation) and then adopt the
+    memory-mapped weights, so nothing depends on file names or pickles.
+
+    ``frozen=True`` returns inference-optimized TorchScript graphs instead: the
+    ones stored in the bundle when the running torch wrote them, otherwise
+    traced and frozen from the weights in memory.
+    """
+    entries = []
+    for metadata, tensors in read_bundle(bundle_path):
+        spec = ModelSpec(metadata['h_input'], metadata['w_input'], metadata['model_type'], metadata['scale'])
+        kernel_size = tuple(metadata['kernel'])
+        model = None
+        if frozen and FROZEN_BLOB in metadata['blobs']:
+            model = load_frozen_bytes(metadata['blobs'][FROZEN_BLOB], device)
+        if model is None:
+            model = _bundle_model(spec, kernel_size, tensors, device)
+            if frozen:
+                model = torch.jit.optimize_for_inference(freeze(model, spec.h_input, spec.w_input, device))
+        entries.append(RegisteredModel(metadata['name'], spec, kernel_size, model))
+    return entries
+
+
+# Every anti-spoof backend of AntiSpoofPredict; 'opencv' is served by
+# onnx_models.OnnxModelRegistry, the others by ModelRegistry
+BACKENDS = ('eager', 'torchscript', 'int8', 'opencv')
+
+
+class ModelRegistry:
+    """
+    All ``.pth`` models of ``model_dir``, keyed by their ModelSpec and
+    BatchNorm-folded by default. ``backend='torchscript'`` serves frozen graphs
+    instead of eager modules (always fused), ``backend='int8'`` the quantized
+    artifacts written by quantize.py. Every model is warmed up at load.
+
+    ``model_dir`` may also be a bundle written by bundle_models.py. Its models
+    are always fused; 'eager' loads them straight from the mapping, while
+    'torchscript' loads the frozen graphs stored in the bundle (or freezes
+    them in memory when the bundle has none for this torch version).
+    """
+
+    def __init__(self, model_dir, device, fuse=True, backend='eager', warmup=True):
+        if backend not in BACKENDS or backend == 'opencv':
+            raise ValueError("unknown backend {!r}, expected one of {} ('opencv' models are served by "
+                             "OnnxModelRegistry)".format(backend, BACKENDS[:-1]))
+        if backend == 'int8':
+            # Quantized kernels are CPU-only
+            device = torch.device('cpu')
+        self.model_dir = model_dir
+        self.device = device
+        self.fuse = fuse
+        self.backend = backend
+        self._models = OrderedDict()
+        self._by_name = {}
+        if is_bundle(model_dir):
+            entries = self._load_bundle(model_dir)
+        else:
+            entries = (self._load(os.path.join(model_dir, model_name))
+                       for model_name in sorted(os.listdir(model_dir)) if model_name.endswith('.pth'))
+        for entry in entries:
+            if warmup:
+                warm_up(entry.model, entry.spec.h_input, entry.spec.w_input, device)
+            if entry.spec in self._models:
+                raise ValueError("{} and {} share the spec {}".format(
+                    self._models[entry.spec].name, entry.name, entry.spec))
+            self._models[entry.spec] = entry
+            self._by_name[entry.name] = entry
+
+    def _load(self, model_path):
+        if self.backend == 'torchscript':
+            return load_frozen_model(model_path, self.device)
+        if self.backend == 'int8':
+            return load_quantized_model(model_path)
+        return load_model(model_path, self.device, self.fuse)
+
+    def _load_bundle(self, bundle_path):
+        if self.backend not in ('eager', 'torchscript'):
+            raise ValueError("bundles hold float weights; backend {!r} needs a model directory".format(
+                self.backend))
+        return load_bundle_models(bundle_path, self.device, frozen=self.backend == 'torchscript')
+
+    def __iter__(self):
+        return iter(self._models.values())
+
+    def __len__(self):
+        return len(self._models)
+
+    def __getitem__(self, spec):
+        return self._models[spec]
+
+    def get_by_name(self, model_name):
+        return self._by_name.get(os.path.basename(model_name))
+
+    def forward(self, entry, batch):
+        """Softmax over a (N, C, H, W) batch (array or tensor), as a NumPy array"""
+        if not torch.is_tensor(batch):
+            batch = torch.from_numpy(batch)
+        with torch.no_grad():
+            result = entry.model.forward(batch.to(self.device))
+            return torch.softmax(result, dim=1).cpu().numpy()
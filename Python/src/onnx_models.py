@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# @File : onnx_models.py
+"""
+ONNX export of the anti-spoof models and a torch-free runtime for them.
+
+``export_onnx`` writes each BatchNorm-folded MiniFASNet next to its ``.pth`` as
+``<name>.onnx`` (dynamic batch dimension) and checks OpenCV's output against
+PyTorch before keeping it. ``OnnxModelRegistry`` serves those files through
+``cv2.dnn`` with the same interface as ModelRegistry, so a worker that only
+runs inference never imports torch; torch is imported only to export a missing
+or outdated file.
+"""
+
+import inspect
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from src.utility import ModelSpec, RegisteredModel, get_kernel, parse_model_name
+
+logger = logging.getLogger(__name__)
+
+ONNX_SUFFIX = '.onnx'
+ONNX_OPSET = 13
+PARITY_TOLERANCE = 1e-4
+
+
+def onnx_path(model_path):
+    return os.path.splitext(model_path)[0] + ONNX_SUFFIX
+
+
+def softmax(logits):
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def export_onnx(model_path, tolerance=PARITY_TOLERANCE):
+    """
+    Export the fused model of the ``.pth`` at ``model_path`` and return the ONNX
+    path. Raises ValueError (and removes the file) when OpenCV's logits differ
+    from PyTorch's by more than ``tolerance`` on a random batch.
+    """
+    import torch
+    from src.model_registry import load_model
+
+    entry = load_model(model_path, 'cpu', fuse=True)
+    model = entry.model
+    # Flatten's view(size(0), -1) exports as a Shape/Reshape chain that OpenCV
+    # pins to the traced batch size; nn.Flatten exports as a batch-agnostic op
+    model.conv_6_flatten = torch.nn.Flatten()
+    h_input, w_input = entry.spec.h_input, entry.spec.w_input
+    path = onnx_path(model_path)
+    options = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # Newer torch defaults to the dynamo exporter; keep the TorchScript one
+        options['dynamo'] = False
+    torch.onnx.export(model, torch.zeros(1, 3, h_input, w_input), path,
+                      input_names=['input'], output_names=['logits'],
+                      dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+                      opset_version=ONNX_OPSET, **options)
+
+    batch = torch.rand(4, 3, h_input, w_input) * 255
+    with torch.no_grad():
+        expected = model(batch).numpy()
+    drift = float(np.abs(OnnxModel(path).forward(batch.numpy()) - expected).max())
+    if drift > tolerance:
+        os.remove(path)
+        raise ValueError("{}: ONNX output differs from PyTorch by {:.2e}".format(entry.name, drift))
+    return path
+
+
+class OnnxModel:
+    """
+    One model as cv2.dnn nets. Nets are not thread-safe, so every calling thread
+    gets its own (created on first use from the file read once, like the
+    DetectorEngine nets) and concurrent requests run in parallel.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._buffer = np.frombuffer(f.read(), dtype=np.uint8)
+        self._local = threading.local()
+        self._nets_lock = threading.Lock()
+        self.nets = 0
+
+    def _net(self):
+        net = getattr(self._local, 'net', None)
+        if net is None:
+            net = self._local.net = cv2.dnn.readNetFromONNX(self._buffer)
+            with self._nets_lock:
+                self.nets += 1
+        return net
+
+    def forward(self, batch):
+        """Logits for a (N, C, H, W) float32 batch"""
+        net = self._net()
+        net.setInput(np.ascontiguousarray(batch, dtype=np.float32))
+        # The output blob is reused by the next forward of this thread's net
+        return net.forward().copy()
+
+
+def load_onnx_model(model_path):
+    """
+    Load the ONNX file of ``model_path`` (the ``.pth`` or the ``.onnx`` itself),
+    exporting it first when it is missing or older than the checkpoint.
+    """
+    stem = os.path.splitext(model_path)[0]
+    checkpoint, path = stem + '.pth', stem + ONNX_SUFFIX
+    if os.path.exists(checkpoint) and (not os.path.exists(path)
+                                       or os.path.getmtime(path) < os.path.getmtime(checkpoint)):
+        logger.info(f"Exporting {checkpoint} to ONNX")
+        export_onnx(checkpoint)
+    model_name = os.path.basename(checkpoint)
+    spec = ModelSpec(*parse_model_name(model_name))
+    return RegisteredModel(model_name, spec, get_kernel(spec.h_input, spec.w_input), OnnxModel(path))
+
+
+def warm_up(model, h_input, w_input, batch_sizes=(1, 2)):
+    """One dummy pass per batch size so layer buffers are allocated before the first request"""
+    for batch_size in batch_sizes:
+        model.forward(np.zeros((batch_size, 3, h_input, w_input), dtype=np.float32))
+
+
+class OnnxModelRegistry:
+    """
+    ModelRegistry counterpart running on OpenCV DNN. Takes every model of
+    ``model_dir`` that has a ``.pth`` or an ``.onnx``; entries keep the ``.pth``
+    name so ``get_by_name`` accepts the same paths as before.
+    """
+
+    def __init__(self, model_dir, warmup=True):
+        self.model_dir = model_dir
+        self._models = OrderedDict()
+        self._by_name = {}
+        stems = sorted({os.path.splitext(name)[0] for name in os.listdir(model_dir)
+                        if name.endswith(('.pth', ONNX_SUFFIX))})
+        for stem in stems:
+            entry = load_onnx_model(os.path.join(model_dir, stem + '.pth'))
+            if warmup:
+                warm_up(entry.model, entry.spec.h_input, entry.spec.w_input)
+            if entry.spec in self._models:
+                raise ValueError("{} and {} share the spec {}".format(
+                    self._models[entry.spec].name, entry.name, entry.spec))
+            self._models[entry.spec] = entry
+            self._by_name[entry.name] = entry
+
+    def __iter__(self):
+        return iter(self._models.values())
+
+    def __len__(self):
+        return len(self._models)
+
+    def __getitem__(self, spec):
+        return self._models[spec]
+
+    def get_by_name(self, model_name):
+        return self._by_name.get(os.path.basename(model_name))
+
+    def forward(self, entry, batch):
+        """Softmax over a (N, C, H, W) batch, as a NumPy array"""
+        return softmax(entry.model.forward(batch))
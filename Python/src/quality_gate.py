@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# @File : quality_gate.py
+"""
+Cheap image-quality checks that reject hopeless frames before detection,
+liveness and matching spend on them.
+
+Blurry, dark, overexposed or washed-out captures fail the anti-spoof check
+or the 90% confidence bar anyway, only later and at full cost. ``QualityGate``
+measures the frame on its grayscale (shared with the pre-check and the
+features, see image_ingest.Frame) shrunk by a fixed factor, so sharpness is
+judged at the same pixel scale as the faces whatever the frame size:
+
+* brightness: mean gray level, within ``[min_brightness, max_brightness]``
+* contrast: standard deviation of the gray levels, at least ``min_contrast``
+* sharpness: variance of the Laplacian, at least ``min_sharpness``
+
+and, once the detector has a box, the face size: at least ``min_face``
+pixels on its shorter side (the 64x64 features of a smaller face are mostly
+interpolation) and at most ``max_face`` of the frame (the face runs off the
+edges). The defaults sit just past where the fused pipeline stops accepting
+real captures, so a rejected frame is one it would have turned down anyway.
+
+A failed check is a ``QualityIssue``: the reason (one of
+``QUALITY_REASONS``), the measured value and the limit it missed.
+"""
+
+from collections import namedtuple
+
+import cv2
+
+QUALITY_REASONS = ('too_dark', 'too_bright', 'low_contrast', 'blurry', 'face_too_small', 'face_too_large')
+
+QualityIssue = namedtuple('QualityIssue', ['reason', 'value', 'limit'])
+
+
+class QualityGate:
+    def __init__(self, downscale=3, min_brightness=40, max_brightness=210, min_contrast=15, min_sharpness=20,
+                 min_face=40, max_face=0.95):
+        # Frames are measured at 1/downscale of their size; the sharpness limit assumes it
+        self.downscale = downscale
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.min_contrast = min_contrast
+        self.min_sharpness = min_sharpness
+        # Shorter side of the face box in pixels, and its largest share of the frame
+        self.min_face = min_face
+        self.max_face = max_face
+
+    def measure(self, gray):
+        """``(brightness, contrast, sharpness)`` of a grayscale frame"""
+        if self.downscale > 1:
+            size = (max(1, gray.shape[1] // self.downscale), max(1, gray.shape[0] // self.downscale))
+            # Linear is ~8x cheaper than area here and gives the same blur ranking
+            gray = cv2.resize(gray, size, interpolation=cv2.INTER_LINEAR)
+        mean, std = cv2.meanStdDev(gray)
+        # 16-bit Laplacian: uint8 would clip the negative half of every edge
+        _, laplacian_std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_16S))
+        return float(mean[0, 0]), float(std[0, 0]), float(laplacian_std[0, 0]) ** 2
+
+    def check_frame(self, gray):
+        """QualityIssue of a (H, W) uint8 frame, or None when it is worth detecting on"""
+        brightness, contrast, sharpness = self.measure(gray)
+        # Darkness and low contrast also flatten the Laplacian; report them first
+        if brightness < self.min_brightness:
+            return QualityIssue('too_dark', brightness, self.min_brightness)
+        if brightness > self.max_brightness:
+            return QualityIssue('too_bright', brightness, self.max_brightness)
+        if contrast < self.min_contrast:
+            return QualityIssue('low_contrast', contrast, self.min_contrast)
+        if sharpness < self.min_sharpness:
+            return QualityIssue('blurry', sharpness, self.min_sharpness)
+        return None
+
+    def check_face(self, width, height, bbox):
+        """QualityIssue of the ``[left, top, width, height]`` face in a ``width`` x ``height`` frame, or None"""
+        side = min(bbox[2], bbox[3])
+        if side < self.min_face:
+            return QualityIssue('face_too_small', side, self.min_face)
+        share = max(bbox[2] / width, bbox[3] / height)
+        if share > self.max_face:
+            return QualityIssue('face_too_large', share, self.max_face)
+        return None
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# @File : quantization.py
+"""
+INT8 versions of the anti-spoof models for CPU-only gates.
+
+Two modes, both saved next to the ``.pth`` as a frozen TorchScript
+``<name>.int8.pt`` that ModelRegistry loads with ``backend='int8'``:
+
+* ``dynamic``: the BatchNorm-folded model with its Linear layers quantized
+  (weights int8, activations quantized on the fly). Needs no data.
+* ``static``: post-training quantization of the network (FX graph mode,
+  Conv-BN fused by the quantizer), with activation ranges observed on a
+  calibration image folder. PReLUs stay in float: torch's quantized PReLU
+  kernel is far off on MiniFASNet's per-channel slopes (about 40% relative
+  error after the first block).
+
+The quantized engine the model was packed for is stored in the artifact and
+selected before it is loaded; packed weights are engine-specific.
+"""
+
+import json
+import os
+import zipfile
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.nn import Module, PReLU
+
+from src.ensemble import to_batch_array
+from src.utility import ModelSpec, RegisteredModel, get_kernel, parse_model_name
+
+QUANT_SUFFIX = '.int8.pt'
+MODES = ('dynamic', 'static')
+_META_FILE = 'quantization.json'
+# Fastest first for MiniFASNet's depthwise convolutions on x86 CPUs
+_ENGINE_PREFERENCE = ('onednn', 'x86', 'fbgemm', 'qnnpack')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def quantized_path(model_path):
+    return os.path.splitext(model_path)[0] + QUANT_SUFFIX
+
+
+def default_engine():
+    supported = torch.backends.quantized.supported_engines
+    return next(engine for engine in _ENGINE_PREFERENCE + tuple(supported) if engine in supported)
+
+
+def load_image_folder(folder):
+    """
+    Every image under ``folder`` as ``(path, BGR image, label)``, resized to 3:4
+    as test() does. ``label`` is the name of a ``0``/``1``/``2`` class directory
+    (the training layout; 1 is a real face), None elsewhere.
+    """
+    samples = []
+    for root, _, files in sorted(os.walk(folder)):
+        parent = os.path.basename(root)
+        label = int(parent) if parent.isdigit() else None
+        for file_name in sorted(files):
+            if not file_name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(root, file_name)
+            image = cv2.imread(path)
+            if image is None:
+                continue
+            image = cv2.resize(image, (int(image.shape[0] * 3 / 4), image.shape[0]))
+            samples.append((path, image, label))
+    return samples
+
+
+def model_inputs(samples, spec, detector, image_cropper):
+    """(N, C, H, W) float tensor of the crops ``spec`` sees for each sample"""
+    patches = []
+    for _, image, _ in samples:
+        patches.append(image_cropper.crop(image, detector.get_bbox(image), spec.scale,
+                                          spec.w_input, spec.h_input, crop=spec.scale is not None))
+    return torch.from_numpy(to_batch_array(np.stack(patches)))
+
+
+class FloatPReLU(Module):
+    """PReLU the quantizer leaves alone (see the module docstring)"""
+
+    def __init__(self, prelu):
+        super(FloatPReLU, self).__init__()
+        self.weight = prelu.weight
+
+    def forward(self, x):
+        return F.prelu(x, self.weight)
+
+
+def _float_prelus(module):
+    for name, child in module.named_children():
+        if isinstance(child, PReLU):
+            setattr(module, name, FloatPReLU(child))
+        else:
+            _float_prelus(child)
+    return module
+
+
+@torch.no_grad()
+def quantize_dynamic(model):
+    """Int8 Linear layers for an eval-mode (preferably BatchNorm-folded) model"""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+@torch.no_grad()
+def quantize_static(model, calibration, engine, batch_size=32):
+    """
+    Static PTQ of an eval-mode, unfused model (the quantizer folds Conv-BN itself);
+    ``calibration`` is an (N, C, H, W) tensor of real crops.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.fx.custom_config import PrepareCustomConfig
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    torch.backends.quantized.engine = engine
+    qconfig_mapping = get_default_qconfig_mapping(engine).set_object_type(FloatPReLU, None)
+    custom_config = PrepareCustomConfig().set_non_traceable_module_classes([FloatPReLU])
+    prepared = prepare_fx(_float_prelus(model), qconfig_mapping, (calibration[:1],),
+                          prepare_custom_config=custom_config)
+    for start in range(0, len(calibration), batch_size):
+        prepared(calibration[start:start + batch_size])
+    return convert_fx(prepared)
+
+
+@torch.no_grad()
+def save_quantized(model, model_path, mode, engine):
+    """Trace, freeze and save ``model`` as the INT8 artifact of ``model_path``; returns its path"""
+    spec = ModelSpec(*parse_model_name(os.path.basename(model_path)))
+    torch.backends.quantized.engine = engine
+    example = torch.zeros(1, 3, spec.h_input, spec.w_input)
+    frozen = torch.jit.freeze(torch.jit.trace(model.eval(), example))
+    path = quantized_path(model_path)
+    meta = {'mode': mode, 'engine': engine, 'source': os.path.basename(model_path)}
+    torch.jit.save(frozen, path, _extra_files={_META_FILE: json.dumps(meta)})
+    return path
+
+
+def read_meta(path):
+    """The metadata of an INT8 artifact, read without deserialising the model"""
+    with zipfile.ZipFile(path) as archive:
+        name = next(n for n in archive.namelist() if n.endswith('/extra/' + _META_FILE))
+        return json.loads(archive.read(name))
+
+
+def load_quantized_model(model_path):
+    """
+    RegisteredModel for the INT8 artifact of ``model_path``. Switches the
+    process-wide quantized engine to the one the artifact was packed for.
+    """
+    path = quantized_path(model_path)
+    if not os.path.exists(path):
+        raise FileNotFoundError("{} has no INT8 artifact; create it with quantize.py".format(model_path))
+    torch.backends.quantized.engine = read_meta(path)['engine']
+    model = torch.jit.load(path, map_location='cpu')
+    model_name = os.path.basename(model_path)
+    spec = ModelSpec(*parse_model_name(model_name))
+    return RegisteredModel(model_name, spec, get_kernel(spec.h_input, spec.w_input), model)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# @File : thread_budget.py
+"""
+CPU thread budget for one host.
+
+Left alone, torch and OpenCV size their intra-op pools to every core, so N
+concurrent requests start N x cores compute threads and spend their time
+context switching. A budget splits the cores explicitly:
+
+    workers x request_threads x ensemble_threads x intra-op threads ~= cores
+
+``workers`` is the number of server processes on the host, ``request_threads``
+how many requests one process computes at once (the rest queue),
+``ensemble_threads`` how many anti-spoof models one request runs at once
+(EnsembleExecutor's pool) and ``torch_threads``/``cv2_threads`` the intra-op
+pool sizes. ``extract_processes`` single-threaded worker processes per server
+extract bulk (mock-mode /encode-batch) features next to the request slots.
+Configure it with FACE_WORKERS, FACE_REQUEST_THREADS, FACE_ENSEMBLE_THREADS,
+FACE_TORCH_THREADS, FACE_CV2_THREADS and FACE_EXTRACT_PROCESSES; ``apply()``
+must run at startup, before torch is imported where possible.
+
+A request should hold its slot (``request_slots``) only while it decodes or
+runs models: not while it downloads an image or waits on other pools.
+"""
+
+import os
+import sys
+import threading
+from collections import namedtuple
+
+import cv2
+
+
+def available_cores():
+    """Cores this process may run on (honours taskset/cpusets where supported)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class ThreadBudget(namedtuple('ThreadBudget',
+                              ['cores', 'workers', 'request_threads', 'torch_threads', 'cv2_threads',
+                               'ensemble_threads', 'extract_processes'], defaults=(1, 0))):
+    __slots__ = ()
+
+    @classmethod
+    def from_env(cls, environ=None, cores=None):
+        """
+        Read the FACE_* variables. By default every core serves one request with a
+        single-threaded kernel and its models one after another, which maximises
+        throughput for the small MiniFASNet and detector passes; latency-bound
+        hosts trade request_threads for ensemble or intra-op threads.
+        """
+        environ = os.environ if environ is None else environ
+        cores = cores or available_cores()
+        workers = max(1, int(environ.get('FACE_WORKERS', 1)))
+        per_worker = max(1, cores // workers)
+        request_threads = max(1, int(environ.get('FACE_REQUEST_THREADS', per_worker)))
+        ensemble_threads = max(1, int(environ.get('FACE_ENSEMBLE_THREADS', 1)))
+        intra_op = max(1, per_worker // (request_threads * ensemble_threads))
+        return cls(cores, workers, request_threads,
+                   max(1, int(environ.get('FACE_TORCH_THREADS', intra_op))),
+                   max(1, int(environ.get('FACE_CV2_THREADS', intra_op))),
+                   ensemble_threads,
+                   max(1, int(environ.get('FACE_EXTRACT_PROCESSES', 1))))
+
+    @property
+    def compute_threads(self):
+        """Busy compute threads on the host when every request slot and extract process is in use"""
+        per_request = self.ensemble_threads * max(self.torch_threads, self.cv2_threads)
+        return self.workers * (self.request_threads * per_request + self.extract_processes)
+
+    def single_threaded(self):
+        """This budget with one intra-op thread, for the extract worker processes"""
+        return self._replace(torch_threads=1, cv2_threads=1)
+
+
+def apply(budget):
+    """Size the torch (OpenMP/MKL) and OpenCV pools of this process"""
+    # Read by OpenMP/MKL when torch loads; covers a torch imported after this call
+    os.environ['OMP_NUM_THREADS'] = str(budget.torch_threads)
+    os.environ['MKL_NUM_THREADS'] = str(budget.torch_threads)
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(budget.torch_threads)
+    cv2.setNumThreads(budget.cv2_threads)
+
+
+def request_slots(budget):
+    """Semaphore admitting ``request_threads`` computing requests at a time"""
+    return threading.BoundedSemaphore(budget.request_threads)
+
@@ -5,6 +5,7 @@
 # @File : utility.py
 # @Software : PyCharm
 
+from collections import namedtuple
 from datetime import datetime
 import os
 
@@ -36,6 +37,12 @@ def parse_model_name(model_name):
     return int(h_input), int(w_input), model_type, scale
 
 
+# parse_model_name() metadata; also the key of the model registries
+ModelSpec = namedtuple('ModelSpec', ['h_input', 'w_input', 'model_type', 'scale'])
+
+RegisteredModel = namedtuple('RegisteredModel', ['name', 'spec', 'kernel_size', 'model'])
+
+
 def make_if_not_exist(folder_path):
     if not os.path.exists(folder_path):
         os.makedirs(folder_path)
@@ -5,16 +5,13 @@
 # @File : test.py
 # @Software : PyCharm
 
-import os
 import cv2
 import numpy as np
 import argparse
 import warnings
-import time
 
-from src.anti_spoof_predict import AntiSpoofPredict
-from src.generate_patches import CropImage
-from src.utility import parse_model_name
+# Settings and shared predictors live in src so the servers do not import this script
+from src.anti_spoof_service import get_predictor, predict_liveness
 warnings.filterwarnings('ignore')
 
 
@@ -32,34 +29,14 @@ def check_image(image):
 
 def test(image_name, model_dir, device_id):
 
-    model_test = AntiSpoofPredict(device_id)
-    image_cropper = CropImage()
+    model_test = get_predictor(model_dir, device_id)
     # image = cv2.imread(image_name)
     image=image_name
     image=cv2.resize(image,(int(image.shape[0]*3/4),image.shape[0]))
     result = check_image(image)
     if result is False:
         return
-    image_bbox = model_test.get_bbox(image)
-    prediction = np.zeros((1, 3))
-    test_speed = 0
-    # sum the prediction from single model's result
-    for model_name in os.listdir(model_dir):
-        h_input, w_input, model_type, scale = parse_model_name(model_name)
-        param = {
-            "org_img": image,
-            "bbox": image_bbox,
-            "scale": scale,
-            "out_w": w_input,
-            "out_h": h_input,
-            "crop": True,
-        }
-        if scale is None:
-            param["crop"] = False
-        img = image_cropper.crop(**param)
-        start = time.time()
-        prediction += model_test.predict(img, os.path.join(model_dir, model_name))
-        test_speed += time.time()-start
+    image_bbox, prediction, test_speed = predict_liveness(image, model_test)
 
     # draw result of prediction
     label = np.argmax(prediction)
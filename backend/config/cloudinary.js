@@ -2,6 +2,7 @@
 const cloudinary = require('cloudinary').v2;
 const { CloudinaryStorage } = require('multer-storage-cloudinary');
 const multer = require('multer');
+const { Transform } = require('stream');
 
 // Configure Cloudinary
 cloudinary.config({
@@ -28,8 +29,32 @@ const faceStorage = new CloudinaryStorage({
   },
 });
 
+// Keeps the upload on req.file.buffer as it streams to Cloudinary, so the
+// face server can be sent the bytes over the local socket instead of a URL.
+// The chunks are recorded as they pass through; nothing flows until
+// CloudinaryStorage pipes the stream on.
+const bufferingStorage = (storage) => ({
+  _handleFile(req, file, cb) {
+    const chunks = [];
+    const recorder = new Transform({
+      transform(chunk, encoding, done) {
+        chunks.push(chunk);
+        done(null, chunk);
+      }
+    });
+    file.stream.on('error', (error) => recorder.destroy(error));
+    storage._handleFile(req, { ...file, stream: file.stream.pipe(recorder) }, (error, info) => {
+      if (error) return cb(error);
+      cb(null, { ...info, buffer: Buffer.concat(chunks) });
+    });
+  },
+  _removeFile(req, file, cb) {
+    storage._removeFile(req, file, cb);
+  }
+});
+
 const faceUpload = multer({ 
-  storage: faceStorage,
+  storage: bufferingStorage(faceStorage),
   limits: { fileSize: 5 * 1024 * 1024 }, // 5MB limit
   fileFilter: (req, file, cb) => {
     const allowedTypes = /jpeg|jpg|png/;
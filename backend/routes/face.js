@@ -5,6 +5,7 @@ const User = require('../models/User');
 const FaceEncoding = require('../models/FaceEncoding');
 const { protect } = require('../middleware/auth');
 const { cloudinary, faceUpload } = require('../config/cloudinary');
+const faceRpc = require('../utils/faceRpc');
 
 // @route   POST /api/face/enroll
 // @desc    Enroll face for a student using Cloudinary
@@ -55,6 +56,8 @@ router.post('/enroll', protect, faceUpload.single('image'), async (req, res) =>
 
     // Send image to Python Face Recognition Server for encoding
     const pythonServerUrl = process.env.PYTHON_FACE_SERVER_URL || 'http://localhost:8085';
+    // Optional Unix socket when the Python server runs on the same host
+    const pythonServerSocket = process.env.PYTHON_FACE_SERVER_SOCKET;
     const mockMode = process.env.MOCK_FACE_RECOGNITION === 'true';
 
     try {
@@ -72,17 +75,26 @@ router.post('/enroll', protect, faceUpload.single('image'), async (req, res) =>
         };
       } else {
         // Real Python Face Recognition mode using Cloudinary URL
-        console.log(`🔗 Connecting to Python Face Recognition Server at: ${pythonServerUrl}/encode`);
-        
-        const response = await axios.post(`${pythonServerUrl}/encode`, {
+        const payload = {
           image_url: imageUrl, // Send Cloudinary URL instead of base64
           studentId: user.studentId
-        }, {
-          timeout: 30000, // 30 second timeout
-          headers: {
-            'Content-Type': 'application/json'
-          }
-        });
+        };
+        let response;
+
+        if (pythonServerSocket) {
+          console.log(`🔗 Connecting to Python Face Recognition Server at: ${pythonServerSocket} (encode)`);
+          // The upload bytes go as the frame's blob: no download of the Cloudinary copy
+          const { image_url, ...header } = payload;
+          response = await faceRpc.post(pythonServerSocket, 'encode', header, { timeout: 30000, image: req.file.buffer });
+        } else {
+          console.log(`🔗 Connecting to Python Face Recognition Server at: ${pythonServerUrl}/encode`);
+          response = await axios.post(`${pythonServerUrl}/encode`, payload, {
+            timeout: 30000, // 30 second timeout
+            headers: {
+              'Content-Type': 'application/json'
+            }
+          });
+        }
 
         console.log('✅ Python Face Recognition Server response:', {
           success: response.data.success,
@@ -212,6 +224,8 @@ router.post('/recognize', protect, faceUpload.single('image'), async (req, res)
     const publicId = cloudinaryResult.filename; // Cloudinary public ID
 
     const pythonServerUrl = process.env.PYTHON_FACE_SERVER_URL || 'http://localhost:8085';
+    // Optional Unix socket when the Python server runs on the same host
+    const pythonServerSocket = process.env.PYTHON_FACE_SERVER_SOCKET;
     const mockMode = process.env.MOCK_FACE_RECOGNITION === 'true';
 
     try {
@@ -254,20 +268,29 @@ router.post('/recognize', protect, faceUpload.single('image'), async (req, res)
         }
       } else {
         // Real Python Face Recognition mode using Cloudinary URL
-        console.log(`🔗 Connecting to Python Face Recognition Server at: ${pythonServerUrl}/recognize`);
-
-        const response = await axios.post(`${pythonServerUrl}/recognize`, {
+        const payload = {
           image_url: imageUrl, // Send Cloudinary URL instead of base64
           encodings: faceEncodings.map(fe => ({
             studentId: fe.studentId,
             encoding: fe.encoding
           }))
-        }, {
-          timeout: 30000,
-          headers: {
-            'Content-Type': 'application/json'
-          }
-        });
+        };
+        let response;
+
+        if (pythonServerSocket) {
+          console.log(`🔗 Connecting to Python Face Recognition Server at: ${pythonServerSocket} (recognize)`);
+          // The upload bytes go as the frame's blob: no download of the Cloudinary copy
+          const { image_url, ...header } = payload;
+          response = await faceRpc.post(pythonServerSocket, 'recognize', header, { timeout: 30000, image: req.file.buffer });
+        } else {
+          console.log(`🔗 Connecting to Python Face Recognition Server at: ${pythonServerUrl}/recognize`);
+          response = await axios.post(`${pythonServerUrl}/recognize`, payload, {
+            timeout: 30000,
+            headers: {
+              'Content-Type': 'application/json'
+            }
+          });
+        }
         
         console.log('✅ Python Face Recognition Server response:', {
           success: response.data.success,
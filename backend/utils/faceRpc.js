@@ -0,0 +1,164 @@
+const net = require('net');
+
+// Local transport to the Python face server over a Unix domain socket.
+// Frame: uint16 code | uint32 headerLen | uint32 blobLen | header JSON | blob
+// (big-endian). See Python/src/local_rpc.py for the server side.
+const PREFIX_BYTES = 10;
+
+const OPS = {
+  encode: 1,
+  recognize: 2
+};
+
+const buildFrame = (code, header, blob) => {
+  const headerBytes = Buffer.from(JSON.stringify(header), 'utf8');
+  const body = blob || Buffer.alloc(0);
+  const prefix = Buffer.alloc(PREFIX_BYTES);
+  prefix.writeUInt16BE(code, 0);
+  prefix.writeUInt32BE(headerBytes.length, 2);
+  prefix.writeUInt32BE(body.length, 6);
+  return Buffer.concat([prefix, headerBytes, body]);
+};
+
+// Connections are kept open and pooled per socket path, up to
+// PYTHON_FACE_SERVER_SOCKET_POOL of them. Each carries one request at a time:
+// the server serves every connection on its own thread, so requests on
+// different connections run concurrently, and a timeout only drops the
+// connection of the request that timed out.
+const POOL_SIZE = parseInt(process.env.PYTHON_FACE_SERVER_SOCKET_POOL, 10) || 4;
+
+class FaceRpcConnection {
+  constructor(socketPath, onClose) {
+    this.onClose = onClose;
+    this.request = null;
+    this.closed = false;
+    this.buffer = Buffer.alloc(0);
+    this.socket = net.createConnection(socketPath);
+    this.socket.on('data', (chunk) => this.onData(chunk));
+    this.socket.on('error', (error) => this.close(error));
+    this.socket.on('close', () => this.close(new Error('Face RPC connection closed before a response')));
+  }
+
+  onData(chunk) {
+    this.buffer = this.buffer.length ? Buffer.concat([this.buffer, chunk]) : chunk;
+    if (this.buffer.length < PREFIX_BYTES) return;
+    const headerLength = this.buffer.readUInt32BE(2);
+    const blobLength = this.buffer.readUInt32BE(6);
+    if (this.buffer.length < PREFIX_BYTES + headerLength + blobLength) return;
+
+    const status = this.buffer.readUInt16BE(0);
+    const data = JSON.parse(this.buffer.toString('utf8', PREFIX_BYTES, PREFIX_BYTES + headerLength));
+    this.buffer = Buffer.alloc(0);
+    const { request } = this;
+    this.request = null;
+    if (request) request.settle(status, data);
+  }
+
+  close(error) {
+    if (this.closed) return;
+    this.closed = true;
+    this.socket.destroy();
+    this.onClose(this);
+    const { request } = this;
+    this.request = null;
+    if (request) request.reject(error);
+  }
+
+  call(op, payload, { timeout, image }) {
+    return new Promise((resolve, reject) => {
+      if (this.closed) {
+        reject(new Error('Face RPC connection closed before a response'));
+        return;
+      }
+      const timer = setTimeout(() => {
+        const error = new Error(`Face RPC timeout after ${timeout}ms`);
+        error.code = 'ETIMEDOUT';
+        // A late answer must not reach the next request on this connection
+        this.close(error);
+      }, timeout);
+
+      this.request = {
+        settle: (status, data) => {
+          clearTimeout(timer);
+          if (status >= 200 && status < 300) {
+            resolve({ status, data });
+          } else {
+            const error = new Error(`Face RPC ${op} failed with status ${status}`);
+            error.response = { status, data };
+            reject(error);
+          }
+        },
+        reject: (error) => {
+          clearTimeout(timer);
+          reject(error);
+        }
+      };
+      // Written before the connection is up on a new connection; net queues it
+      this.socket.write(buildFrame(OPS[op], payload, image));
+    });
+  }
+}
+
+class FaceRpcPool {
+  constructor(socketPath, size) {
+    this.socketPath = socketPath;
+    this.size = size;
+    this.connections = new Set();
+    this.idle = [];
+    this.waiting = [];
+  }
+
+  open() {
+    const connection = new FaceRpcConnection(this.socketPath, (closed) => this.discard(closed));
+    this.connections.add(connection);
+    return connection;
+  }
+
+  acquire() {
+    const connection = this.idle.pop();
+    if (connection) return Promise.resolve(connection);
+    if (this.connections.size < this.size) return Promise.resolve(this.open());
+    return new Promise((resolve) => this.waiting.push(resolve));
+  }
+
+  release(connection) {
+    // A closed connection already gave its place away in discard()
+    if (connection.closed) return;
+    const waiter = this.waiting.shift();
+    if (waiter) {
+      waiter(connection);
+    } else {
+      this.idle.push(connection);
+    }
+  }
+
+  discard(connection) {
+    this.connections.delete(connection);
+    const index = this.idle.indexOf(connection);
+    if (index >= 0) this.idle.splice(index, 1);
+    const waiter = this.waiting.shift();
+    if (waiter) waiter(this.open());
+  }
+
+  async post(op, payload, options) {
+    const connection = await this.acquire();
+    try {
+      return await connection.call(op, payload, options);
+    } finally {
+      this.release(connection);
+    }
+  }
+}
+
+const pools = new Map();
+
+// Resolves like axios ({ status, data }) and rejects non-2xx statuses with
+// error.response set, so callers can share their axios error handling.
+// `image` (a Buffer) goes as the raw blob; the server reads it instead of
+// downloading an image_url. The timeout runs from when the request is sent.
+exports.post = (socketPath, op, payload, { timeout = 30000, image } = {}) => {
+  if (!pools.has(socketPath)) {
+    pools.set(socketPath, new FaceRpcPool(socketPath, POOL_SIZE));
+  }
+  return pools.get(socketPath).post(op, payload, { timeout, image });
+};